@@ -1,7 +1,8 @@
 import os
+import click
 from dotenv import load_dotenv
 from app import create_app, db, socketio
-from app.models import User, Category, Product, ProductImage, Order, OrderItem, Review, Newsletter, CartItem, MessageHistory, ChatSession, ChatMessage, ChatNotification
+from app.models import User, Category, Product, ProductImage, Order, OrderItem, Review, Newsletter, CartItem, MessageHistory, ChatSession, ChatMessage, ChatNotification, OrderEvent, OrderStatusCount
 from ssl_config import create_ssl_app
 
 # Load environment variables
@@ -32,6 +33,7 @@ def make_shell_context():
         'ProductImage': ProductImage,
         'Order': Order,
         'OrderItem': OrderItem,
+        'OrderEvent': OrderEvent,
         'Review': Review,
         'Newsletter': Newsletter,
         'CartItem': CartItem,
@@ -47,6 +49,85 @@ def init_db():
     db.create_all()
     print('Database initialized.')
 
+@app.cli.command()
+def rebuild_order_counts():
+    """Recompute the order status counters from the order table."""
+    OrderStatusCount.rebuild()
+    for field in ('status', 'payment_status'):
+        print(f'{field}: {OrderStatusCount.counts(field)}')
+
+@app.cli.command()
+@click.option('--prune', is_flag=True, help='Delete fingerprinted files not in the new manifest.')
+def build_assets(prune):
+    """Fingerprint static CSS/JS and precompress them into static/dist."""
+    from app.assets import build_assets as build
+    manifest = build(app.static_folder, prune=prune)
+    for logical, built in sorted(manifest.items()):
+        print(f'{logical} -> {built}')
+
+@app.cli.command()
+@click.option('--delete', is_flag=True, help='Delete orphaned files (default is report only).')
+@click.option('--batch-size', default=500, show_default=True, help='Orphans deleted per batch.')
+@click.option('--limit', type=int, help='Stop after about this many files; the next run resumes.')
+@click.option('--min-age', default=3600, show_default=True, help='Ignore files newer than this (seconds).')
+@click.option('--restart', is_flag=True, help='Ignore any saved checkpoint and start from the beginning.')
+def gc_uploads(delete, batch_size, limit, min_age, restart):
+    """Find orphaned uploads and image rows whose file is missing."""
+    from app.upload_gc import collect_garbage
+    checkpoint_path = os.path.join(app.instance_path, 'upload_gc.checkpoint')
+    start_after = ''
+    if not restart and os.path.exists(checkpoint_path):
+        with open(checkpoint_path) as f:
+            start_after = f.read().strip()
+        print(f'Resuming after {start_after}')
+
+    summary = collect_garbage(
+        delete=delete, batch_size=batch_size, limit=limit, start_after=start_after, min_age=min_age,
+        on_orphan=lambda key: print(f'orphan  {key}'),
+        on_missing=lambda key, labels: print(f'missing {key} ({", ".join(sorted(labels))})'),
+    )
+    if summary['checkpoint']:
+        os.makedirs(app.instance_path, exist_ok=True)
+        with open(checkpoint_path, 'w') as f:
+            f.write(summary['checkpoint'])
+    elif os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    print(f"Scanned {summary['scanned']} files: {summary['orphans']} orphaned "
+          f"({summary['deleted']} deleted, {summary['skipped_recent']} too recent to judge), "
+          f"{summary['missing']} missing")
+    if summary['checkpoint']:
+        print(f"Stopped at {summary['checkpoint']}; run again to continue")
+
+@app.cli.command()
+@click.option('--days', type=int, help='Only recompute this many most recent days (default: everything).')
+def rollup_sales(days):
+    """Backfill or reconcile the DailySales/DailyProductSales rollups."""
+    from datetime import datetime, timedelta
+    from app.models import DailySales
+    since = datetime.utcnow().date() - timedelta(days=days - 1) if days else None
+    DailySales.rebuild(since=since)
+    print(f"Rebuilt daily sales {'since ' + str(since) if since else 'for all days'}")
+
+@app.cli.command()
+@click.option('--resync', is_flag=True, help='Rebuild the low-stock set from the product table first.')
+def low_stock_digest(resync):
+    """Email admins the products that ran low since the last digest (run from cron)."""
+    from app.inventory import send_digest
+    from app.models import LowStockAlert
+    if resync:
+        product_ids = [product_id for (product_id,) in db.session.query(Product.id).order_by(Product.id)]
+        for start in range(0, len(product_ids), 500):
+            LowStockAlert.sync(product_ids[start:start + 500])
+        db.session.commit()
+        print(f'Resynced low stock alerts for {len(product_ids)} products')
+    print(f'Sent low stock digest for {send_digest()} products')
+
+@app.cli.command()
+def purge_verification_codes():
+    """Delete expired SMS verification codes (run periodically, e.g. from cron)."""
+    from app.auth.verification import purge_expired
+    print(f'Purged {purge_expired()} expired verification codes')
+
 @app.cli.command()
 def create_admin():
     """Create an admin user."""
@@ -10,6 +10,7 @@ from flask_mail import Mail
 from flask_migrate import Migrate
 from flask_socketio import SocketIO
 from flask_wtf.csrf import CSRFProtect
+from werkzeug.middleware.proxy_fix import ProxyFix
 from decimal import ROUND_HALF_UP
 import decimal
 try:
@@ -26,6 +27,21 @@ migrate = Migrate()
 socketio = SocketIO()
 csrf = CSRFProtect()
 
+
+def run_offloaded(func, *args):
+    """Run a CPU-bound call on a native thread so it doesn't block the eventlet/gevent hub.
+
+    Blocks the calling greenlet (or thread, in threading mode) until done.
+    """
+    mode = getattr(socketio, 'async_mode', None)
+    if mode == 'eventlet':
+        from eventlet import tpool  # type: ignore
+        return tpool.execute(func, *args)
+    if mode == 'gevent':
+        import gevent  # type: ignore
+        return gevent.get_hub().threadpool.apply(func, args)
+    return func(*args)
+
 def create_app():
     app = Flask(__name__)
     # Ensure DEBUG is off by default in production unless explicitly enabled
@@ -68,11 +84,80 @@ def create_app():
     except Exception:
         max_mb = 16
     app.config['MAX_CONTENT_LENGTH'] = max_mb * 1024 * 1024  # default 16MB max file size
+    # Where uploads are kept: 'local' (UPLOAD_FOLDER) or 's3' (any S3-compatible endpoint)
+    app.config['STORAGE_BACKEND'] = os.environ.get('STORAGE_BACKEND', 'local')
+    app.config['S3_BUCKET'] = os.environ.get('S3_BUCKET')
+    app.config['S3_ENDPOINT_URL'] = os.environ.get('S3_ENDPOINT_URL')
+    app.config['S3_PREFIX'] = os.environ.get('S3_PREFIX', '')
+    app.config['S3_PUBLIC_URL'] = os.environ.get('S3_PUBLIC_URL')
     
     # SMS Configuration (Twilio)
     app.config['TWILIO_ACCOUNT_SID'] = os.environ.get('TWILIO_ACCOUNT_SID')
     app.config['TWILIO_AUTH_TOKEN'] = os.environ.get('TWILIO_AUTH_TOKEN')
     app.config['TWILIO_PHONE_NUMBER'] = os.environ.get('TWILIO_PHONE_NUMBER')
+    # TextBelt is only used when a key is set; TEXTBELT_API_KEY=textbelt uses the free quota
+    app.config['TEXTBELT_API_KEY'] = os.environ.get('TEXTBELT_API_KEY')
+    app.config['SMS_API_KEY'] = os.environ.get('SMS_API_KEY')
+    app.config['SMS_API_USERNAME'] = os.environ.get('SMS_API_USERNAME')
+    app.config['SMS_API_PASSWORD'] = os.environ.get('SMS_API_PASSWORD')
+    # Provider priority, e.g. "twilio,textbelt" ("fake" records messages without sending).
+    # Defaults to every provider that has credentials configured.
+    app.config['SMS_PROVIDERS'] = os.environ.get('SMS_PROVIDERS')
+    # Take a provider out of rotation for SMS_CIRCUIT_COOLDOWN seconds after this many failures in a row
+    app.config['SMS_CIRCUIT_THRESHOLD'] = int(os.environ.get('SMS_CIRCUIT_THRESHOLD', '3'))
+    app.config['SMS_CIRCUIT_COOLDOWN'] = int(os.environ.get('SMS_CIRCUIT_COOLDOWN', '60'))
+    app.config['SMS_WORKERS'] = int(os.environ.get('SMS_WORKERS', '2'))
+
+    # Seconds a logged-in user's identity stays cached between requests/socket events
+    app.config['USER_CACHE_TTL'] = int(os.environ.get('USER_CACHE_TTL', '30'))
+
+    # Seconds the admin dashboard counters are shared before being recomputed
+    app.config['DASHBOARD_STATS_TTL'] = int(os.environ.get('DASHBOARD_STATS_TTL', '15'))
+
+    # Socket.IO chat messages are group-committed by one writer per process: up to
+    # CHAT_WRITER_BATCH messages, or whatever arrived within CHAT_WRITER_FLUSH_MS.
+    # Senders are turned away when CHAT_WRITER_QUEUE_SIZE messages are waiting.
+    app.config['CHAT_WRITER_QUEUE_SIZE'] = int(os.environ.get('CHAT_WRITER_QUEUE_SIZE', '1000'))
+    app.config['CHAT_WRITER_BATCH'] = int(os.environ.get('CHAT_WRITER_BATCH', '50'))
+    app.config['CHAT_WRITER_FLUSH_MS'] = int(os.environ.get('CHAT_WRITER_FLUSH_MS', '10'))
+
+    # Admins get message activity for sessions they aren't subscribed to as one
+    # coalesced chat_summary event at most every CHAT_SUMMARY_INTERVAL_MS
+    app.config['CHAT_SUMMARY_INTERVAL_MS'] = int(os.environ.get('CHAT_SUMMARY_INTERVAL_MS', '1000'))
+
+    # Typing indicators are relayed at most once per TYPING_WINDOW_MS per typist (the
+    # latest state wins) and withdrawn after TYPING_EXPIRY_MS without a typing event
+    app.config['TYPING_WINDOW_MS'] = int(os.environ.get('TYPING_WINDOW_MS', '1000'))
+    app.config['TYPING_EXPIRY_MS'] = int(os.environ.get('TYPING_EXPIRY_MS', '5000'))
+
+    # Socket handlers read chat session status/agent/customer from a per-process cache,
+    # kept in step across workers over Redis (defaults to the Socket.IO REDIS_URL queue)
+    app.config['CHAT_SESSION_CACHE_TTL'] = int(os.environ.get('CHAT_SESSION_CACHE_TTL', '300'))
+    app.config['CHAT_SESSION_CACHE_SIZE'] = int(os.environ.get('CHAT_SESSION_CACHE_SIZE', '10000'))
+    app.config['CHAT_STATE_REDIS_URL'] = os.environ.get('CHAT_STATE_REDIS_URL') or os.environ.get('REDIS_URL')
+
+    # Rows upserted per transaction by the bulk product import
+    app.config['PRODUCT_IMPORT_BATCH'] = int(os.environ.get('PRODUCT_IMPORT_BATCH', '500'))
+
+    # Password hashing method and cost, e.g. 'scrypt:32768:8:1' or 'pbkdf2:sha256:600000'.
+    # Existing hashes are upgraded transparently on the user's next login.
+    app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+
+    # Login/OTP/SMS throttling. Buckets are shared through Redis when a URL is available;
+    # individual limits can be overridden with e.g. RATELIMIT_LOGIN="10/60" (attempts/seconds).
+    app.config['RATELIMIT_ENABLED'] = os.environ.get('RATELIMIT_ENABLED', 'true').lower() in ['true', 'on', '1']
+    app.config['RATELIMIT_STORAGE_URL'] = os.environ.get('RATELIMIT_STORAGE_URL') or os.environ.get('REDIS_URL')
+    for scope in ('LOGIN', 'PASSWORD_RESET', 'OTP_VERIFY', 'SMS_SEND'):
+        if os.environ.get(f'RATELIMIT_{scope}'):
+            app.config[f'RATELIMIT_{scope}'] = os.environ[f'RATELIMIT_{scope}']
+
+    # Number of proxies in front of the app (the platform router) whose X-Forwarded-For /
+    # X-Forwarded-Proto entries are trusted. Without it every client shares the router's
+    # address and therefore one per-IP rate limit bucket. Set to 0 when serving directly.
+    app.config['PROXY_FIX_HOPS'] = int(os.environ.get('PROXY_FIX_HOPS', '1'))
+    if app.config['PROXY_FIX_HOPS'] > 0:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_HOPS'],
+                                x_proto=app.config['PROXY_FIX_HOPS'])
     
     # Set decimal context for proper rounding
     decimal.getcontext().rounding = ROUND_HALF_UP
@@ -156,8 +241,13 @@ def create_app():
             return None
         return app._local_cache['data'].get(key)
 
+    def cache_delete(key):
+        app._local_cache['data'].pop(key, None)
+        app._local_cache['ttl'].pop(key, None)
+
     app.cache_set = cache_set
     app.cache_get = cache_get
+    app.cache_delete = cache_delete
     
     # Make CSRF token available in templates
     @app.context_processor
@@ -194,6 +284,14 @@ def create_app():
         app.logger.exception('Failed to import chat socket event handlers')
     
     # Google OAuth is now handled directly in auth routes
+
+    # Responsive image helpers for templates (image_src, image_srcset, ...)
+    from app import images
+    images.init_app(app)
+
+    # Fingerprinted, precompressed static assets (asset_url helper; see `flask build-assets`)
+    from app import assets
+    assets.init_app(app)
     
     # Create upload directory if it doesn't exist
     upload_dir = os.path.join(app.instance_path, '..', app.config['UPLOAD_FOLDER'])
@@ -232,4 +330,4 @@ def create_app():
 @login_manager.user_loader
 def load_user(user_id):
     from app.models import User
-    return User.query.get(int(user_id))
+    return User.load_identity(int(user_id))
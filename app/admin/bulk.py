@@ -0,0 +1,90 @@
+"""Bulk admin actions on orders, reviews and users.
+
+Each action is a set-based UPDATE (or DELETE) over the selected ids instead
+of loading and committing rows one by one. Follow-up work is batched too:
+status emails go out from a background task over one SMTP connection,
+product rating aggregates are refreshed with one UPDATE, and caches are
+invalidated once per action.
+"""
+from sqlalchemy.orm import joinedload
+
+from app import db, socketio
+from app.models import USER_IDENTITY_CHANGES, Order, Product, Review, User
+
+# Keeps IN (...) lists well under database parameter limits
+ID_CHUNK = 500
+EMAIL_BATCH = 50
+
+
+def chunks(ids, size=ID_CHUNK):
+    ids = list(ids)
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def update_order_status(order_ids, status, actor_id=None, note=None):
+    """Move orders to ``status``; returns the ids that changed. The caller commits."""
+    changed = []
+    for chunk in chunks(order_ids):
+        changed.extend(Order.bulk_transition(chunk, status, actor_id=actor_id, note=note))
+    return changed
+
+
+def _send_status_emails(app, order_ids):
+    from app.auth.email import send_order_status_update_emails
+
+    with app.app_context():
+        for chunk in chunks(order_ids, EMAIL_BATCH):
+            orders = Order.query.options(joinedload(Order.customer)).filter(Order.id.in_(chunk)).all()
+            try:
+                send_order_status_update_emails(orders)
+            except Exception:
+                app.logger.exception('Failed to send bulk order status emails')
+            db.session.remove()
+
+
+def queue_status_emails(app, order_ids):
+    """Email the customers of ``order_ids`` off the request thread"""
+    if not order_ids:
+        return
+    if app.config.get('BULK_EMAIL_SYNC'):
+        _send_status_emails(app, order_ids)
+    else:
+        socketio.start_background_task(_send_status_emails, app, list(order_ids))
+
+
+def moderate_reviews(review_ids, action):
+    """Approve, reject or delete reviews and refresh the affected products' ratings.
+
+    Returns the number of reviews changed. The caller commits.
+    """
+    count = 0
+    product_ids = set()
+    for chunk in chunks(review_ids):
+        product_ids.update(product_id for (product_id,) in db.session.query(Review.product_id).filter(
+            Review.id.in_(chunk)).distinct())
+        query = Review.query.filter(Review.id.in_(chunk))
+        if action == 'delete':
+            count += query.delete(synchronize_session=False)
+        else:
+            approved = action == 'approve'
+            count += query.filter(Review.is_approved != approved).update(
+                {Review.is_approved: approved}, synchronize_session=False)
+    for chunk in chunks(product_ids):
+        Product.refresh_ratings(chunk)
+    return count
+
+
+def set_users_active(user_ids, active, keep_id=None):
+    """Activate or deactivate users (never ``keep_id``); returns the number changed.
+
+    The caller commits. Bulk UPDATEs skip the ORM events that normally queue
+    cached identities to be dropped on commit, so they are queued here.
+    """
+    user_ids = [user_id for user_id in user_ids if user_id != keep_id]
+    count = 0
+    for chunk in chunks(user_ids):
+        count += User.query.filter(User.id.in_(chunk), User.is_active != active).update(
+            {User.is_active: active}, synchronize_session=False)
+    db.session.info.setdefault(USER_IDENTITY_CHANGES, set()).update(user_ids)
+    return count
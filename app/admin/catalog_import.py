@@ -0,0 +1,328 @@
+"""Bulk catalog import from CSV or JSON Lines.
+
+A file is uploaded once, then a background task streams it row by row,
+validates each row and upserts products by SKU in batches of
+PRODUCT_IMPORT_BATCH rows per transaction. Categories and existing SKUs are
+looked up in dicts built once per job instead of a query per row. Progress
+is kept on a ``ProductImportJob`` row (and pushed to the admins Socket.IO
+room), and rows that can't be imported are written to a CSV error report
+with their line number. The homepage catalog cache is dropped once, when
+the job finishes.
+
+Columns: ``sku`` (required) plus any of ``name``, ``description``, ``price``,
+``compare_price``, ``cost_price``, ``stock_quantity``, ``min_stock_level``,
+``weight``, ``dimensions``, ``category`` (name) or ``category_id``,
+``is_active``, ``is_featured``, ``meta_title`` and ``meta_description``.
+Blank cells leave existing values alone, so a file with just ``sku`` and
+``price`` is a price update. New SKUs need a name, price and category.
+"""
+import csv
+import io
+import json
+import os
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from sqlalchemy import insert, update
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import db, socketio
+from app.models import Category, LowStockAlert, Product, ProductImportJob
+
+EXTENSIONS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}
+REQUIRED_FOR_NEW = ('name', 'price', 'category_id')
+
+
+class RowError(ValueError):
+    """A row that can't be imported; the message goes in the error report"""
+
+
+def _text(max_length=None):
+    def parse(value):
+        value = str(value).strip()
+        if max_length and len(value) > max_length:
+            raise RowError(f'longer than {max_length} characters')
+        return value
+    return parse
+
+
+def _money(value):
+    try:
+        amount = Decimal(str(value).strip())
+    except InvalidOperation:
+        raise RowError('not a number')
+    if amount < 0 or not amount.is_finite():
+        raise RowError('must be zero or more')
+    return amount.quantize(Decimal('0.01'))
+
+
+def _count(value):
+    try:
+        number = int(str(value).strip())
+    except ValueError:
+        raise RowError('not a whole number')
+    if number < 0:
+        raise RowError('must be zero or more')
+    return number
+
+
+def _weight(value):
+    try:
+        number = float(str(value).strip())
+    except ValueError:
+        raise RowError('not a number')
+    if number < 0:
+        raise RowError('must be zero or more')
+    return number
+
+
+def _flag(value):
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in ('1', 'true', 'yes', 'y', 'on'):
+        return True
+    if text in ('0', 'false', 'no', 'n', 'off'):
+        return False
+    raise RowError('expected yes/no')
+
+
+FIELDS = {
+    'name': _text(200),
+    'description': _text(),
+    'price': _money,
+    'compare_price': _money,
+    'cost_price': _money,
+    'stock_quantity': _count,
+    'min_stock_level': _count,
+    'weight': _weight,
+    'dimensions': _text(100),
+    'is_active': _flag,
+    'is_featured': _flag,
+    'meta_title': _text(200),
+    'meta_description': _text(),
+}
+
+
+def import_dir(app):
+    return os.path.join(app.instance_path, 'imports')
+
+
+def error_report_path(app, job_id):
+    return os.path.join(import_dir(app), f'{job_id}-errors.csv')
+
+
+def detect_format(filename):
+    return EXTENSIONS.get(os.path.splitext(filename or '')[1].lower())
+
+
+def read_rows(f, fmt):
+    """Yield ``(line_number, row_dict)`` from a binary file; bad JSON lines yield a RowError"""
+    if fmt == 'csv':
+        text = io.TextIOWrapper(f, encoding='utf-8-sig', newline='')
+        try:
+            reader = csv.DictReader(text)
+            for row in reader:
+                yield reader.line_num, {(k or '').strip().lower(): v for k, v in row.items()}
+        finally:
+            text.detach()  # Leave ``f`` open for the caller's progress reporting
+        return
+    for line_number, line in enumerate(f, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield line_number, RowError('not valid JSON')
+            continue
+        yield line_number, row if isinstance(row, dict) else RowError('expected a JSON object')
+
+
+class CatalogImport:
+    """Validates rows and applies them in batches against lookups built once"""
+
+    def __init__(self):
+        categories = db.session.execute(db.select(Category.id, Category.name)).all()
+        self.category_ids = {category_id for category_id, _ in categories}
+        self.category_names = {name.strip().lower(): category_id for category_id, name in categories}
+        self.skus = dict(db.session.execute(
+            db.select(Product.sku, Product.id).where(Product.sku.isnot(None))).all())
+
+    def parse(self, row):
+        """Return ``(sku, values)`` for one input row or raise RowError"""
+        sku = str(row.get('sku') or '').strip()
+        if not sku:
+            raise RowError('sku is required')
+        if len(sku) > 100:
+            raise RowError('sku: longer than 100 characters')
+
+        values = {}
+        for field, parse in FIELDS.items():
+            value = row.get(field)
+            if value is None or (isinstance(value, str) and not value.strip()):
+                continue
+            try:
+                values[field] = parse(value)
+            except RowError as e:
+                raise RowError(f'{field}: {e}')
+
+        category = row.get('category')
+        category_id = row.get('category_id')
+        if category_id not in (None, ''):
+            try:
+                category_id = int(category_id)
+            except (TypeError, ValueError):
+                raise RowError('category_id: not a whole number')
+            if category_id not in self.category_ids:
+                raise RowError(f'category_id: no category {category_id}')
+            values['category_id'] = category_id
+        elif category not in (None, ''):
+            category_id = self.category_names.get(str(category).strip().lower())
+            if category_id is None:
+                raise RowError(f'category: no category named {category!r}')
+            values['category_id'] = category_id
+        return sku, values
+
+    def apply(self, rows):
+        """Upsert a batch of parsed ``(line_number, sku, values)`` rows.
+
+        Returns ``(created, updated, errors)``; the caller commits.
+        """
+        inserts, updates, errors = {}, {}, []
+        for line_number, sku, values in rows:
+            product_id = self.skus.get(sku)
+            if product_id is not None:
+                updates.setdefault(product_id, {'id': product_id}).update(values)
+            elif sku in inserts:
+                inserts[sku].update(values)
+            else:
+                missing = [field for field in REQUIRED_FOR_NEW if field not in values]
+                if missing:
+                    errors.append((line_number, sku, f"new product needs {', '.join(missing)}"))
+                    continue
+                inserts[sku] = dict(values, sku=sku)
+
+        now = datetime.utcnow()
+        if updates:
+            for values in updates.values():
+                values['updated_at'] = now
+            db.session.execute(update(Product), list(updates.values()))
+        if inserts:
+            for values in inserts.values():
+                values.setdefault('created_at', now)
+                values['updated_at'] = now
+            db.session.execute(insert(Product), list(inserts.values()))
+            self.skus.update(db.session.execute(
+                db.select(Product.sku, Product.id).where(Product.sku.in_(list(inserts)))).all())
+        # Bulk statements skip the ORM hooks that maintain the low-stock set
+        LowStockAlert.sync(list(updates) + [self.skus[sku] for sku in inserts])
+        return len(inserts), len(updates), errors
+
+
+class _ErrorReport:
+    """CSV of rejected rows, created on the first error"""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.writer = None
+
+    def add(self, line_number, sku, message):
+        if self.writer is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.file = open(self.path, 'w', newline='', encoding='utf-8')
+            self.writer = csv.writer(self.file)
+            self.writer.writerow(['line', 'sku', 'error'])
+        self.writer.writerow([line_number, sku, message])
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+def _save_progress(job_id, **values):
+    ProductImportJob.query.filter_by(id=job_id).update(values, synchronize_session=False)
+    db.session.commit()
+    job = db.session.get(ProductImportJob, job_id)
+    socketio.emit('product_import', job.to_dict(), room='admins')
+
+
+def run_import(app, job_id, path, fmt):
+    """Background task: import ``path`` for ``job_id``, then delete the file"""
+    from app.main.routes import invalidate_catalog_cache
+
+    with app.app_context():
+        batch_size = app.config['PRODUCT_IMPORT_BATCH']
+        report = _ErrorReport(error_report_path(app, job_id))
+        counts = {'rows_processed': 0, 'rows_created': 0, 'rows_updated': 0, 'rows_failed': 0}
+        try:
+            _save_progress(job_id, status='running', bytes_total=os.path.getsize(path))
+            catalog = CatalogImport()
+            with open(path, 'rb') as f:
+                batch = []
+
+                def flush():
+                    try:
+                        created, updated, errors = catalog.apply(batch)
+                        db.session.flush()
+                    except SQLAlchemyError as e:
+                        db.session.rollback()
+                        app.logger.exception(f'Product import {job_id}: batch failed')
+                        created, updated = 0, 0
+                        errors = [(line, sku, f'not saved: {e.__class__.__name__}') for line, sku, _ in batch]
+                    for error in errors:
+                        report.add(*error)
+                    counts['rows_processed'] += len(batch)
+                    counts['rows_created'] += created
+                    counts['rows_updated'] += updated
+                    counts['rows_failed'] += len(errors)
+                    _save_progress(job_id, bytes_read=f.tell(), **counts)
+                    batch.clear()
+                    socketio.sleep(0)  # Let other greenlets run between batches
+
+                for line_number, row in read_rows(f, fmt):
+                    try:
+                        if isinstance(row, RowError):
+                            raise row
+                        sku, values = catalog.parse(row)
+                    except RowError as e:
+                        report.add(line_number, (row.get('sku') if isinstance(row, dict) else '') or '', str(e))
+                        counts['rows_processed'] += 1
+                        counts['rows_failed'] += 1
+                        continue
+                    batch.append((line_number, sku, values))
+                    if len(batch) >= batch_size:
+                        flush()
+                flush()
+            _save_progress(job_id, status='done', finished_at=datetime.utcnow(), **counts)
+        except Exception as e:
+            db.session.rollback()
+            app.logger.exception(f'Product import {job_id} failed')
+            _save_progress(job_id, status='failed', error=str(e)[:500], finished_at=datetime.utcnow(), **counts)
+        finally:
+            report.close()
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            invalidate_catalog_cache()
+
+
+def start_import(app, file_storage, user_id=None):
+    """Save an uploaded CSV/JSONL file and queue its import; returns the job"""
+    fmt = detect_format(file_storage.filename)
+    if fmt is None:
+        raise ValueError('Upload a .csv or .jsonl file')
+    job = ProductImportJob(filename=os.path.basename(file_storage.filename)[:255], created_by=user_id)
+    db.session.add(job)
+    db.session.commit()
+
+    os.makedirs(import_dir(app), exist_ok=True)
+    path = os.path.join(import_dir(app), f'{job.id}.{fmt}')
+    file_storage.save(path)
+    if app.config.get('PRODUCT_IMPORT_SYNC'):
+        run_import(app, job.id, path, fmt)
+        db.session.refresh(job)
+    else:
+        socketio.start_background_task(run_import, app, job.id, path, fmt)
+    return job
@@ -50,6 +50,10 @@ class ProductForm(FlaskForm):
             if product is not None:
                 raise ValidationError('Please use a different SKU.')
 
+class ProductImportForm(FlaskForm):
+    file = FileField('Catalog File', validators=[DataRequired(), FileAllowed(['csv', 'jsonl', 'ndjson'], 'CSV or JSON Lines files only!')])
+    submit = SubmitField('Start Import')
+
 class ProductImageForm(FlaskForm):
     image = FileField('Product Image', validators=[DataRequired(), FileAllowed(['jpg', 'png', 'jpeg', 'gif'], 'Images only!')])
     alt_text = StringField('Alt Text', validators=[Optional(), Length(max=200)])
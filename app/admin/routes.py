@@ -1,17 +1,26 @@
 import os
 from datetime import datetime, timedelta
 from decimal import Decimal, ROUND_HALF_UP
-from flask import render_template, redirect, url_for, flash, request, jsonify, current_app, abort
+from flask import render_template, redirect, url_for, flash, request, jsonify, current_app, abort, send_file
 from flask_login import login_required, current_user
-from werkzeug.utils import secure_filename
-from sqlalchemy import func, and_, or_
+from sqlalchemy import func, or_
 from app import db
 from app.admin import bp
+from app.admin.catalog_import import start_import, error_report_path
+from app.admin.exports import export_response
+from app.admin import bulk
+from app.admin.stats import dashboard_stats, invalidate_stats
 from app.admin.forms import (CategoryForm, ProductForm, ProductImageForm, OrderStatusForm, 
-                            UserForm, ReviewModerationForm, BulkActionForm, SearchForm, DateRangeForm)
+                            UserForm, ReviewModerationForm, BulkActionForm, SearchForm, DateRangeForm,
+                            ProductImportForm)
 from app.models import (Category, Product, ProductImage, Order, OrderItem, User, Review,
-                       Newsletter, CartItem, MessageHistory)
+                       Newsletter, CartItem, MessageHistory, OrderStatusCount, ProductImportJob,
+                       DailySales, DailyProductSales, InvalidOrderTransition, ORDER_STATUSES, PAYMENT_STATUSES)
 from app.auth.email import send_order_status_update_email
+from app.main.routes import invalidate_catalog_cache
+from app.images import save_image_upload
+from app.inventory import low_stock_products
+from app.storage import release_upload
 from functools import wraps
 
 def admin_required(f):
@@ -26,79 +35,19 @@ def admin_required(f):
 @login_required
 @admin_required
 def dashboard():
-    # Get dashboard statistics
-    today = datetime.utcnow().date()
-    week_ago = today - timedelta(days=7)
-    month_ago = today - timedelta(days=30)
-    
-    # Sales statistics
-    total_sales = db.session.query(func.sum(Order.total_amount)).filter(
-        Order.payment_status == 'paid'
-    ).scalar() or 0
-    
-    today_sales = db.session.query(func.sum(Order.total_amount)).filter(
-        and_(Order.payment_status == 'paid',
-             func.date(Order.created_at) == today)
-    ).scalar() or 0
-    
-    week_sales = db.session.query(func.sum(Order.total_amount)).filter(
-        and_(Order.payment_status == 'paid',
-             func.date(Order.created_at) >= week_ago)
-    ).scalar() or 0
-    
-    month_sales = db.session.query(func.sum(Order.total_amount)).filter(
-        and_(Order.payment_status == 'paid',
-             func.date(Order.created_at) >= month_ago)
-    ).scalar() or 0
-    
-    # Order statistics
-    total_orders = Order.query.count()
-    pending_orders = Order.query.filter_by(status='pending').count()
-    processing_orders = Order.query.filter_by(status='processing').count()
-    shipped_orders = Order.query.filter_by(status='shipped').count()
-    
-    # Product statistics
-    total_products = Product.query.filter_by(is_active=True).count()
-    low_stock_products = Product.query.filter(
-        and_(Product.is_active == True,
-             Product.stock_quantity <= Product.min_stock_level)
-    ).count()
-    out_of_stock_products = Product.query.filter(
-        and_(Product.is_active == True,
-             Product.stock_quantity == 0)
-    ).count()
-    
-    # User statistics
-    total_users = User.query.filter_by(is_active=True).count()
-    new_users_today = User.query.filter(
-        func.date(User.created_at) == today
-    ).count()
+    # Counters are shared between admins and cached briefly (see app/admin/stats.py)
+    stats = dashboard_stats()
     
     # Recent orders
     recent_orders = Order.query.order_by(Order.created_at.desc()).limit(5).all()
     
-    # Low stock products
-    low_stock_list = Product.query.filter(
-        and_(Product.is_active == True,
-             Product.stock_quantity <= Product.min_stock_level)
-    ).limit(5).all()
+    # Low stock products, from the set kept by app/inventory.py
+    low_stock_list = low_stock_products(limit=5)
     
     return render_template('admin/dashboard.html',
-                         total_sales=float(total_sales),
-                         today_sales=float(today_sales),
-                         week_sales=float(week_sales),
-                         month_sales=float(month_sales),
-                         total_orders=total_orders,
-                         pending_orders=pending_orders,
-                         processing_orders=processing_orders,
-                         shipped_orders=shipped_orders,
-                         total_products=total_products,
-                         low_stock_products=low_stock_products,
-                         out_of_stock_products=out_of_stock_products,
-                         total_users=total_users,
-                         new_users_today=new_users_today,
                          recent_orders=recent_orders,
-                         low_stock_list=low_stock_list)
+                         low_stock_list=low_stock_list,
+                         **stats)
 
 # Category Management
 @bp.route('/categories')
@@ -137,13 +86,7 @@ def add_category():
         
         # Handle image upload
         if form.image.data:
-            filename = secure_filename(form.image.data.filename)
-            timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S_')
-            filename = timestamp + filename
-            image_path = os.path.join(current_app.config['UPLOAD_FOLDER'], 'categories', filename)
-            os.makedirs(os.path.dirname(image_path), exist_ok=True)
-            form.image.data.save(image_path)
-            category.image = f'categories/{filename}'
+            category.image = save_image_upload(form.image.data)
         
         db.session.add(category)
         db.session.commit()
@@ -166,13 +109,8 @@ def edit_category(id):
         
         # Handle image upload
         if form.image.data:
-            filename = secure_filename(form.image.data.filename)
-            timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S_')
-            filename = timestamp + filename
-            image_path = os.path.join(current_app.config['UPLOAD_FOLDER'], 'categories', filename)
-            os.makedirs(os.path.dirname(image_path), exist_ok=True)
-            form.image.data.save(image_path)
-            category.image = f'categories/{filename}'
+            release_upload(category.image)
+            category.image = save_image_upload(form.image.data)
         
         db.session.commit()
         flash('Category updated successfully!', 'success')
@@ -195,6 +133,7 @@ def delete_category(id):
     if category.products:
         flash('Cannot delete category with products. Please move or delete products first.', 'danger')
     else:
+        release_upload(category.image)
         db.session.delete(category)
         db.session.commit()
         flash('Category deleted successfully!', 'success')
@@ -245,6 +184,41 @@ def products():
                          current_category=category_id,
                          current_status=status)
 
+@bp.route('/products/import', methods=['GET', 'POST'])
+@login_required
+@admin_required
+def import_products():
+    form = ProductImportForm()
+    
+    if form.validate_on_submit():
+        try:
+            job = start_import(current_app._get_current_object(), form.file.data, current_user.id)
+        except ValueError as e:
+            flash(str(e), 'danger')
+        else:
+            flash(f'Import of {job.filename} started.', 'success')
+            return redirect(url_for('admin.import_products'))
+    
+    jobs = ProductImportJob.query.order_by(ProductImportJob.id.desc()).limit(10).all()
+    return render_template('admin/product_import.html', form=form, jobs=jobs)
+
+@bp.route('/products/import/<int:id>')
+@login_required
+@admin_required
+def import_status(id):
+    return jsonify(ProductImportJob.query.get_or_404(id).to_dict())
+
+@bp.route('/products/import/<int:id>/errors')
+@login_required
+@admin_required
+def import_errors(id):
+    job = ProductImportJob.query.get_or_404(id)
+    path = error_report_path(current_app, job.id)
+    if not os.path.exists(path):
+        abort(404)
+    return send_file(path, mimetype='text/csv', as_attachment=True,
+                     download_name=f'import-{job.id}-errors.csv')
+
 @bp.route('/product/add', methods=['GET', 'POST'])
 @login_required
 @admin_required
@@ -342,12 +316,7 @@ def add_product_image(product_id):
     form = ProductImageForm()
     
     if form.validate_on_submit():
-        filename = secure_filename(form.image.data.filename)
-        timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S_')
-        filename = timestamp + filename
-        image_path = os.path.join(current_app.config['UPLOAD_FOLDER'], 'products', filename)
-        os.makedirs(os.path.dirname(image_path), exist_ok=True)
-        form.image.data.save(image_path)
+        image_url = save_image_upload(form.image.data)
         
         # Check if this is the first image for the product
         existing_images = ProductImage.query.filter_by(product_id=product_id).count()
@@ -359,7 +328,7 @@ def add_product_image(product_id):
         
         product_image = ProductImage(
             product_id=product_id,
-            image_url=f'products/{filename}',
+            image_url=image_url,
             alt_text=form.alt_text.data,
             is_main=form.is_main.data or is_first_image,  # Set as main if explicitly requested or if it's the first image
             sort_order=form.sort_order.data
@@ -378,11 +347,8 @@ def delete_product_image(image_id):
     image = ProductImage.query.get_or_404(image_id)
     product_id = image.product_id
     
-    # Delete file from filesystem
-    image_path = os.path.join(current_app.config['UPLOAD_FOLDER'], image.image_url)
-    if os.path.exists(image_path):
-        os.remove(image_path)
-    
+    # The file itself is removed after commit once no other row references it
+    release_upload(image.image_url)
     db.session.delete(image)
     db.session.commit()
     flash('Image deleted successfully!', 'success')
@@ -390,30 +356,35 @@ def delete_product_image(image_id):
     return redirect(url_for('admin.edit_product', id=product_id))
 
 # Order Management
-@bp.route('/orders')
-@login_required
-@admin_required
-def orders():
-    page = request.args.get('page', 1, type=int)
-    status = request.args.get('status', '')
-    payment_status = request.args.get('payment_status', '')
-    search = request.args.get('search', '')
-    
-    query = Order.query
+def _order_filters(status, payment_status, search):
+    """Criteria for the order list filters, shared by the list and its export"""
+    criteria = []
     
-    if status:
-        query = query.filter_by(status=status)
+    if status in ORDER_STATUSES:
+        criteria.append(Order.status == status)
     
-    if payment_status:
-        query = query.filter_by(payment_status=payment_status)
+    if payment_status in PAYMENT_STATUSES:
+        criteria.append(Order.payment_status == payment_status)
     
     if search:
-        query = query.filter(or_(
+        criteria.append(or_(
             Order.order_number.contains(search),
             Order.shipping_email.contains(search),
             Order.shipping_first_name.contains(search),
             Order.shipping_last_name.contains(search)
         ))
+    return criteria
+
+@bp.route('/orders')
+@login_required
+@admin_required
+def orders():
+    page = request.args.get('page', 1, type=int)
+    status = request.args.get('status', '')
+    payment_status = request.args.get('payment_status', '')
+    search = request.args.get('search', '')
+    
+    query = Order.query.filter(*_order_filters(status, payment_status, search))
     
     orders = query.order_by(Order.created_at.desc()).paginate(
         page=page, per_page=20, error_out=False)
@@ -427,14 +398,32 @@ def orders():
                          current_status=status,
                          current_payment_status=payment_status)
 
+@bp.route('/orders/export')
+@login_required
+@admin_required
+def export_orders():
+    """Download every order matching the list filters as CSV or JSON"""
+    columns = [Order.order_number, Order.created_at, Order.status, Order.payment_status,
+               Order.payment_method, Order.payment_reference, Order.subtotal, Order.tax_amount,
+               Order.shipping_cost, Order.discount_amount, Order.total_amount,
+               Order.shipping_first_name, Order.shipping_last_name, Order.shipping_email,
+               Order.shipping_phone, Order.shipping_address, Order.shipping_city,
+               Order.shipping_country, Order.shipping_postal_code, Order.shipped_at, Order.delivered_at]
+    criteria = _order_filters(request.args.get('status', ''), request.args.get('payment_status', ''),
+                              request.args.get('search', ''))
+    statement = db.select(*columns).where(*criteria).order_by(Order.id.desc())
+    return export_response(statement, [c.key for c in columns], 'orders',
+                           fmt=request.args.get('format', 'csv'), gzip=request.args.get('gzip') == '1')
+
 @bp.route('/order/<int:id>')
 @login_required
 @admin_required
 def order_detail(id):
     order = Order.query.get_or_404(id)
-    form = OrderStatusForm()
+    form = OrderStatusForm(obj=order)
+    events = order.events.all()
     
-    return render_template('admin/order_detail.html', order=order, form=form)
+    return render_template('admin/order_detail.html', order=order, form=form, events=events)
 
 @bp.route('/order/<int:id>/update_status', methods=['POST'])
 @login_required
@@ -445,15 +434,14 @@ def update_order_status(id):
     
     if form.validate_on_submit():
         old_status = order.status
-        order.status = form.status.data
-        order.payment_status = form.payment_status.data
-        order.updated_at = datetime.utcnow()
-        
-        # Set timestamps for status changes
-        if form.status.data == 'shipped' and old_status != 'shipped':
-            order.shipped_at = datetime.utcnow()
-        elif form.status.data == 'delivered' and old_status != 'delivered':
-            order.delivered_at = datetime.utcnow()
+        try:
+            order.transition(status=form.status.data,
+                             payment_status=form.payment_status.data,
+                             actor_id=current_user.id)
+        except InvalidOrderTransition as e:
+            db.session.rollback()
+            flash(str(e), 'danger')
+            return redirect(url_for('admin.order_detail', id=id))
         
         db.session.commit()
         
@@ -465,19 +453,44 @@ def update_order_status(id):
     
     return redirect(url_for('admin.order_detail', id=id))
 
-# User Management
-@bp.route('/users')
+def _selected_ids(model, criteria):
+    """Ids ticked on a list page, or every row matching its filters when asked"""
+    if request.form.get('all_matching') == '1':
+        return [row_id for (row_id,) in db.session.query(model.id).filter(*criteria)]
+    return request.form.getlist('ids', type=int)
+
+@bp.route('/orders/bulk_status', methods=['POST'])
 @login_required
 @admin_required
-def users():
-    page = request.args.get('page', 1, type=int)
-    search = request.args.get('search', '')
-    role = request.args.get('role', '')
+def bulk_order_status():
+    status = request.form.get('status', '')
+    if status not in ORDER_STATUSES:
+        flash('Choose a status to apply.', 'warning')
+        return redirect(request.referrer or url_for('admin.orders'))
+    
+    order_ids = _selected_ids(Order, _order_filters(request.form.get('filter_status', ''),
+                                                    request.form.get('filter_payment_status', ''),
+                                                    request.form.get('filter_search', '')))
+    changed = bulk.update_order_status(order_ids, status, actor_id=current_user.id, note='Bulk update')
+    db.session.commit()
     
-    query = User.query
+    invalidate_stats()
+    bulk.queue_status_emails(current_app._get_current_object(), changed)
+    
+    skipped = len(set(order_ids)) - len(changed)
+    message = f'{len(changed)} orders moved to {status}.'
+    if skipped:
+        message += f' {skipped} skipped because they cannot move to {status} from their current status.'
+    flash(message, 'success' if changed else 'warning')
+    return redirect(request.referrer or url_for('admin.orders'))
+
+# User Management
+def _user_filters(search, role):
+    """Criteria for the user list filters, shared by the list and its export"""
+    criteria = []
     
     if search:
-        query = query.filter(or_(
+        criteria.append(or_(
             User.username.contains(search),
             User.email.contains(search),
             User.first_name.contains(search),
@@ -485,9 +498,20 @@ def users():
         ))
     
     if role == 'admin':
-        query = query.filter_by(is_admin=True)
+        criteria.append(User.is_admin == True)
     elif role == 'customer':
-        query = query.filter_by(is_admin=False)
+        criteria.append(User.is_admin == False)
+    return criteria
+
+@bp.route('/users')
+@login_required
+@admin_required
+def users():
+    page = request.args.get('page', 1, type=int)
+    search = request.args.get('search', '')
+    role = request.args.get('role', '')
+    
+    query = User.query.filter(*_user_filters(search, role))
     
     users = query.order_by(User.created_at.desc()).paginate(
         page=page, per_page=20, error_out=False)
@@ -500,6 +524,18 @@ def users():
                          search_form=search_form,
                          current_role=role)
 
+@bp.route('/users/export')
+@login_required
+@admin_required
+def export_users():
+    """Download every user matching the list filters as CSV or JSON"""
+    columns = [User.id, User.username, User.email, User.first_name, User.last_name, User.phone,
+               User.phone_verified, User.is_admin, User.is_active, User.created_at]
+    criteria = _user_filters(request.args.get('search', ''), request.args.get('role', ''))
+    statement = db.select(*columns).where(*criteria).order_by(User.id)
+    return export_response(statement, [c.key for c in columns], 'users',
+                           fmt=request.args.get('format', 'csv'), gzip=request.args.get('gzip') == '1')
+
 @bp.route('/user/<int:id>')
 @login_required
 @admin_required
@@ -552,6 +588,7 @@ def moderate_review(id):
     
     if form.validate_on_submit():
         review.is_approved = form.is_approved.data
+        Product.refresh_ratings([review.product_id])
         db.session.commit()
         
         status = 'approved' if form.is_approved.data else 'rejected'
@@ -559,6 +596,31 @@ def moderate_review(id):
     
     return redirect(url_for('admin.reviews'))
 
+@bp.route('/reviews/bulk', methods=['POST'])
+@login_required
+@admin_required
+def bulk_moderate_reviews():
+    action = request.form.get('action', '')
+    if action not in ('approve', 'reject', 'delete'):
+        flash('Choose an action to apply.', 'warning')
+        return redirect(request.referrer or url_for('admin.reviews'))
+    
+    status = request.form.get('filter_status', '')
+    criteria = []
+    if status == 'approved':
+        criteria.append(Review.is_approved == True)
+    elif status == 'pending':
+        criteria.append(Review.is_approved == False)
+    
+    count = bulk.moderate_reviews(_selected_ids(Review, criteria), action)
+    db.session.commit()
+    
+    # Ratings show on the cached homepage product lists
+    invalidate_catalog_cache()
+    past = {'approve': 'approved', 'reject': 'rejected', 'delete': 'deleted'}[action]
+    flash(f'{count} reviews {past}.', 'success')
+    return redirect(request.referrer or url_for('admin.reviews'))
+
 # User Management Actions
 @bp.route('/user/<int:id>/activate', methods=['POST'])
 @login_required
@@ -580,12 +642,32 @@ def deactivate_user(id):
     flash(f'User {user.username} has been deactivated.', 'success')
     return redirect(url_for('admin.user_detail', id=user.id))
 
+@bp.route('/users/bulk', methods=['POST'])
+@login_required
+@admin_required
+def bulk_user_action():
+    action = request.form.get('action', '')
+    if action not in ('activate', 'deactivate'):
+        flash('Choose an action to apply.', 'warning')
+        return redirect(request.referrer or url_for('admin.users'))
+    
+    user_ids = _selected_ids(User, _user_filters(request.form.get('filter_search', ''),
+                                                 request.form.get('filter_role', '')))
+    # Admins can't lock themselves out
+    count = bulk.set_users_active(user_ids, action == 'activate', keep_id=current_user.id)
+    db.session.commit()
+    
+    invalidate_stats()
+    flash(f'{count} users {action}d.', 'success')
+    return redirect(request.referrer or url_for('admin.users'))
+
 @bp.route('/user/<int:id>/delete', methods=['POST'])
 @login_required
 @admin_required
 def delete_user(id):
     user = User.query.get_or_404(id)
     username = user.username
+    release_upload(user.profile_image)
     db.session.delete(user)
     db.session.commit()
     flash(f'User {username} has been deleted.', 'success')
@@ -672,30 +754,55 @@ def resend_message(id):
 @login_required
 @admin_required
 def analytics():
-    # Sales analytics
-    sales_data = db.session.query(
-        func.date(Order.created_at).label('date'),
-        func.sum(Order.total_amount).label('total_sales'),
-        func.count(Order.id).label('order_count')
-    ).filter(Order.payment_status == 'paid').group_by(
-        func.date(Order.created_at)
-    ).order_by(func.date(Order.created_at).desc()).limit(30).all()
+    # Read the precomputed daily rollups (built from the orders on first use)
+    if not DailySales.is_built():
+        DailySales.rebuild()
+    
+    # Sales for the last 30 days, including days without sales
+    today = datetime.utcnow().date()
+    days = [today - timedelta(days=n) for n in range(29, -1, -1)]
+    daily = {row.day: row for row in DailySales.query.filter(DailySales.day >= days[0])}
+    sales_data = {
+        'labels': [day.strftime('%b %d') for day in days],
+        'sales': [float(daily[day].revenue) if day in daily else 0 for day in days],
+        'orders': [daily[day].order_count if day in daily else 0 for day in days],
+    }
     
     # Top selling products
     top_products = db.session.query(
         Product.name,
-        func.sum(OrderItem.quantity).label('total_sold'),
-        func.sum(OrderItem.total_price).label('total_revenue')
-    ).join(OrderItem).join(Order).filter(
-        Order.payment_status == 'paid'
-    ).group_by(Product.id, Product.name).order_by(
-        func.sum(OrderItem.quantity).desc()
+        func.sum(DailyProductSales.quantity).label('total_sold'),
+        func.sum(DailyProductSales.revenue).label('total_revenue')
+    ).join(DailyProductSales, DailyProductSales.product_id == Product.id).group_by(
+        Product.id, Product.name
+    ).order_by(
+        func.sum(DailyProductSales.quantity).desc()
     ).limit(10).all()
     
     return render_template('admin/analytics.html',
                          sales_data=sales_data,
                          top_products=top_products)
 
+@bp.route('/analytics/export')
+@login_required
+@admin_required
+def export_analytics():
+    """Download daily sales (or daily sales per product with ?report=products)"""
+    if not DailySales.is_built():
+        DailySales.rebuild()
+    if request.args.get('report') == 'products':
+        statement = db.select(
+            DailyProductSales.day, DailyProductSales.product_id, Product.name,
+            DailyProductSales.quantity, DailyProductSales.revenue
+        ).join(Product, Product.id == DailyProductSales.product_id).order_by(
+            DailyProductSales.day, DailyProductSales.product_id)
+        header, basename = ['day', 'product_id', 'product_name', 'quantity', 'revenue'], 'product-sales'
+    else:
+        statement = db.select(DailySales.day, DailySales.order_count, DailySales.revenue).order_by(DailySales.day)
+        header, basename = ['day', 'order_count', 'revenue'], 'daily-sales'
+    return export_response(statement, header, basename,
+                           fmt=request.args.get('format', 'csv'), gzip=request.args.get('gzip') == '1')
+
 # Newsletter Management
 @bp.route('/newsletter')
 @login_required
@@ -708,26 +815,43 @@ def newsletter():
     
     return render_template('admin/newsletter.html', subscribers=subscribers)
 
+@bp.route('/newsletter/export')
+@login_required
+@admin_required
+def export_newsletter():
+    """Download the active newsletter subscribers as CSV or JSON"""
+    statement = db.select(Newsletter.email, Newsletter.created_at).where(
+        Newsletter.is_active == True
+    ).order_by(Newsletter.id)
+    return export_response(statement, ['email', 'subscribed_at'], 'newsletter-subscribers',
+                           fmt=request.args.get('format', 'csv'), gzip=request.args.get('gzip') == '1')
+
 # API endpoints for AJAX requests
 @bp.route('/api/dashboard_stats')
 @login_required
 @admin_required
 def api_dashboard_stats():
-    today = datetime.utcnow().date()
-    
-    stats = {
-        'today_sales': float(db.session.query(func.sum(Order.total_amount)).filter(
-            and_(Order.payment_status == 'paid',
-                 func.date(Order.created_at) == today)
-        ).scalar() or 0),
-        'today_orders': Order.query.filter(
-            func.date(Order.created_at) == today
-        ).count(),
-        'pending_orders': Order.query.filter_by(status='pending').count(),
-        'low_stock_count': Product.query.filter(
-            and_(Product.is_active == True,
-                 Product.stock_quantity <= Product.min_stock_level)
-        ).count()
-    }
-    
-    return jsonify(stats)
\ No newline at end of file
+    stats = dashboard_stats()
+    
+    return jsonify({
+        'today_sales': stats['today_sales'],
+        'today_orders': stats['today_orders'],
+        'pending_orders': stats['pending_orders'],
+        'low_stock_count': stats['low_stock_products']
+    })
+
+@bp.route('/api/sms_health')
+@login_required
+@admin_required
+def api_sms_health():
+    """Per-provider SMS delivery stats for this worker process"""
+    from app.auth.sms import get_dispatcher
+    return jsonify(get_dispatcher().stats())
+
+@bp.route('/api/chat_writer_health')
+@login_required
+@admin_required
+def api_chat_writer_health():
+    """Chat writer queue depth and commit latency for this worker process"""
+    from app.chat.writer import get_writer
+    return jsonify(get_writer().stats())
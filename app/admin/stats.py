@@ -0,0 +1,96 @@
+"""Admin dashboard counters.
+
+Everything the dashboard and its 30-second poll show comes from
+``dashboard_stats()``: a handful of conditional-aggregation queries (one per
+table) over index-friendly ``created_at`` ranges, cached for
+DASHBOARD_STATS_TTL seconds. All admins on a worker share the cached copy,
+and only one request recomputes it when it expires.
+"""
+import threading
+from datetime import datetime, time, timedelta
+
+from flask import current_app
+from sqlalchemy import case, func
+
+from app import db
+from app.models import LowStockAlert, Order, OrderStatusCount, Product, User
+
+CACHE_KEY = 'admin_dashboard_stats'
+
+_refresh_lock = threading.Lock()
+
+
+def _sum_if(condition, value):
+    return func.coalesce(func.sum(case((condition, value), else_=0)), 0)
+
+
+def _count_if(condition):
+    return func.coalesce(func.sum(case((condition, 1), else_=0)), 0)
+
+
+def compute_stats(now=None):
+    """Run the dashboard queries and return a plain dict of numbers"""
+    now = now or datetime.utcnow()
+    # Compare created_at against datetime bounds rather than func.date(created_at),
+    # so the index on created_at can be used
+    today = datetime.combine(now.date(), time.min)
+    week_ago = today - timedelta(days=7)
+    month_ago = today - timedelta(days=30)
+    paid = Order.payment_status == 'paid'
+
+    total_sales = db.session.query(func.coalesce(func.sum(Order.total_amount), 0)).filter(paid).scalar()
+    recent = db.session.query(
+        _sum_if(paid & (Order.created_at >= today), Order.total_amount),
+        _sum_if(paid & (Order.created_at >= week_ago), Order.total_amount),
+        _sum_if(paid, Order.total_amount),
+        _count_if(Order.created_at >= today),
+    ).filter(Order.created_at >= month_ago).one()
+
+    total_products = db.session.query(func.count(Product.id)).filter(Product.is_active == True).scalar()
+    # Maintained at write time, so this only touches the low-stock rows
+    low_stock = db.session.query(
+        func.count(LowStockAlert.product_id),
+        _count_if(LowStockAlert.stock_quantity == 0),
+    ).one()
+
+    users = db.session.query(
+        _count_if(User.is_active == True),
+        _count_if(User.created_at >= today),
+    ).one()
+
+    status_counts = OrderStatusCount.counts('status')
+
+    return {
+        'total_sales': float(total_sales),
+        'today_sales': float(recent[0]),
+        'week_sales': float(recent[1]),
+        'month_sales': float(recent[2]),
+        'today_orders': int(recent[3]),
+        'total_orders': sum(status_counts.values()),
+        'pending_orders': status_counts.get('pending', 0),
+        'processing_orders': status_counts.get('processing', 0),
+        'shipped_orders': status_counts.get('shipped', 0),
+        'total_products': int(total_products),
+        'low_stock_products': int(low_stock[0]),
+        'out_of_stock_products': int(low_stock[1]),
+        'total_users': int(users[0]),
+        'new_users_today': int(users[1]),
+    }
+
+
+def dashboard_stats():
+    """Cached ``compute_stats()``; concurrent misses wait for one refresh"""
+    stats = current_app.cache_get(CACHE_KEY)
+    if stats is not None:
+        return stats
+    with _refresh_lock:
+        stats = current_app.cache_get(CACHE_KEY)
+        if stats is None:
+            stats = compute_stats()
+            current_app.cache_set(CACHE_KEY, stats, ttl=current_app.config['DASHBOARD_STATS_TTL'])
+    return stats
+
+
+def invalidate_stats():
+    """Drop this worker's cached counters, e.g. after a bulk admin action"""
+    current_app.cache_delete(CACHE_KEY)
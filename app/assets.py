@@ -0,0 +1,138 @@
+"""Fingerprinted static assets with precompressed siblings.
+
+``flask build-assets`` copies every file under static/css and static/js to
+``static/dist/<path>.<hash><ext>``, writes ``.gz`` (and ``.br`` when the
+brotli package is installed) next to each, and records the mapping in
+``static/dist/manifest.json``. Templates link assets with
+``asset_url('css/site.css')``. This resolves to the fingerprinted copy when
+a manifest exists, and to the plain file otherwise (e.g. in development).
+
+Fingerprinted files never change, so they are served with a one-year
+immutable Cache-Control, and the precompressed variant is picked from
+Accept-Encoding without compressing anything per request.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+
+from flask import current_app, request, send_from_directory, url_for
+
+try:
+    import brotli  # type: ignore
+    _have_brotli = True
+except Exception:
+    _have_brotli = False
+
+ASSET_DIRS = ('css', 'js')
+DIST_DIR = 'dist'
+MANIFEST = 'manifest.json'
+COMPRESSIBLE = ('.css', '.js', '.svg', '.json', '.map', '.txt', '.html')
+IMMUTABLE_MAX_AGE = 31536000
+
+
+def build_assets(static_folder, prune=False):
+    """Fingerprint and precompress assets. Returns the new manifest."""
+    dist = os.path.join(static_folder, DIST_DIR)
+    manifest = {}
+    written = {MANIFEST}
+    for asset_dir in ASSET_DIRS:
+        source_root = os.path.join(static_folder, asset_dir)
+        for dirpath, _, filenames in os.walk(source_root):
+            for filename in sorted(filenames):
+                source = os.path.join(dirpath, filename)
+                logical = os.path.relpath(source, static_folder).replace(os.sep, '/')
+                with open(source, 'rb') as f:
+                    data = f.read()
+                stem, ext = os.path.splitext(logical)
+                fingerprinted = f'{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}'
+                target = os.path.join(dist, fingerprinted)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                if not os.path.exists(target):
+                    shutil.copyfile(source, target)
+                written.add(fingerprinted)
+                if ext in COMPRESSIBLE:
+                    if not os.path.exists(target + '.gz'):
+                        with open(target + '.gz', 'wb') as out:
+                            # mtime=0 keeps the output byte-identical across builds
+                            out.write(gzip.compress(data, compresslevel=9, mtime=0))
+                    written.add(fingerprinted + '.gz')
+                    if _have_brotli:
+                        if not os.path.exists(target + '.br'):
+                            with open(target + '.br', 'wb') as out:
+                                out.write(brotli.compress(data, quality=11))
+                        written.add(fingerprinted + '.br')
+                manifest[logical] = f'{DIST_DIR}/{fingerprinted}'
+
+    os.makedirs(dist, exist_ok=True)
+    tmp_path = os.path.join(dist, MANIFEST + '.part')
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, os.path.join(dist, MANIFEST))
+
+    if prune:
+        # Only when no page rendered by the previous release can still ask for old files
+        for dirpath, _, filenames in os.walk(dist):
+            for filename in filenames:
+                rel = os.path.relpath(os.path.join(dirpath, filename), dist).replace(os.sep, '/')
+                if rel not in written:
+                    os.remove(os.path.join(dirpath, filename))
+    return manifest
+
+
+def _load_manifest(app):
+    path = os.path.join(app.static_folder, DIST_DIR, MANIFEST)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return {}
+    cached = app.extensions.get('assets')
+    # Production reads the manifest once; debug picks up rebuilds
+    if cached is not None and (not app.debug or cached[0] == mtime):
+        return cached[1]
+    with open(path) as f:
+        manifest = json.load(f)
+    app.extensions['assets'] = (mtime, manifest)
+    return manifest
+
+
+def asset_url(filename, **kwargs):
+    """``url_for('static', ...)`` that resolves to the fingerprinted build if there is one"""
+    manifest = _load_manifest(current_app)
+    return url_for('static', filename=manifest.get(filename, filename), **kwargs)
+
+
+def _accepted_encodings():
+    accepted = request.accept_encodings
+    encodings = []
+    if _have_brotli and accepted['br']:
+        encodings.append(('br', '.br'))
+    if accepted['gzip']:
+        encodings.append(('gzip', '.gz'))
+    return encodings
+
+
+def init_app(app):
+    app.jinja_env.globals['asset_url'] = asset_url
+    default_static = app.view_functions['static']
+
+    def static(filename):
+        if not filename.startswith(DIST_DIR + '/'):
+            return default_static(filename)
+        dist_root = app.static_folder
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        for encoding, suffix in _accepted_encodings():
+            if os.path.isfile(os.path.join(dist_root, filename + suffix)):
+                response = send_from_directory(dist_root, filename + suffix, mimetype=mimetype,
+                                               max_age=IMMUTABLE_MAX_AGE)
+                response.headers['Content-Encoding'] = encoding
+                break
+        else:
+            response = send_from_directory(dist_root, filename, max_age=IMMUTABLE_MAX_AGE)
+        response.headers['Cache-Control'] = f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+        response.vary.add('Accept-Encoding')
+        return response
+
+    app.view_functions['static'] = static
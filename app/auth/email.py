@@ -68,6 +68,36 @@ def send_order_status_update_email(user, order):
                                 user=user, order=order)
     )
 
+def send_order_status_update_emails(orders):
+    """Send status update emails for many orders over one SMTP connection.
+
+    Returns the number sent; failures are logged and skipped.
+    """
+    sent = 0
+    with mail.connect() as conn:
+        for order in orders:
+            user = order.customer
+            msg = Message(f'[H2HERBAL] Order Update - {order.order_number}',
+                          sender=current_app.config['MAIL_DEFAULT_SENDER'],
+                          recipients=[user.email])
+            msg.body = render_template('email/order_status_update.txt', user=user, order=order)
+            msg.html = render_template('email/order_status_update.html', user=user, order=order)
+            try:
+                conn.send(msg)
+                sent += 1
+            except Exception:
+                current_app.logger.exception(f'Failed to send status update for {order.order_number}')
+    return sent
+
+def send_low_stock_digest(recipients, products, total):
+    """Send the low-stock digest to the admins in ``recipients``"""
+    msg = Message(f'[H2HERBAL] {len(products)} products running low on stock',
+                  sender=current_app.config['MAIL_DEFAULT_SENDER'],
+                  recipients=recipients)
+    msg.body = render_template('email/low_stock_digest.txt', products=products, total=total)
+    msg.html = render_template('email/low_stock_digest.html', products=products, total=total)
+    mail.send(msg)
+
 def send_sms_code_via_email(user, code):
     """Send SMS verification code via email as fallback"""
     return send_email(
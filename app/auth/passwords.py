@@ -0,0 +1,51 @@
+"""Password hashing policy.
+
+The hash method and cost come from ``PASSWORD_HASH_METHOD`` (any method
+string understood by werkzeug, e.g. ``scrypt:32768:8:1`` or
+``pbkdf2:sha256:600000``). Verification is CPU-bound, so under eventlet or
+gevent it runs on the hub's native thread pool instead of blocking every
+other socket served by the worker.
+"""
+from functools import lru_cache
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash
+from app import run_offloaded
+
+DEFAULT_HASH_METHOD = 'scrypt'
+
+
+def _configured_method():
+    try:
+        return current_app.config.get('PASSWORD_HASH_METHOD') or DEFAULT_HASH_METHOD
+    except RuntimeError:
+        # Outside an app context (scripts, shell helpers)
+        return DEFAULT_HASH_METHOD
+
+
+@lru_cache(maxsize=8)
+def _hash_prefix(method):
+    """Return the ``method:params`` prefix werkzeug writes for ``method``.
+
+    Short forms such as ``scrypt`` are expanded with werkzeug's defaults, so
+    the only reliable way to compare is to look at a real hash.
+    """
+    return generate_password_hash('', method=method).split('$', 1)[0]
+
+
+def hash_password(password):
+    """Hash ``password`` with the configured method"""
+    return run_offloaded(generate_password_hash, password, _configured_method())
+
+
+def verify_password(pwhash, password):
+    """Check ``password`` against ``pwhash`` off the event loop"""
+    if not pwhash or password is None:
+        return False
+    return run_offloaded(check_password_hash, pwhash, password)
+
+
+def needs_rehash(pwhash):
+    """True if ``pwhash`` was made with a different method or cost than configured"""
+    if not pwhash:
+        return False
+    return pwhash.split('$', 1)[0] != _hash_prefix(_configured_method())
@@ -0,0 +1,200 @@
+"""Token-bucket rate limiting for login, password reset, OTP and SMS endpoints.
+
+Each scope (``login``, ``otp_verify`` ...) has a bucket of ``capacity`` tokens
+refilled evenly over ``period`` seconds, kept separately per key (client IP,
+account email, phone number or user id). Buckets live in process memory, or in
+Redis when ``RATELIMIT_STORAGE_URL`` (falling back to ``REDIS_URL``) is set so
+that all workers share the same counts.
+
+The decorator runs before the view body, so a throttled request never reaches
+the database, the password hasher or an SMS provider.
+"""
+import math
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, request, flash, redirect, jsonify, make_response
+from flask_login import current_user
+
+# scope -> (capacity, period in seconds). Override with RATELIMIT_<SCOPE>="capacity/period".
+DEFAULT_LIMITS = {
+    'login': (10, 60),
+    'password_reset': (5, 900),
+    'otp_verify': (5, 300),
+    'sms_send': (3, 600),
+}
+
+
+class MemoryBucketStore:
+    """Per-process token buckets. Suitable for a single worker."""
+
+    def __init__(self, max_keys=10000, clock=time.monotonic):
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._max_keys = max_keys
+        self._clock = clock
+
+    def hit(self, key, capacity, period, cost=1):
+        rate = capacity / period
+        now = self._clock()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self._max_keys:
+                self._prune(now)
+        return allowed, 0 if allowed else math.ceil((cost - tokens) / rate)
+
+    def _prune(self, now):
+        # Buckets untouched for an hour have long since refilled; dropping them is lossless
+        stale = [k for k, (_, updated) in self._buckets.items() if now - updated > 3600]
+        for k in stale:
+            del self._buckets[k]
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class RedisBucketStore:
+    """Token buckets shared between workers through Redis."""
+
+    # Refill and consume atomically so concurrent workers can't both spend the last token
+    SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local allowed = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return {allowed, tostring(tokens)}
+"""
+
+    def __init__(self, url, prefix='ratelimit:'):
+        import redis  # type: ignore
+        self._client = redis.Redis.from_url(url, socket_timeout=0.5)
+        self._script = self._client.register_script(self.SCRIPT)
+        self._prefix = prefix
+
+    def hit(self, key, capacity, period, cost=1):
+        rate = capacity / period
+        allowed, tokens = self._script(keys=[self._prefix + key], args=[capacity, rate, time.time(), cost])
+        if allowed:
+            return True, 0
+        return False, math.ceil((cost - float(tokens)) / rate)
+
+    def reset(self):
+        for key in self._client.scan_iter(self._prefix + '*'):
+            self._client.delete(key)
+
+
+def _get_store():
+    app = current_app._get_current_object()
+    store = app.extensions.get('ratelimit')
+    if store is None:
+        url = app.config.get('RATELIMIT_STORAGE_URL')
+        if url:
+            try:
+                store = RedisBucketStore(url)
+            except Exception:
+                app.logger.exception('Rate limit Redis store unavailable, using in-process buckets')
+        if store is None:
+            store = MemoryBucketStore()
+        app.extensions['ratelimit'] = store
+    return store
+
+
+def _limit_for(scope):
+    value = current_app.config.get(f'RATELIMIT_{scope.upper()}')
+    if value:
+        capacity, period = str(value).split('/', 1)
+        return int(capacity), float(period)
+    return DEFAULT_LIMITS[scope]
+
+
+def check_rate_limit(scope, key, cost=1):
+    """Spend ``cost`` tokens from ``scope``'s bucket for ``key``.
+
+    Returns ``(allowed, retry_after_seconds)``. Store errors fail open: an
+    outage of the limiter must not lock everyone out.
+    """
+    if not key or not current_app.config.get('RATELIMIT_ENABLED', True):
+        return True, 0
+    capacity, period = _limit_for(scope)
+    try:
+        return _get_store().hit(f'{scope}:{key}', capacity, period, cost)
+    except Exception:
+        current_app.logger.exception('Rate limit check failed for %s', scope)
+        return True, 0
+
+
+# Request -> bucket key extractors used by ``rate_limited(by=...)``
+def _key_ip():
+    return request.remote_addr
+
+
+def _key_email():
+    email = request.form.get('email')
+    return email.strip().lower() if email else None
+
+
+def _key_phone():
+    phone = request.form.get('phone') or request.args.get('phone')
+    return ''.join(ch for ch in phone if ch.isdigit() or ch == '+') if phone else None
+
+
+def _key_user():
+    return current_user.get_id() if current_user.is_authenticated else None
+
+
+KEY_FUNCS = {
+    'ip': _key_ip,
+    'email': _key_email,
+    'phone': _key_phone,
+    'user': _key_user,
+}
+
+
+def _limited_response(retry_after):
+    message = 'Too many attempts. Please wait a few minutes and try again.'
+    if request.is_json or request.accept_mimetypes.best == 'application/json':
+        response = make_response(jsonify({'success': False, 'message': message}), 429)
+    else:
+        flash(message, 'danger')
+        response = make_response(redirect(request.full_path if request.query_string else request.path))
+    response.headers['Retry-After'] = str(int(retry_after))
+    return response
+
+
+def rate_limited(scope, by=('ip',), methods=('POST',)):
+    """Throttle a view per ``scope``, spending one token from each key in ``by``.
+
+    Only requests whose method is in ``methods`` are counted, so rendering
+    the form stays free.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if request.method in methods:
+                for name in by:
+                    key = KEY_FUNCS[name]()
+                    allowed, retry_after = check_rate_limit(scope, f'{name}:{key}' if key else None)
+                    if not allowed:
+                        current_app.logger.warning('Rate limit hit: scope=%s %s=%s', scope, name, key)
+                        return _limited_response(retry_after)
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
@@ -1,5 +1,5 @@
 from datetime import datetime, timezone
-from flask import app, render_template, redirect, url_for, flash, request, current_app, session, make_response
+from flask import app, render_template, redirect, url_for, flash, request, current_app, session, make_response, jsonify
 from flask_login import login_user, logout_user, current_user, login_required
 try:
     # Newer Werkzeug moved url_parse; prefer importing if available
@@ -13,8 +13,12 @@ from app.auth.forms import (LoginForm, RegistrationForm, ResetPasswordRequestFor
                            ResetPasswordForm, ChangePasswordForm, EditProfileForm,
                            PhoneVerificationForm, VerifyPhoneCodeForm, Setup2FAForm, ProfileImageForm,
                            PasswordResetMethodForm, PhoneResetCodeForm, PhoneResetPasswordForm)
-from app.models import User, Order
+from app.models import (User, Order, OrderItem, ProductImage, BackupCode, ORDER_STATUS_COLORS,
+                        DEFAULT_PRODUCT_IMAGE)
 from app.auth.email import send_password_reset_email
+from app.auth.ratelimit import rate_limited
+from app.auth import verification
+from app.images import thumbnail_url
 try:
     import pyotp
     import qrcode
@@ -31,6 +35,7 @@ import os
 
 
 @bp.route('/login', methods=['GET', 'POST'])
+@rate_limited('login', by=('ip', 'email'))
 def login():
     if current_user.is_authenticated:
         return redirect(url_for('main.index'))
@@ -45,6 +50,15 @@ def login():
         if not user.is_active:
             flash('Your account has been deactivated. Please contact support.', 'warning')
             return redirect(url_for('auth.login'))
+
+        # We hold the plaintext only now, so upgrade hashes made under an older policy
+        if user.password_needs_rehash():
+            try:
+                user.set_password(form.password.data)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                current_app.logger.exception('Failed to rehash password on login')
         
         login_user(user, remember=form.remember_me.data)
         next_page = request.args.get('next')
@@ -191,6 +205,7 @@ def reset_password_request():
     return redirect(url_for('auth.reset_password_method'))
 
 @bp.route('/reset_password_method', methods=['GET', 'POST'])
+@rate_limited('password_reset', by=('ip', 'email', 'phone'))
 def reset_password_method():
     if current_user.is_authenticated:
         return redirect(url_for('main.index'))
@@ -211,10 +226,10 @@ def reset_password_method():
         elif form.method.data == 'phone':
             user = User.query.filter_by(phone=form.phone.data).first()
             if user and user.phone_verified:
-                code = user.generate_phone_reset_code()
+                code = verification.issue_code(user, verification.PURPOSE_PASSWORD_RESET)
                 db.session.commit()
                 
-                success, error = user.send_password_reset_sms(code)
+                success, error = verification.send_code(user, code, verification.PURPOSE_PASSWORD_RESET)
                 if success:
                     flash('Verification code sent to your phone', 'info')
                     return redirect(url_for('auth.reset_password_phone_code', phone=user.phone))
@@ -228,6 +243,7 @@ def reset_password_method():
                          title='Reset Password', form=form)
 
 @bp.route('/reset_password_phone_code', methods=['GET', 'POST'])
+@rate_limited('otp_verify', by=('ip', 'phone'))
 def reset_password_phone_code():
     if current_user.is_authenticated:
         return redirect(url_for('main.index'))
@@ -239,10 +255,11 @@ def reset_password_phone_code():
     
     form = PhoneResetCodeForm()
     if form.validate_on_submit():
-        user = User.query.filter_by(phone=phone).first()
-        if user and user.verify_phone_reset_code(form.code.data):
-            # Store user ID in session for password reset
-            session['reset_user_id'] = user.id
+        user_id = verification.consume_code(verification.PURPOSE_PASSWORD_RESET, form.code.data, phone=phone)
+        db.session.commit()
+        if user_id:
+            # The code is used up; the session marker authorises the password change
+            session['reset_user_id'] = user_id
             return redirect(url_for('auth.reset_password_phone_new'))
         else:
             flash('Invalid or expired verification code', 'danger')
@@ -268,8 +285,6 @@ def reset_password_phone_new():
     form = PhoneResetPasswordForm()
     if form.validate_on_submit():
         user.set_password(form.password.data)
-        user.phone_verification_code = None
-        user.phone_verification_expires = None
         db.session.commit()
         
         # Clear reset session
@@ -381,21 +396,119 @@ def change_password():
     
     return render_template('auth/change_password.html', title='Change Password', form=form)
 
+def _order_history_page(user_id, before=None, per_page=10):
+    """Load one page of a customer's order history as plain dicts.
+
+    Uses keyset pagination on Order.id (newest first) and three bounded
+    queries per page: the order columns shown in the list, the items of those
+    orders, and one image per first-item product. Returns ``(orders,
+    next_before)`` where ``next_before`` is the cursor for the next page or
+    None on the last page.
+    """
+    query = db.session.query(
+        Order.id, Order.order_number, Order.created_at, Order.total_amount,
+        Order.status, Order.payment_status,
+        Order.shipping_first_name, Order.shipping_last_name, Order.shipping_address,
+        Order.shipping_city, Order.shipping_country, Order.shipping_postal_code
+    ).filter(Order.user_id == user_id)
+    if before is not None:
+        query = query.filter(Order.id < before)
+    rows = query.order_by(Order.id.desc()).limit(per_page + 1).all()
+
+    next_before = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_before = rows[-1].id
+
+    orders = []
+    by_id = {}
+    for row in rows:
+        order = {
+            'id': row.id,
+            'order_number': row.order_number,
+            'created_at': row.created_at,
+            'total_amount': float(row.total_amount or 0),
+            'status': row.status,
+            'status_color': ORDER_STATUS_COLORS.get(row.status, 'secondary'),
+            'payment_status': row.payment_status,
+            'total_items': 0,
+            'thumbnail': None,
+            'line_items': [],
+            'shipping': {
+                'first_name': row.shipping_first_name,
+                'last_name': row.shipping_last_name,
+                'address': row.shipping_address,
+                'city': row.shipping_city,
+                'country': row.shipping_country,
+                'postal_code': row.shipping_postal_code,
+            },
+        }
+        orders.append(order)
+        by_id[row.id] = order
+
+    if not by_id:
+        return orders, next_before
+
+    items = db.session.query(
+        OrderItem.order_id, OrderItem.product_id, OrderItem.product_name,
+        OrderItem.quantity, OrderItem.unit_price, OrderItem.total_price
+    ).filter(OrderItem.order_id.in_(list(by_id))).order_by(OrderItem.id).all()
+
+    first_products = {}
+    for item in items:
+        order = by_id[item.order_id]
+        order['total_items'] += item.quantity
+        order['line_items'].append({
+            'product_id': item.product_id,
+            'product_name': item.product_name,
+            'quantity': item.quantity,
+            'unit_price': float(item.unit_price),
+            'total_price': float(item.total_price),
+        })
+        first_products.setdefault(item.order_id, item.product_id)
+
+    # One image per product, preferring the main image, for all first items at once
+    images = {}
+    product_ids = set(first_products.values())
+    if product_ids:
+        image_rows = db.session.query(ProductImage.product_id, ProductImage.image_url).filter(
+            ProductImage.product_id.in_(product_ids)
+        ).order_by(ProductImage.is_main.desc(), ProductImage.sort_order, ProductImage.id).all()
+        for product_id, image_url in image_rows:
+            images.setdefault(product_id, image_url)
+
+    for order_id, product_id in first_products.items():
+        by_id[order_id]['thumbnail'] = thumbnail_url(images.get(product_id, DEFAULT_PRODUCT_IMAGE))
+
+    return orders, next_before
+
 @bp.route('/my-orders')
 @login_required
 def my_orders():
-    page = request.args.get('page', 1, type=int)
-    orders = Order.query.filter_by(user_id=current_user.id).order_by(Order.created_at.desc()).paginate(
-        page=page, per_page=10, error_out=False)
-    return render_template('auth/orders.html', title='My Orders', orders=orders)
+    return orders()
 
 @bp.route('/orders')
 @login_required
 def orders():
-    page = request.args.get('page', 1, type=int)
-    orders = Order.query.filter_by(user_id=current_user.id).order_by(Order.created_at.desc()).paginate(
-        page=page, per_page=10, error_out=False)
-    return render_template('auth/orders.html', title='My Orders', orders=orders)
+    before = request.args.get('before', type=int)
+    orders, next_before = _order_history_page(current_user.id, before=before)
+    return render_template('auth/orders.html', title='My Orders', orders=orders,
+                         before=before, next_before=next_before)
+
+@bp.route('/api/orders')
+@login_required
+def api_orders():
+    """JSON order history for the current user (keyset paginated with ``before``)"""
+    before = request.args.get('before', type=int)
+    per_page = min(max(request.args.get('per_page', 10, type=int), 1), 50)
+    orders, next_before = _order_history_page(current_user.id, before=before, per_page=per_page)
+    for order in orders:
+        order['created_at'] = order['created_at'].isoformat() if order['created_at'] else None
+    return jsonify({
+        'success': True,
+        'orders': orders,
+        'next_before': next_before
+    })
 
 # Two-Factor Authentication Routes
 @bp.route('/setup_2fa')
@@ -439,6 +552,7 @@ def setup_2fa():
 
 @bp.route('/verify_2fa', methods=['GET', 'POST'])
 @login_required
+@rate_limited('otp_verify', by=('ip', 'user'))
 def verify_2fa():
     if not TOTP_AVAILABLE:
         flash('Two-factor authentication is not available.', 'warning')
@@ -482,7 +596,7 @@ def disable_2fa():
     
     current_user.two_factor_enabled = False
     current_user.two_factor_secret = None
-    current_user.backup_codes = None
+    BackupCode.query.filter_by(user_id=current_user.id).delete()
     db.session.commit()
     
     flash('Two-factor authentication has been disabled.', 'success')
@@ -503,15 +617,16 @@ def view_backup_codes():
 # Phone Verification Routes
 @bp.route('/verify_phone', methods=['GET', 'POST'])
 @login_required
+@rate_limited('sms_send', by=('user', 'phone'))
 def verify_phone():
     form = PhoneVerificationForm()
     if form.validate_on_submit():
         current_user.phone = form.phone.data
-        code = current_user.generate_phone_verification_code()
+        code = verification.issue_code(current_user, verification.PURPOSE_PHONE_VERIFY)
         db.session.commit()
         
         # Send SMS code with improved error handling
-        sms_sent, error_message = current_user.send_sms_code(code)
+        sms_sent, error_message = verification.send_code(current_user, code, verification.PURPOSE_PHONE_VERIFY)
         
         if sms_sent:
             flash(f'Verification code sent to {current_user.phone}', 'success')
@@ -529,18 +644,24 @@ def verify_phone():
 
 @bp.route('/verify_phone_code', methods=['GET', 'POST'])
 @login_required
+@rate_limited('otp_verify', by=('ip', 'user'))
 def verify_phone_code():
-    if not current_user.phone or not current_user.phone_verification_code:
+    if not current_user.phone or not verification.has_pending_code(
+            verification.PURPOSE_PHONE_VERIFY, user_id=current_user.id, phone=current_user.phone):
         flash('Please request a verification code first.', 'warning')
         return redirect(url_for('auth.verify_phone'))
     
     form = VerifyPhoneCodeForm()
     if form.validate_on_submit():
-        if current_user.verify_phone_code(form.code.data):
+        if verification.consume_code(verification.PURPOSE_PHONE_VERIFY, form.code.data,
+                                     user_id=current_user.id, phone=current_user.phone):
+            current_user.phone_verified = True
             db.session.commit()
             flash('Phone number verified successfully!', 'success')
             return redirect(url_for('auth.profile'))
         else:
+            # Persist the failed attempt
+            db.session.commit()
             flash('Invalid or expired verification code.', 'danger')
     
     return render_template('auth/verify_phone_code.html',
@@ -580,24 +701,12 @@ def upload_profile_image():
     form = ProfileImageForm()
     if form.validate_on_submit():
         if form.profile_image.data:
-            from werkzeug.utils import secure_filename
-            import os
-            from datetime import datetime
-            
-            filename = secure_filename(form.profile_image.data.filename)
-            timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S_')
-            filename = timestamp + filename
-            
-            # Create profile images directory
-            upload_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], 'profiles')
-            os.makedirs(upload_dir, exist_ok=True)
-            
-            # Save the file
-            file_path = os.path.join(upload_dir, filename)
-            form.profile_image.data.save(file_path)
-            
+            from app.images import save_image_upload
+            from app.storage import release_upload
+
             # Update user profile image
-            current_user.profile_image = f'profiles/{filename}'
+            release_upload(current_user.profile_image)
+            current_user.profile_image = save_image_upload(form.profile_image.data)
             current_user.updated_at = datetime.now(timezone.utc)
             db.session.commit()
             
@@ -609,13 +718,10 @@ def upload_profile_image():
 @bp.route('/remove_profile_image', methods=['POST'])
 @login_required
 def remove_profile_image():
-    if current_user.profile_image and not current_user.profile_image.startswith('http'):
-        # Remove local file
-        import os
-        file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], current_user.profile_image)
-        if os.path.exists(file_path):
-            os.remove(file_path)
-    
+    from app.storage import release_upload
+
+    # The file itself is removed after commit once nothing else references it
+    release_upload(current_user.profile_image)
     current_user.profile_image = 'default.jpg'
     current_user.updated_at = datetime.now(timezone.utc)
     db.session.commit()
@@ -0,0 +1,136 @@
+"""One-time SMS codes for phone verification and password reset.
+
+Codes are stored in ``VerificationCode`` as an HMAC keyed with the app's
+SECRET_KEY, so a leaked table can't be brute-forced offline over the tiny
+6-digit space. A code is single-use, expires after ``CODE_TTL``, and is
+locked out after ``MAX_ATTEMPTS`` wrong guesses.
+"""
+import hashlib
+import hmac
+import secrets
+from datetime import datetime, timedelta
+
+from flask import current_app, session
+
+from app import db
+from app.models import VerificationCode
+
+CODE_TTL = timedelta(minutes=10)
+MAX_ATTEMPTS = 5
+
+PURPOSE_PHONE_VERIFY = 'phone_verify'
+PURPOSE_PASSWORD_RESET = 'password_reset'
+
+_MESSAGES = {
+    PURPOSE_PHONE_VERIFY: 'Your H2HERBAL verification code is: {code}. Valid for 10 minutes.',
+    PURPOSE_PASSWORD_RESET: 'Your H2HERBAL password reset code is: {code}. Valid for 10 minutes.',
+}
+
+# Session keys the templates read to show the code when no SMS provider is available in development
+_DEV_SESSION_KEYS = {
+    PURPOSE_PHONE_VERIFY: ('dev_sms_code', 'dev_sms_phone'),
+    PURPOSE_PASSWORD_RESET: ('dev_reset_code', 'dev_reset_phone'),
+}
+
+
+def _hash_code(code):
+    key = current_app.config['SECRET_KEY'].encode()
+    return hmac.new(key, code.strip().encode(), hashlib.sha256).hexdigest()
+
+
+def _active(purpose, user_id=None, phone=None):
+    query = VerificationCode.query.filter(
+        VerificationCode.purpose == purpose,
+        VerificationCode.expires_at > datetime.utcnow(),
+    )
+    if user_id is not None:
+        query = query.filter(VerificationCode.user_id == user_id)
+    if phone is not None:
+        query = query.filter(VerificationCode.phone == phone)
+    return query
+
+
+def issue_code(user, purpose):
+    """Create a fresh code for ``user.phone``, replacing any outstanding one.
+
+    Returns the plaintext code; the caller commits.
+    """
+    VerificationCode.query.filter_by(user_id=user.id, purpose=purpose).delete()
+    code = f'{secrets.randbelow(10 ** 6):06d}'
+    db.session.add(VerificationCode(
+        user_id=user.id,
+        phone=user.phone,
+        purpose=purpose,
+        code_hash=_hash_code(code),
+        expires_at=datetime.utcnow() + CODE_TTL,
+    ))
+    return code
+
+
+def has_pending_code(purpose, user_id=None, phone=None):
+    return db.session.query(
+        _active(purpose, user_id, phone).filter(VerificationCode.attempts < MAX_ATTEMPTS).exists()
+    ).scalar()
+
+
+def consume_code(purpose, code, user_id=None, phone=None):
+    """Check ``code`` and use it up.
+
+    Returns the owning user id, or None if the code is wrong, expired or
+    locked. A wrong guess counts against every outstanding code for the same
+    user/phone and purpose. The caller commits.
+    """
+    if not code or (user_id is None and phone is None):
+        return None
+    match = _active(purpose, user_id, phone).filter(
+        VerificationCode.code_hash == _hash_code(code),
+        VerificationCode.attempts < MAX_ATTEMPTS,
+    ).first()
+    if match is None:
+        _active(purpose, user_id, phone).update(
+            {VerificationCode.attempts: VerificationCode.attempts + 1}, synchronize_session=False
+        )
+        return None
+    # Conditional delete so two concurrent submissions can't both redeem the same code
+    deleted = VerificationCode.query.filter_by(id=match.id).delete(synchronize_session=False)
+    db.session.expunge(match)
+    return match.user_id if deleted else None
+
+
+def purge_expired(batch_size=1000):
+    """Delete expired codes in batches. Returns the number of rows removed."""
+    total = 0
+    while True:
+        ids = [row.id for row in db.session.query(VerificationCode.id).filter(
+            VerificationCode.expires_at <= datetime.utcnow()
+        ).limit(batch_size)]
+        if not ids:
+            return total
+        VerificationCode.query.filter(VerificationCode.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        total += len(ids)
+
+
+def send_code(user, code, purpose):
+    """Queue ``code`` for SMS delivery to ``user.phone``. Returns ``(sent, error)``."""
+    from app.auth.ratelimit import check_rate_limit
+    from app.auth.sms import get_dispatcher
+
+    # Every send is a paid provider call; cap them per destination number
+    allowed, _ = check_rate_limit('sms_send', f'to:{user.phone}')
+    if not allowed:
+        return False, 'Too many SMS requests for this number. Please try again later.'
+
+    dispatcher = get_dispatcher()
+    if dispatcher.has_providers() and dispatcher.healthy():
+        return dispatcher.enqueue(user.phone, _MESSAGES[purpose].format(code=code))
+
+    # Development mode fallback - show code in UI
+    if current_app.config.get('FLASK_ENV') == 'development':
+        current_app.logger.info(f"Development Mode - {purpose} code for {user.phone}: {code}")
+        code_key, phone_key = _DEV_SESSION_KEYS[purpose]
+        session[code_key] = code
+        session[phone_key] = user.phone
+        return True, "Development mode - code displayed in UI"
+
+    return False, "SMS service unavailable"
@@ -3,45 +3,11 @@ from flask_login import current_user
 from app import socketio, db
 from app.models import ChatSession, ChatMessage, User
 from datetime import datetime
-from flask_socketio import join_room, leave_room
-from sqlalchemy.exc import SQLAlchemyError
-
-
-def _persist_message_and_emit(app, message_kwargs, rooms):
-    """Background task: persist a ChatMessage and emit to the given rooms.
-
-    This runs inside a separate greenlet and pushes an application context so
-    the DB session and `current_app` are available safely.
-    """
-    # Run everything inside the app context so `app.logger` and the DB are available
-    with app.app_context():
-        try:
-            message = ChatMessage(**message_kwargs)
-            db.session.add(message)
-            db.session.commit()
-
-            message_data = {
-                'id': message.id,
-                'session_id': message.session_id,
-                'sender_id': message.sender_id,
-                'sender_name': getattr(message, 'sender_name', None) or 'Customer',
-                'sender_type': 'agent' if message.sender_id and getattr(message, 'sender_is_admin', False) else 'customer',
-                'message': message.message,
-                'message_type': message.message_type,
-                'attachment_url': message.attachment_url,
-                'is_read': message.is_read,
-                'created_at': message.created_at.isoformat() if message.created_at else None
-            }
-
-            for room in rooms:
-                try:
-                    socketio.emit('message_sent', message_data, room=room)
-                except Exception:
-                    app.logger.exception('Failed to emit message_sent in background')
-        except SQLAlchemyError:
-            app.logger.exception('DB error while persisting chat message in background')
-        except Exception:
-            app.logger.exception('Unexpected error in _persist_message_and_emit')
+from flask_socketio import join_room, leave_room, rooms
+from app.chat.writer import get_writer
+from app.chat.state import session_state
+from app.chat.typing_indicator import get_typing
+from app.chat.fanout import MAX_SUBSCRIPTIONS, session_room
 
 
 def create_chat_session(app, sid, cust_id, cust_name):
@@ -106,6 +72,8 @@ def handle_connect():
 def handle_disconnect():
     """Handle client disconnect"""
     print(f'Client disconnected: {request.sid}')
+    # Don't leave a "typing..." indicator behind for a socket that went away
+    get_typing().disconnect(request.sid)
 
 
 @socketio.on('join_room')
@@ -122,6 +90,32 @@ def handle_join_room(data):
         print(f'Client {request.sid} joined room: {room}')
 
 
+@socketio.on('subscribe_sessions')
+def handle_subscribe_sessions(data):
+    """Set the sessions an admin socket receives full traffic for.
+
+    The dashboard sends the sessions assigned to the admin plus the one on
+    screen whenever that changes; session rooms not in the list are left.
+    Everything else reaches admins as chat_summary (see app/chat/fanout.py).
+    """
+    if not (current_user.is_authenticated and current_user.is_admin):
+        return
+    session_ids = set()
+    for session_id in (data or {}).get('session_ids') or []:
+        try:
+            session_ids.add(int(session_id))
+        except (TypeError, ValueError):
+            continue
+    wanted = {session_room(session_id) for session_id in sorted(session_ids)[:MAX_SUBSCRIPTIONS]}
+
+    for room in rooms():
+        if room.startswith('session_') and room not in wanted:
+            leave_room(room)
+    for room in wanted:
+        join_room(room)
+    return {'subscribed': len(wanted)}
+
+
 @socketio.on('join_session')
 def handle_join_session(data):
     """Handle joining a chat session"""
@@ -135,11 +129,11 @@ def handle_join_session(data):
         join_room(f'session_{session_id}')
         print(f'Client {request.sid} joined session: {session_id}')
 
-        # Lookup existing session
-        session = ChatSession.query.get(session_id)
+        # Lookup existing session (status/agent/customer only, usually from the state cache)
+        state = session_state(session_id)
 
         # If session does not exist, create it and ensure the client joins the correct room using the created id
-        if not session:
+        if state is None:
             # Launch background task to create session and emit notifications
             try:
                 socketio.start_background_task(
@@ -154,13 +148,13 @@ def handle_join_session(data):
 
         # If an admin joined an existing session, notify the session participants (unless silent)
         elif current_user.is_authenticated and current_user.is_admin:
-            if not silent and session and getattr(session, 'status', None) != 'closed':
+            if not silent and state.status != 'closed':
                 try:
                     socketio.emit('admin_notification', {
                         'title': 'Admin Joined Session',
                         'message': f"Admin {current_user.first_name} {current_user.last_name} joined the chat session",
-                        'session_id': session.id
-                    }, room=f'session_{session.id}')
+                        'session_id': session_id
+                    }, room=f'session_{session_id}')
                 except Exception:
                     pass
                 
@@ -173,25 +167,25 @@ def handle_send_message(data):
     
     if session_id and message_text:
         # Check if session exists and get its current status
-        session = ChatSession.query.get(session_id)
-        if not session:
+        state = session_state(session_id)
+        if state is None:
             return
         
         # If this is a customer message to a closed session, reopen it to 'waiting' status
         is_customer_message = not (current_user.is_authenticated and current_user.is_admin)
-        if is_customer_message and session.status == 'closed':
+        if is_customer_message and state.status == 'closed':
+            session = db.session.get(ChatSession, int(session_id))
             session.status = 'waiting'
             session.closed_at = None
             session.agent_id = None  # Unassign the agent so it can be reassigned
             db.session.commit()
             
-            # Emit session status update to admins
+            # Emit session status update to admins (list fields only)
             socketio.emit('session_updated', {
                 'session_id': session_id,
                 'status': 'waiting',
                 'agent_id': None,
-                'agent_name': 'Unassigned',
-                'message': 'Session reopened - customer sent new message'
+                'agent_name': 'Unassigned'
             }, room='admins')
             
             # Also emit to the session room
@@ -205,38 +199,30 @@ def handle_send_message(data):
         
         # If this is an admin socket message, ensure the admin is assigned to this session
         if current_user.is_authenticated and current_user.is_admin:
-            if session.agent_id is None or session.agent_id != current_user.id:
+            if state.agent_id is None or state.agent_id != current_user.id:
                 # Do not allow unassigned admins to send messages via socket
                 return
 
-        # Persist message in background to avoid blocking the socket loop.
+        # Persisted (batched with other messages) and emitted by the chat writer,
+        # so the socket loop isn't held up by the commit
         message_kwargs = dict(
             session_id=session_id,
             sender_id=current_user.id if current_user.is_authenticated else None,
             message=message_text,
             message_type='text'
         )
-
-        try:
-            socketio.start_background_task(
-                _persist_message_and_emit,
-                current_app._get_current_object(),
-                message_kwargs,
-                [f'session_{session_id}', 'admins']
-            )
-        except Exception:
-            current_app.logger.exception('Failed to start background task to persist message')
-
-        # Send admin notification quickly (non-blocking emit)
-        if not (current_user.is_authenticated and current_user.is_admin):
-            try:
-                socketio.emit('admin_notification', {
-                    'title': 'New Message',
-                    'message': f"New message from {current_user.first_name + ' ' + current_user.last_name if current_user.is_authenticated else 'Customer'}",
-                    'session_id': session_id
-                }, room='admins')
-            except Exception:
-                current_app.logger.exception('Failed to emit admin_notification')
+        is_agent = current_user.is_authenticated and current_user.is_admin
+        accepted, error = get_writer().submit(
+            message_kwargs,
+            [f'session_{session_id}'],
+            f'{current_user.first_name} {current_user.last_name}' if current_user.is_authenticated else 'Customer',
+            'agent' if is_agent else 'customer'
+        )
+        if not accepted:
+            # Tell the sender so the client can offer a retry
+            socketio.emit('message_error', {'session_id': session_id, 'message': error}, to=request.sid)
+            return
+        # Admins not subscribed to the session hear about it through chat_summary
 
 @socketio.on('typing')
 def handle_typing(data):
@@ -245,18 +231,24 @@ def handle_typing(data):
     is_typing = data.get('is_typing', False)
     
     if session_id:
-        # Emit typing status to session room
+        # Only relay typing for open sessions, from their customer or any admin
+        state = session_state(session_id)
+        if state is None or state.status == 'closed':
+            return
+        if (current_user.is_authenticated and not current_user.is_admin
+                and state.customer_id is not None and state.customer_id != current_user.id):
+            return
+
+        # Typing status for the session room, coalesced per typist (see app/chat/typing_indicator.py)
         typing_data = {
             'session_id': session_id,
-            'is_typing': is_typing,
             'user_id': current_user.id if current_user.is_authenticated else None
         }
+        typist = current_user.id if current_user.is_authenticated else request.sid
         
         # Send to customer if admin is typing, or to admin if customer is typing
-        if current_user.is_authenticated and current_user.is_admin:
-            socketio.emit('agent_typing', typing_data, room=f'session_{session_id}')
-        else:
-            socketio.emit('user_typing', typing_data, room=f'session_{session_id}')
+        event = 'agent_typing' if current_user.is_authenticated and current_user.is_admin else 'user_typing'
+        get_typing().update(str(session_id), typist, is_typing, event, typing_data, sid=request.sid)
 
 @socketio.on('close_session')
 def handle_close_session(data):
@@ -308,10 +300,7 @@ def handle_close_session(data):
                 'message': 'This chat session has been closed'
             }, room=f'session_{session_id}')
             
-            socketio.emit('session_closed', {
-                'session_id': session_id,
-                'message': 'This chat session has been closed'
-            }, room='admins')
+            socketio.emit('session_closed', {'session_id': session_id}, room='admins')
 
 @socketio.on('delete_session')
 def handle_delete_session(data):
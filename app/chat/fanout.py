@@ -0,0 +1,108 @@
+"""Admin fan-out for chat traffic.
+
+Admin sockets used to receive every chat event on the global ``admins``
+room, so each one carried the whole site's chat volume. Now:
+
+* full session traffic (messages, typing, deletions) only goes to the
+  ``session_<id>`` rooms, which an admin joins for the sessions assigned to
+  them and the one on screen (``subscribe_sessions``);
+* the ``admins`` room carries list-level events only: new sessions, status
+  changes and deletions, with slim payloads, plus ``chat_summary``.
+
+``chat_summary`` coalesces message activity: one event every
+``CHAT_SUMMARY_INTERVAL_MS`` at most, with the latest (truncated) preview
+and number of new customer messages per session since the previous one,
+and the session counts per status.
+"""
+import threading
+
+from sqlalchemy import func
+
+from app import db, socketio
+from app.models import ChatSession
+
+ADMINS_ROOM = 'admins'
+PREVIEW_LENGTH = 80
+# Upper bound on the rooms one admin socket may subscribe to
+MAX_SUBSCRIPTIONS = 200
+
+
+def session_room(session_id):
+    return f'session_{session_id}'
+
+
+def preview(text):
+    text = ' '.join((text or '').split())
+    return text if len(text) <= PREVIEW_LENGTH else text[:PREVIEW_LENGTH - 1] + '\u2026'
+
+
+class ChatSummary:
+    def __init__(self, app, interval=1.0):
+        self.app = app
+        self.logger = app.logger
+        self.interval = interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._running = False
+
+        self.noted = 0
+        self.emitted = 0
+
+    def note_message(self, payload):
+        """Fold a ``message_sent`` payload into the next ``chat_summary``"""
+        session_id = payload['session_id']
+        with self._lock:
+            self.noted += 1
+            entry = self._pending.setdefault(session_id, {'session_id': session_id, 'unread': 0})
+            entry['last_message'] = preview(payload.get('message'))
+            entry['last_message_time'] = payload.get('created_at')
+            entry['sender_type'] = payload.get('sender_type')
+            if payload.get('sender_type') == 'customer':
+                entry['unread'] += 1
+                entry['customer_name'] = payload.get('sender_name')
+            start = not self._running
+            self._running = True
+        if start:
+            socketio.start_background_task(self._run)
+
+    def flush(self):
+        """Emit the pending summary; returns the number of sessions in it"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            if not pending:
+                self._running = False
+                return 0
+        with self.app.app_context():
+            try:
+                counts = dict(db.session.query(ChatSession.status, func.count(ChatSession.id))
+                              .group_by(ChatSession.status).all())
+            except Exception:
+                self.logger.exception('Failed to count chat sessions for the admin summary')
+                counts = None
+        socketio.emit('chat_summary', {'sessions': list(pending.values()), 'counts': counts}, room=ADMINS_ROOM)
+        self.emitted += 1
+        return len(pending)
+
+    def _run(self):
+        while True:
+            socketio.sleep(self.interval)
+            try:
+                if not self.flush():
+                    return
+            except Exception:
+                self.logger.exception('Chat summary error')
+
+    def stats(self):
+        return {'pending': len(self._pending), 'noted': self.noted, 'emitted': self.emitted}
+
+
+def get_summary(app=None):
+    """Return the process-wide chat summary for ``app``, building it on first use"""
+    if app is None:
+        from flask import current_app
+        app = current_app._get_current_object()
+    summary = app.extensions.get('chat_summary')
+    if summary is None:
+        summary = ChatSummary(app, interval=app.config['CHAT_SUMMARY_INTERVAL_MS'] / 1000)
+        app.extensions['chat_summary'] = summary
+    return summary
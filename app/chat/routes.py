@@ -2,11 +2,22 @@ from flask import render_template, redirect, url_for, flash, request, jsonify, c
 from flask_login import login_required, current_user
 from app import db, socketio
 from app.chat import bp
+from app.chat.fanout import get_summary
 from app.models import ChatSession, ChatMessage, User, CannedResponse, ChatAnalytics, Order
 from app.models import ChatNotification
 from datetime import datetime
 import os
+from sqlalchemy import func, or_
 from sqlalchemy.exc import SQLAlchemyError, IntegrityError
+from sqlalchemy.orm import joinedload
+
+SESSION_STATUSES = ('waiting', 'active', 'closed')
+# Sessions per page of /api/sessions (per_page is capped at MAX_SESSIONS_PER_PAGE)
+SESSIONS_PER_PAGE = 50
+MAX_SESSIONS_PER_PAGE = 200
+# Messages per page of /api/sessions/<id>/messages (limit is capped at MAX_MESSAGES_PER_PAGE)
+MESSAGES_PER_PAGE = 50
+MAX_MESSAGES_PER_PAGE = 200
 
 @bp.route('/chat')
 @login_required
@@ -82,34 +93,57 @@ def api_get_agents():
 @bp.route('/api/sessions', methods=['GET'])
 @login_required
 def api_get_sessions():
-    """Get chat sessions for current user"""
+    """Get a page of chat sessions for the current user.
+
+    Query parameters: ``status`` (comma-separated, e.g. ``waiting,active``),
+    ``page``/``per_page`` and ``since`` (ISO timestamp; only sessions updated
+    or with new messages after it, for incremental polling). Pass the
+    returned ``server_time`` as the next ``since``.
+    """
     try:
-        # Build query
-        query = ChatSession.query
-        
-        # Filter by user
-        if current_user.is_admin:
-            # Admins can see all sessions
-            pass
-        else:
-            # Customers see their own sessions
-            query = query.filter_by(customer_id=current_user.id)
-        
-        # Order by creation date
-        sessions = query.order_by(ChatSession.created_at.desc()).all()
-        
-        # Convert to dictionary format
-        sessions_data = []
-        for session in sessions:
-            # Get the last message for this session
-            last_message = ChatMessage.query.filter_by(session_id=session.id)\
-                .order_by(ChatMessage.created_at.desc()).first()
+        server_time = datetime.utcnow()
+        statuses = [s for s in request.args.get('status', '').split(',') if s]
+        if any(s not in SESSION_STATUSES for s in statuses):
+            return jsonify({'success': False, 'message': 'Invalid status filter'}), 400
+        since = None
+        if request.args.get('since'):
+            try:
+                since = datetime.fromisoformat(request.args['since'].rstrip('Z'))
+            except ValueError:
+                return jsonify({'success': False, 'message': 'Invalid since timestamp'}), 400
+        page = max(request.args.get('page', 1, type=int), 1)
+        per_page = min(max(request.args.get('per_page', SESSIONS_PER_PAGE, type=int), 1), MAX_SESSIONS_PER_PAGE)
+
+        # Admins can see all sessions, customers their own
+        visible = [] if current_user.is_admin else [ChatSession.customer_id == current_user.id]
+        criteria = list(visible)
+        if statuses:
+            criteria.append(ChatSession.status.in_(statuses))
+        if since is not None:
+            criteria.append(or_(
+                ChatSession.updated_at > since,
+                db.select(ChatMessage.id).where(ChatMessage.session_id == ChatSession.id,
+                                                ChatMessage.created_at > since).exists()
+            ))
+
+        sessions = ChatSession.query.options(
+            joinedload(ChatSession.customer), joinedload(ChatSession.agent)
+        ).filter(*criteria).order_by(ChatSession.created_at.desc(), ChatSession.id.desc()).paginate(
+            page=page, per_page=per_page, error_out=False)
 
-            # Build customer object (if available)
+        # One query each for the page's last messages, unread counts and its customers' recent orders
+        last_messages = ChatSession.last_messages([session.id for session in sessions.items])
+        unread_counts = ChatSession.unread_counts([session.id for session in sessions.items], current_user.id)
+        recent_orders = Order.recent_for_users([session.customer_id for session in sessions.items])
+        counts = dict(db.session.query(ChatSession.status, func.count(ChatSession.id)).filter(
+            *visible).group_by(ChatSession.status).all())
+
+        sessions_data = []
+        for session in sessions.items:
+            last_message = last_messages.get(session.id)
+            cust = session.customer
             customer_obj = None
-            recent_orders = []
-            if session.customer:
-                cust = session.customer
+            if cust:
                 customer_obj = {
                     'id': cust.id,
                     'first_name': cust.first_name,
@@ -119,25 +153,17 @@ def api_get_sessions():
                     'profile_image': getattr(cust, 'profile_image', None)
                 }
 
-                # Fetch last 5 orders for this customer to show in context panel
-                try:
-                    orders = Order.query.filter_by(user_id=cust.id).order_by(Order.created_at.desc()).limit(5).all()
-                    for order in orders:
-                        recent_orders.append({
-                            'order_number': order.order_number,
-                            'payment_status': order.payment_status,
-                            'total_amount': float(order.total_amount) if order.total_amount is not None else 0.0,
-                            'created_at': order.created_at.isoformat() if order.created_at else None
-                        })
-                except Exception:
-                    recent_orders = []
-
-            session_data = {
+            sessions_data.append({
                 'id': session.id,
                 'customer_id': session.customer_id,
-                'customer_name': f"{session.customer.first_name} {session.customer.last_name}" if session.customer else "Unknown",
+                'customer_name': f"{cust.first_name} {cust.last_name}" if cust else "Unknown",
                 'customer': customer_obj,
-                'recent_orders': recent_orders,
+                'recent_orders': [{
+                    'order_number': order.order_number,
+                    'payment_status': order.payment_status,
+                    'total_amount': float(order.total_amount) if order.total_amount is not None else 0.0,
+                    'created_at': order.created_at.isoformat() if order.created_at else None
+                } for order in recent_orders.get(session.customer_id, [])],
                 'agent_id': session.agent_id,
                 'agent_name': f"{session.agent.first_name} {session.agent.last_name}" if session.agent else "Unassigned",
                 'status': session.status,
@@ -147,13 +173,19 @@ def api_get_sessions():
                 'updated_at': session.updated_at.isoformat() if session.updated_at else None,
                 'closed_at': session.closed_at.isoformat() if session.closed_at else None,
                 'last_message': last_message.message if last_message else "",
-                'last_message_time': last_message.created_at.isoformat() if last_message else None
-            }
-            sessions_data.append(session_data)
+                'last_message_time': last_message.created_at.isoformat() if last_message else None,
+                'unread_count': unread_counts.get(session.id, 0)
+            })
         
         return jsonify({
             'success': True,
-            'sessions': sessions_data
+            'sessions': sessions_data,
+            'page': sessions.page,
+            'per_page': per_page,
+            'total': sessions.total,
+            'has_next': sessions.has_next,
+            'counts': {status: counts.get(status, 0) for status in SESSION_STATUSES},
+            'server_time': server_time.isoformat()
         })
         
     except Exception as e:
@@ -245,8 +277,7 @@ def api_get_session():
                             'session_id': session.id,
                             'status': 'waiting',
                             'agent_id': None,
-                            'agent_name': 'Unassigned',
-                            'message': 'Customer reopened the chat and session is waiting for assignment'
+                            'agent_name': 'Unassigned'
                         }, room='admins')
                         socketio.emit('session_updated', {
                             'session_id': session.id,
@@ -370,10 +401,7 @@ def api_close_session(session_id):
         }, room=f'session_{session_id}')
         
         # Also emit to admins
-        socketio.emit('session_closed', {
-            'session_id': session_id,
-            'message': 'This chat session has been closed'
-        }, room='admins')
+        socketio.emit('session_closed', {'session_id': session_id}, room='admins')
         
         return jsonify({
             'success': True,
@@ -823,19 +851,42 @@ def api_get_session_messages(session_id):
                 'message': 'Access denied'
             }), 403
         
-        # Get messages
-        messages = ChatMessage.query.filter_by(session_id=session_id)\
-            .order_by(ChatMessage.created_at.asc()).all()
+        # Cursor pagination over message ids (served by the (session_id, id) index).
+        # Without a cursor the latest page is returned; before=<id> pages back through
+        # history and after=<id> (or since_id=<id>) catches up after a reconnect.
+        limit = min(max(request.args.get('limit', MESSAGES_PER_PAGE, type=int), 1), MAX_MESSAGES_PER_PAGE)
+        before = request.args.get('before', type=int)
+        after = request.args.get('after', type=int)
+        if after is None:
+            after = request.args.get('since_id', type=int)
+
+        query = ChatMessage.query.filter(ChatMessage.session_id == session_id)
+        if after is not None:
+            messages = query.filter(ChatMessage.id > after).order_by(ChatMessage.id.asc()).limit(limit + 1).all()
+            has_more = len(messages) > limit
+            messages = messages[:limit]
+        else:
+            if before is not None:
+                query = query.filter(ChatMessage.id < before)
+            messages = query.order_by(ChatMessage.id.desc()).limit(limit + 1).all()
+            has_more = len(messages) > limit
+            messages = messages[:limit][::-1]
+
+        # Sender details for the whole page in one query
+        sender_ids = {message.sender_id for message in messages}
+        senders = {row.id: row for row in db.session.query(
+            User.id, User.first_name, User.last_name, User.is_admin).filter(User.id.in_(sender_ids))}
         
         # Convert messages to dictionary format
         messages_data = []
         for message in messages:
+            sender = senders.get(message.sender_id)
             message_data = {
                 'id': message.id,
                 'session_id': message.session_id,
                 'sender_id': message.sender_id,
-                'sender_name': f"{message.sender.first_name} {message.sender.last_name}",
-                'sender_type': 'agent' if message.sender.is_admin else 'customer',
+                'sender_name': f"{sender.first_name} {sender.last_name}" if sender else 'Unknown',
+                'sender_type': 'agent' if sender and sender.is_admin else 'customer',
                 'message': message.message,
                 'message_type': message.message_type,
                 'attachment_url': message.attachment_url,
@@ -846,7 +897,11 @@ def api_get_session_messages(session_id):
         
         return jsonify({
             'success': True,
-            'messages': messages_data
+            'messages': messages_data,
+            # Older messages exist (before/latest page) or newer ones do (after/since_id)
+            'has_more': has_more,
+            'oldest_id': messages[0].id if messages else None,
+            'newest_id': messages[-1].id if messages else None
         })
         
     except Exception as e:
@@ -919,11 +974,8 @@ def api_send_message(session_id):
             'message': message_data
         }, room=f'session_{session_id}')
         
-        # Also emit to admins
-        socketio.emit('message_sent', {
-            'session_id': session_id,
-            'message': message_data
-        }, room='admins')
+        # Admins not subscribed to the session get it in the next chat_summary
+        get_summary().note_message(message_data)
         
         return jsonify({
             'success': True,
@@ -943,8 +995,12 @@ def api_send_message(session_id):
 @bp.route('/api/sessions/<int:session_id>/mark_read', methods=['POST'])
 @login_required
 def api_mark_session_read(session_id):
-    """Mark all messages in a session as read for the current user (except their own messages)
-    and notify connected clients so unread badges can be cleared in real-time."""
+    """Mark all messages in a session as read for the current user (except their own messages).
+
+    Pass ``up_to_message_id`` (JSON body or query string) to mark only up to
+    that message, e.g. one just shown in an open conversation. Read state is
+    per user (a ChatReadCursor), so other participants' unread badges are
+    left alone."""
     try:
         session = ChatSession.query.get(session_id)
         if not session:
@@ -956,20 +1012,25 @@ def api_mark_session_read(session_id):
             if session.customer_id != current_user.id:
                 return jsonify({'success': False, 'message': 'Access denied'}), 403
 
+        data = request.get_json(silent=True) or {}
+        up_to_message_id = data.get('up_to_message_id', request.args.get('up_to_message_id'))
+        if up_to_message_id is not None:
+            try:
+                up_to_message_id = int(up_to_message_id)
+            except (TypeError, ValueError):
+                return jsonify({'success': False, 'message': 'up_to_message_id must be a message id'}), 400
+            # Clamp to this session's own messages so the cursor can't skip ahead of them
+            up_to_message_id = db.session.query(db.func.max(ChatMessage.id)).filter(
+                ChatMessage.session_id == session.id, ChatMessage.id <= up_to_message_id).scalar()
+            if up_to_message_id is None:
+                return jsonify({'success': True, 'message': 'Nothing to mark as read'})
+
         # Mark messages as read for this user
         try:
-            session.mark_messages_as_read(current_user.id)
+            session.mark_messages_as_read(current_user.id, up_to_message_id)
         except Exception:
             db.session.rollback()
 
-        # Emit socket event so other connected admin clients (and the session room) can clear badges
-        try:
-            socketio.emit('session_unread_cleared', {'session_id': session_id}, room='admins')
-            socketio.emit('session_unread_cleared', {'session_id': session_id}, room=f'session_{session_id}')
-        except Exception:
-            # non-fatal
-            pass
-
         return jsonify({'success': True, 'message': 'Marked as read'})
 
     except Exception as e:
@@ -1030,7 +1091,6 @@ def api_delete_message(session_id, message_id):
         # Emit lightweight event so UIs can remove the message from their view
         try:
             socketio.emit('message_deleted', {'session_id': session_id, 'message_id': message_id}, room=f'session_{session_id}')
-            socketio.emit('message_deleted', {'session_id': session_id, 'message_id': message_id}, room='admins')
         except Exception:
             pass
 
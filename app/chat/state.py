@@ -0,0 +1,179 @@
+"""Per-process cache of chat session routing state for the Socket.IO handlers.
+
+Every socket event (a message, a typing indicator, a join) needs the
+session's status, agent_id and customer_id to authorize and route it. Those
+are kept here instead of being read from the database each time: a miss
+loads the three columns once, and every committed insert, update or delete
+of a ChatSession writes through (see ``_publish_chat_session_states`` in
+app/models.py). Assign, close and reopen therefore never leave a stale
+entry behind in this process.
+
+With several workers the changes are also published on Redis
+(``CHAT_STATE_REDIS_URL``, by default the Socket.IO ``REDIS_URL`` message
+queue) and applied by every other worker. If that subscription drops, the
+cache is cleared so nothing missed in between is served. Entries also
+expire after ``CHAT_SESSION_CACHE_TTL`` seconds as a last resort.
+"""
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict, namedtuple
+
+from flask import current_app, has_app_context
+
+from app import db, socketio
+from app.models import ChatSession
+
+CHANNEL = 'chat_session_state'
+
+_setup_lock = threading.Lock()
+
+SessionState = namedtuple('SessionState', 'status agent_id customer_id')
+
+
+class SessionStateCache:
+    def __init__(self, ttl=300, max_size=10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped on every change, so a load that raced with a commit isn't cached
+        self._version = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, session_id):
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None or entry[1] < time.monotonic():
+                self.misses += 1
+                return None
+            self._entries.move_to_end(session_id)
+            self.hits += 1
+            return entry[0]
+
+    @property
+    def version(self):
+        return self._version
+
+    def put(self, session_id, state, version=None):
+        """Cache ``state``; when loaded at ``version``, only if nothing changed since"""
+        with self._lock:
+            if version is not None and version != self._version:
+                return
+            self._entries[session_id] = (state, time.monotonic() + self.ttl)
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def apply(self, changes):
+        """Apply committed ``{session_id: (status, agent_id, customer_id) or None}``"""
+        with self._lock:
+            self._version += 1
+        for session_id, values in changes.items():
+            if values is None:
+                self.discard(session_id)
+            else:
+                self.put(session_id, SessionState(*values))
+
+    def discard(self, session_id):
+        with self._lock:
+            self._entries.pop(session_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._version += 1
+            self._entries.clear()
+
+    def stats(self):
+        return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+class RedisStateBus:
+    """Shares committed session state changes between worker processes"""
+
+    def __init__(self, url, cache, logger):
+        import redis  # type: ignore
+        self._client = redis.Redis.from_url(url, socket_timeout=0.5)
+        self._listen_client = redis.Redis.from_url(url)
+        self.cache = cache
+        self.logger = logger
+        self.origin = uuid.uuid4().hex
+
+    def start(self):
+        socketio.start_background_task(self._listen)
+
+    def publish(self, changes):
+        try:
+            self._client.publish(CHANNEL, json.dumps({'origin': self.origin, 'changes': [
+                [session_id, values] for session_id, values in changes.items()]}))
+        except Exception:
+            self.logger.exception('Failed to publish chat session state')
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self._listen_client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(CHANNEL)
+                for message in pubsub.listen():
+                    data = json.loads(message['data'])
+                    if data.get('origin') != self.origin:
+                        self.cache.apply({session_id: values for session_id, values in data['changes']})
+            except Exception:
+                self.logger.exception('Chat session state subscription lost, retrying')
+            # Changes published while unsubscribed are lost: start from a clean cache
+            self.cache.clear()
+            socketio.sleep(1)
+
+
+def _get_state(app=None):
+    if app is None:
+        app = current_app._get_current_object()
+    state = app.extensions.get('chat_state')
+    if state is None:
+        with _setup_lock:
+            state = app.extensions.get('chat_state')
+            if state is None:
+                cache = SessionStateCache(ttl=app.config['CHAT_SESSION_CACHE_TTL'],
+                                          max_size=app.config['CHAT_SESSION_CACHE_SIZE'])
+                bus = None
+                url = app.config.get('CHAT_STATE_REDIS_URL')
+                if url:
+                    try:
+                        bus = RedisStateBus(url, cache, app.logger)
+                        bus.start()
+                    except Exception:
+                        app.logger.exception('Chat state Redis bus unavailable, cache is per-process only')
+                        bus = None
+                state = app.extensions['chat_state'] = (cache, bus)
+    return state
+
+
+def session_state(session_id):
+    """Return the SessionState for ``session_id``, or None if there is no such session"""
+    try:
+        session_id = int(session_id)
+    except (TypeError, ValueError):
+        return None
+    cache, _ = _get_state()
+    state = cache.get(session_id)
+    if state is None:
+        version = cache.version
+        row = db.session.query(ChatSession.status, ChatSession.agent_id, ChatSession.customer_id
+                               ).filter(ChatSession.id == session_id).first()
+        if row is None:
+            return None
+        state = SessionState(*row)
+        cache.put(session_id, state, version=version)
+    return state
+
+
+def apply_changes(changes):
+    """Write committed session changes through to this worker's cache and the others'"""
+    if not has_app_context():
+        return
+    cache, bus = _get_state()
+    cache.apply(changes)
+    if bus is not None:
+        bus.publish(changes)
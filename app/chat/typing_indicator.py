@@ -0,0 +1,170 @@
+"""Server-side coalescing of chat typing indicators.
+
+Clients send a ``typing`` event whenever someone starts or stops typing, and
+``handle_typing`` used to relay every one of them to the session room (and,
+with a Redis message queue, through Redis). Each (session, typist) pair now
+keeps its last relayed state instead:
+
+* a change is relayed at once when nothing was relayed for that typist in
+  the last ``TYPING_WINDOW_MS`` (leading edge);
+* otherwise only the latest state is relayed when the window ends (trailing
+  edge), so start/stop flicker within a window collapses to at most one
+  event, or none if it ends where it started;
+* "is typing" is withdrawn after ``TYPING_EXPIRY_MS`` without a fresh
+  ``typing`` event, or as soon as the typist's socket disconnects.
+
+Pending trailing emits and expiries are handled by one background task per
+process, which only runs while someone is typing.
+"""
+import logging
+import threading
+import time
+
+from app import socketio
+
+
+class Typist:
+    __slots__ = ('event', 'room', 'payload', 'sid', 'shown', 'pending', 'last_emit', 'expires')
+
+    def __init__(self, event, room, payload, sid):
+        self.event = event
+        self.room = room
+        self.payload = payload
+        self.sid = sid
+        self.shown = False
+        self.pending = None
+        self.last_emit = None
+        self.expires = None
+
+
+class TypingCoalescer:
+    def __init__(self, window=1.0, expiry=5.0, clock=time.monotonic, logger=None):
+        self.window = window
+        self.expiry = expiry
+        self.clock = clock
+        self.logger = logger or logging.getLogger(__name__)
+        self._typists = {}
+        self._lock = threading.Lock()
+        self._running = False
+
+        self.received = 0
+        self.emitted = 0
+
+    def update(self, session_id, typist_key, is_typing, event, payload, sid=None):
+        """Record a ``typing`` event; relays ``event`` to the session room when due.
+
+        ``payload`` is the event data without ``is_typing``.
+        """
+        is_typing = bool(is_typing)
+        now = self.clock()
+        emits = []
+        with self._lock:
+            self.received += 1
+            key = (session_id, typist_key)
+            typist = self._typists.get(key)
+            if typist is None:
+                if not is_typing:
+                    return
+                typist = self._typists[key] = Typist(event, f'session_{session_id}', payload, sid)
+            typist.sid = sid
+            if is_typing:
+                typist.expires = now + self.expiry
+
+            if typist.last_emit is None or now - typist.last_emit >= self.window:
+                # Outside the window this update is the latest state; drop any older trailing one
+                typist.pending = None
+                if is_typing != typist.shown:
+                    emits.append(self._emit_state(typist, is_typing, now))
+            else:
+                # Inside the window: relay the final state when it closes, if it differs
+                typist.pending = is_typing if is_typing != typist.shown else None
+            self._forget_idle(key, typist)
+            start = bool(self._typists) and not self._running
+            if start:
+                self._running = True
+        self._send(emits)
+        if start:
+            socketio.start_background_task(self._run)
+
+    def disconnect(self, sid):
+        """Withdraw the typing indicators of a disconnected socket"""
+        emits = []
+        now = self.clock()
+        with self._lock:
+            for key, typist in list(self._typists.items()):
+                if typist.sid == sid:
+                    if typist.shown:
+                        emits.append(self._emit_state(typist, False, now))
+                    del self._typists[key]
+        self._send(emits)
+
+    def sweep(self):
+        """Send trailing states and expire stale indicators; returns the typists still tracked"""
+        now = self.clock()
+        emits = []
+        with self._lock:
+            for key, typist in list(self._typists.items()):
+                if typist.pending is not None and now - typist.last_emit >= self.window:
+                    emits.append(self._emit_state(typist, typist.pending, now))
+                if typist.shown and typist.expires <= now:
+                    emits.append(self._emit_state(typist, False, now))
+                self._forget_idle(key, typist)
+            remaining = len(self._typists)
+            if not remaining:
+                self._running = False
+        self._send(emits)
+        return remaining
+
+    def _emit_state(self, typist, is_typing, now):
+        typist.shown = is_typing
+        typist.pending = None
+        typist.last_emit = now
+        return typist.event, dict(typist.payload, is_typing=is_typing), typist.room
+
+    def _forget_idle(self, key, typist):
+        # Nothing shown and nothing pending: the next start is a leading edge again
+        if not typist.shown and typist.pending is None and (
+                typist.last_emit is None or self.clock() - typist.last_emit >= self.window):
+            del self._typists[key]
+
+    def _send(self, emits):
+        for event, data, room in emits:
+            self.emitted += 1
+            try:
+                socketio.emit(event, data, room=room)
+            except Exception:
+                self.logger.exception('Failed to relay typing indicator')
+
+    def _run(self):
+        tick = min(self.window, self.expiry) / 4
+        idle = False
+        try:
+            while True:
+                socketio.sleep(tick)
+                try:
+                    idle = not self.sweep()
+                except Exception:
+                    self.logger.exception('Typing indicator sweep error')
+                if idle:
+                    return
+        finally:
+            # Left without going idle: let the next update() start a new sweeper
+            if not idle:
+                with self._lock:
+                    self._running = False
+
+    def stats(self):
+        return {'typists': len(self._typists), 'received': self.received, 'emitted': self.emitted}
+
+
+def get_typing(app=None):
+    """Return the process-wide typing coalescer for ``app``, building it on first use"""
+    if app is None:
+        from flask import current_app
+        app = current_app._get_current_object()
+    typing = app.extensions.get('chat_typing')
+    if typing is None:
+        typing = TypingCoalescer(window=app.config['TYPING_WINDOW_MS'] / 1000,
+                                 expiry=app.config['TYPING_EXPIRY_MS'] / 1000, logger=app.logger)
+        app.extensions['chat_typing'] = typing
+    return typing
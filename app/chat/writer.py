@@ -0,0 +1,203 @@
+"""Batched persistence for chat messages sent over Socket.IO.
+
+``handle_send_message`` used to start a background task per message, each
+with its own app context and commit. Messages now go onto one bounded queue
+drained by a single writer task, which group-commits whatever has arrived
+within ``CHAT_WRITER_FLUSH_MS`` (up to ``CHAT_WRITER_BATCH`` messages) and
+then emits ``message_sent`` for each one in the order they were sent (and
+notes it for the admins' ``chat_summary``, see app/chat/fanout.py).
+
+When the database falls behind the queue fills up and ``submit`` waits up
+to ``CHAT_WRITER_PUT_TIMEOUT`` seconds for room before turning the message
+away, so a slow database slows senders down instead of piling up work.
+Queue depth and commit latency are reported by ``stats()``.
+"""
+import queue
+import threading
+import time
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import db, socketio
+from app.chat.fanout import get_summary
+from app.models import ChatMessage
+
+
+def message_payload(message, sender_name, sender_type):
+    """The ``message_sent`` event data for a persisted message"""
+    return {
+        'id': message.id,
+        'session_id': message.session_id,
+        'sender_id': message.sender_id,
+        'sender_name': sender_name,
+        'sender_type': sender_type,
+        'message': message.message,
+        'message_type': message.message_type,
+        'attachment_url': message.attachment_url,
+        'is_read': message.is_read,
+        'created_at': message.created_at.isoformat() if message.created_at else None
+    }
+
+
+class PendingMessage:
+    __slots__ = ('fields', 'rooms', 'sender_name', 'sender_type')
+
+    def __init__(self, fields, rooms, sender_name, sender_type):
+        self.fields = fields
+        self.rooms = rooms
+        self.sender_name = sender_name
+        self.sender_type = sender_type
+
+
+class ChatWriter:
+    def __init__(self, app, queue_size=1000, batch_size=50, flush_interval=0.01, put_timeout=0.5,
+                 synchronous=False, summary=None):
+        self.app = app
+        self.summary = summary
+        self.logger = app.logger
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.synchronous = synchronous
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._started = False
+        self._lock = threading.Lock()
+
+        self.max_queued = 0
+        self.batches = 0
+        self.written = 0
+        self.failed = 0
+        self.rejected = 0
+        self.avg_batch_size = None
+        self.avg_commit_latency = None
+        self.max_commit_latency = 0.0
+
+    def submit(self, fields, rooms, sender_name, sender_type):
+        """Queue a ChatMessage (``fields`` are its column values) for writing.
+
+        Returns ``(accepted, error)``. Once accepted the message is written
+        and emitted to ``rooms`` in submission order.
+        """
+        item = PendingMessage(fields, rooms, sender_name, sender_type)
+        if self.synchronous:
+            self.write([item])
+            return True, None
+        self._ensure_writer()
+        try:
+            self._queue.put(item, timeout=self.put_timeout)
+        except queue.Full:
+            self.rejected += 1
+            self.logger.warning('Chat writer queue full, message rejected')
+            return False, 'Chat is busy, please try sending again'
+        self.max_queued = max(self.max_queued, self._queue.qsize())
+        return True, None
+
+    def _ensure_writer(self):
+        if self._started:
+            return
+        with self._lock:
+            if not self._started:
+                socketio.start_background_task(self._run)
+                self._started = True
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self.write(batch)
+            except Exception:
+                self.logger.exception('Chat writer error')
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def write(self, batch):
+        """Insert ``batch`` in one transaction, then emit each message in order"""
+        with self.app.app_context():
+            start = time.monotonic()
+            try:
+                payloads = self._commit(batch)
+            except SQLAlchemyError:
+                db.session.rollback()
+                # One bad row (e.g. a session deleted meanwhile) shouldn't lose the rest
+                self.logger.exception('Chat batch commit failed, retrying messages one by one')
+                payloads = []
+                for item in batch:
+                    try:
+                        payloads.extend(self._commit([item]))
+                    except SQLAlchemyError:
+                        db.session.rollback()
+                        self.failed += 1
+                        self.logger.exception(f"Failed to persist chat message for session {item.fields.get('session_id')}")
+            self._record(len(batch), time.monotonic() - start)
+            self.written += len(payloads)
+
+            for item, payload in payloads:
+                for room in item.rooms:
+                    try:
+                        socketio.emit('message_sent', payload, room=room)
+                    except Exception:
+                        self.logger.exception('Failed to emit message_sent')
+                if self.summary is not None:
+                    self.summary.note_message(payload)
+
+    def _commit(self, batch):
+        messages = [ChatMessage(**item.fields) for item in batch]
+        db.session.add_all(messages)
+        # Build the payloads after the flush assigns ids but before the commit expires them
+        db.session.flush()
+        payloads = [(item, message_payload(message, item.sender_name, item.sender_type))
+                    for item, message in zip(batch, messages)]
+        db.session.commit()
+        return payloads
+
+    def _record(self, size, latency):
+        self.batches += 1
+        self.avg_batch_size = size if self.avg_batch_size is None else 0.8 * self.avg_batch_size + 0.2 * size
+        self.avg_commit_latency = (latency if self.avg_commit_latency is None
+                                   else 0.8 * self.avg_commit_latency + 0.2 * latency)
+        self.max_commit_latency = max(self.max_commit_latency, latency)
+
+    def stats(self):
+        return {
+            'queued': self._queue.qsize(),
+            'max_queued': self.max_queued,
+            'capacity': self._queue.maxsize,
+            'batches': self.batches,
+            'written': self.written,
+            'failed': self.failed,
+            'rejected': self.rejected,
+            'avg_batch_size': round(self.avg_batch_size, 1) if self.avg_batch_size is not None else None,
+            'avg_commit_ms': round(self.avg_commit_latency * 1000, 1) if self.avg_commit_latency is not None else None,
+            'max_commit_ms': round(self.max_commit_latency * 1000, 1),
+        }
+
+
+def get_writer(app=None):
+    """Return the process-wide chat writer for ``app``, building it on first use"""
+    if app is None:
+        from flask import current_app
+        app = current_app._get_current_object()
+    writer = app.extensions.get('chat_writer')
+    if writer is None:
+        config = app.config
+        writer = ChatWriter(
+            app,
+            queue_size=config['CHAT_WRITER_QUEUE_SIZE'],
+            batch_size=config['CHAT_WRITER_BATCH'],
+            flush_interval=config['CHAT_WRITER_FLUSH_MS'] / 1000,
+            put_timeout=config.get('CHAT_WRITER_PUT_TIMEOUT', 0.5),
+            synchronous=config.get('CHAT_WRITER_SYNC', False),
+            summary=get_summary(app),
+        )
+        app.extensions['chat_writer'] = writer
+    return writer
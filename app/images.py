@@ -0,0 +1,226 @@
+"""Upload image pipeline: content-addressed originals plus resized variants.
+
+Uploaded images are kept by ``app.storage`` under their SHA-256, so the same
+picture uploaded twice is stored once. A background task then renders a
+square thumbnail and a few fixed widths as WebP with a JPEG fallback into
+``variants/<sha[:2]>/<sha>/``. A ``manifest.json`` is written last, so its
+presence means the set is complete. Templates use ``image_src``,
+``image_srcset``, ``picture_source`` and ``thumbnail_url``, which fall back to
+the original file until the variants exist (and for legacy or external image
+URLs).
+"""
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+
+from flask import current_app, url_for
+from markupsafe import Markup, escape
+
+from app import socketio, run_offloaded
+from app.storage import get_storage, save_upload
+
+VARIANT_DIR = 'variants'
+VARIANT_WIDTHS = (320, 640, 1280)
+THUMB_SIZE = 200
+WEBP_QUALITY = 80
+JPEG_QUALITY = 82
+
+_CAS_NAME = re.compile(r'^[0-9a-f]{64}$')
+
+
+def content_hash(path):
+    """Return the sha256 embedded in a content-addressed upload path, or None"""
+    if not path or path.startswith('http'):
+        return None
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return stem if _CAS_NAME.match(stem) else None
+
+
+def variant_prefix(sha):
+    return f'{VARIANT_DIR}/{sha[:2]}/{sha}'
+
+
+def save_image_upload(file_storage):
+    """Store an uploaded image and queue its variants.
+
+    Returns the storage key to save on the model; the caller commits.
+    """
+    key = save_upload(file_storage)
+    schedule_variants(key)
+    return key
+
+
+def _flatten(image):
+    """RGB copy for JPEG output, compositing any transparency onto white"""
+    from PIL import Image
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def build_variants(storage, key):
+    """Render thumbnail and width variants for one upload. Safe to re-run."""
+    from PIL import Image, ImageOps
+
+    sha = content_hash(key)
+    if not sha:
+        return None
+    prefix = variant_prefix(sha)
+    manifest_key = f'{prefix}/manifest.json'
+    if storage.exists(manifest_key):
+        return manifest_key
+
+    with storage.open(key) as f, Image.open(f) as source:
+        # Let the JPEG decoder downscale while decoding; much cheaper for large photos
+        source.draft('RGB', (max(VARIANT_WIDTHS), max(VARIANT_WIDTHS)))
+        image = ImageOps.exif_transpose(source)
+        image.load()
+
+    has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+    image = image.convert('RGBA' if has_alpha else 'RGB')
+
+    work_dir = tempfile.mkdtemp()
+    files = []
+    try:
+        def write(img, name):
+            for ext, fmt, args in (
+                ('webp', 'WEBP', {'quality': WEBP_QUALITY, 'method': 4}),
+                ('jpg', 'JPEG', {'quality': JPEG_QUALITY, 'optimize': True, 'progressive': True}),
+            ):
+                local_path = os.path.join(work_dir, f'{name}.{ext}')
+                (img if fmt == 'WEBP' else _flatten(img)).save(local_path, format=fmt, **args)
+                storage.put_file(f'{prefix}/{name}.{ext}', local_path, f'image/{"jpeg" if ext == "jpg" else ext}')
+                files.append(f'{name}.{ext}')
+
+        write(ImageOps.fit(image, (THUMB_SIZE, THUMB_SIZE), Image.LANCZOS), 'thumb')
+
+        widths = [w for w in VARIANT_WIDTHS if w < image.width]
+        if image.width < max(VARIANT_WIDTHS):
+            # Full-size re-encode so the largest candidate isn't smaller than the original
+            widths.append(image.width)
+        for width in widths:
+            height = max(1, round(image.height * width / image.width))
+            write(image.resize((width, height), Image.LANCZOS), str(width))
+
+        manifest_path = os.path.join(work_dir, 'manifest.json')
+        with open(manifest_path, 'w') as f:
+            json.dump({'widths': widths, 'width': image.width, 'height': image.height, 'files': files}, f)
+        storage.put_file(manifest_key, manifest_path, 'application/json')
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return manifest_key
+
+
+def variant_keys(storage, key):
+    """Every stored key belonging to ``key``'s variants (for deletion)"""
+    sha = content_hash(key)
+    if not sha:
+        return []
+    prefix = variant_prefix(sha)
+    try:
+        manifest = json.loads(storage.read_bytes(f'{prefix}/manifest.json'))
+    except (OSError, ValueError):
+        return []
+    return [f'{prefix}/{name}' for name in manifest.get('files', [])] + [f'{prefix}/manifest.json']
+
+
+# Caps concurrent renders; each one holds a decoded image in memory
+_render_slots = threading.BoundedSemaphore(int(os.environ.get('IMAGE_WORKERS', '2')))
+
+
+def _variants_task(app, storage, key):
+    with _render_slots:
+        try:
+            run_offloaded(build_variants, storage, key)
+        except Exception:
+            app.logger.exception(f'Failed to build image variants for {key}')
+
+
+def schedule_variants(key):
+    """Queue variant generation for ``key`` off the request thread"""
+    app = current_app._get_current_object()
+    if app.config.get('IMAGE_VARIANTS_SYNC'):
+        _variants_task(app, get_storage(app), key)
+    else:
+        socketio.start_background_task(_variants_task, app, get_storage(app), key)
+
+
+def _manifest(sha):
+    cache_key = f'img_variants:{sha}'
+    cached = current_app.cache_get(cache_key)
+    if cached is not None:
+        return cached or None
+    try:
+        manifest = json.loads(get_storage().read_bytes(f'{variant_prefix(sha)}/manifest.json'))
+        current_app.cache_set(cache_key, manifest, ttl=3600)
+    except Exception:
+        manifest = None
+        # Variants may still be rendering; look again shortly
+        current_app.cache_set(cache_key, {}, ttl=30)
+    return manifest
+
+
+def _original_url(path):
+    if '/' not in path:
+        # Placeholders bundled with the app (default.jpg, ...) always live in static/uploads
+        return url_for('static', filename='uploads/' + path)
+    return get_storage().url(path)
+
+
+def _variant_url(sha, name, fmt):
+    return get_storage().url(f'{variant_prefix(sha)}/{name}.{fmt}')
+
+
+def image_src(path, width=640):
+    """URL of the closest variant at or above ``width``, else the original"""
+    if path and path.startswith('http'):
+        return path
+    sha = content_hash(path)
+    manifest = _manifest(sha) if sha else None
+    if manifest:
+        widths = manifest['widths']
+        best = next((w for w in widths if w >= width), widths[-1])
+        return _variant_url(sha, best, 'jpg')
+    return _original_url(path)
+
+
+def image_srcset(path, fmt='jpg'):
+    """``srcset`` value listing every width variant, or '' if there are none"""
+    sha = content_hash(path)
+    manifest = _manifest(sha) if sha else None
+    if not manifest:
+        return ''
+    return ', '.join(f'{_variant_url(sha, w, fmt)} {w}w' for w in manifest['widths'])
+
+
+def picture_source(path, sizes='100vw'):
+    """``<source>`` element offering the WebP variants inside a ``<picture>``"""
+    srcset = image_srcset(path, 'webp')
+    if not srcset:
+        return Markup('')
+    return Markup(f'<source type="image/webp" srcset="{escape(srcset)}" sizes="{escape(sizes)}">')
+
+
+def thumbnail_url(path):
+    """Square thumbnail URL for small previews, falling back to the original"""
+    if path and path.startswith('http'):
+        return path
+    sha = content_hash(path)
+    if sha and _manifest(sha):
+        return _variant_url(sha, 'thumb', 'jpg')
+    return _original_url(path)
+
+
+def init_app(app):
+    app.jinja_env.globals.update(
+        image_src=image_src,
+        image_srcset=image_srcset,
+        picture_source=picture_source,
+        thumbnail_url=thumbnail_url,
+    )
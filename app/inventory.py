@@ -0,0 +1,61 @@
+"""Low-stock alerting.
+
+``LowStockAlert`` rows (app/models.py) are maintained whenever product stock
+changes: checkout decrements, admin edits and the catalog import. This module
+handles what happens next: products that newly run low are pushed to the
+admins room over Socket.IO as soon as the change commits, and alerts not yet
+mailed are collected into one digest email (``low_stock_digest`` command, run
+from cron).
+"""
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy.orm import joinedload
+
+from app import db, socketio
+from app.models import LowStockAlert, User
+
+
+def notify_admins(notices):
+    """Emit ``low_stock`` to connected admins for products that just ran low"""
+    try:
+        socketio.emit('low_stock', {'products': notices}, room='admins')
+    except Exception:
+        current_app.logger.exception('Failed to emit low stock alert')
+
+
+def low_stock_products(limit=None):
+    """Low-stock products, emptiest first, with their alert rows"""
+    query = LowStockAlert.query.options(joinedload(LowStockAlert.product)).order_by(
+        LowStockAlert.stock_quantity, LowStockAlert.product_id)
+    if limit:
+        query = query.limit(limit)
+    return [alert.product for alert in query]
+
+
+def send_digest():
+    """Email active admins about alerts not included in an earlier digest.
+
+    Marks the mailed alerts and commits. Returns the number of alerts sent.
+    """
+    from app.auth.email import send_low_stock_digest
+
+    pending = LowStockAlert.query.options(joinedload(LowStockAlert.product)).filter(
+        LowStockAlert.notified_at.is_(None)
+    ).order_by(LowStockAlert.stock_quantity, LowStockAlert.product_id).all()
+    if not pending:
+        return 0
+    recipients = [email for (email,) in db.session.query(User.email).filter(
+        User.is_admin == True, User.is_active == True)]
+    if not recipients:
+        current_app.logger.warning('No active admins to send the low stock digest to')
+        return 0
+
+    total = LowStockAlert.query.count()
+    # Usually run from cron: build the admin links against BASE_URL
+    with current_app.test_request_context(base_url=current_app.config['BASE_URL']):
+        send_low_stock_digest(recipients, [alert.product for alert in pending], total)
+    LowStockAlert.query.filter(LowStockAlert.product_id.in_([alert.product_id for alert in pending])).update(
+        {LowStockAlert.notified_at: datetime.utcnow()}, synchronize_session=False)
+    db.session.commit()
+    return len(pending)
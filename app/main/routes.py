@@ -8,11 +8,22 @@ from app.main import bp
 from app.main.forms import (AddToCartForm, UpdateCartForm, CheckoutForm, ReviewForm, 
                            NewsletterForm, ContactForm, SearchForm, PaymentForm)
 from app.models import (Product, Category, CartItem, Order, OrderItem, Review, 
-                       Newsletter, User)
+                       Newsletter, User, InvalidOrderTransition)
 from app.main.payment import PaystackPayment
 from app.auth.email import send_order_confirmation_email
 import json
 
+# Homepage lists cached by index(); see invalidate_catalog_cache()
+CATALOG_CACHE_KEYS = ('featured_products', 'active_categories', 'latest_products')
+
+def invalidate_catalog_cache():
+    """Drop this worker's cached homepage lists after a catalog change.
+
+    Other workers pick the change up when their short TTLs run out.
+    """
+    for key in CATALOG_CACHE_KEYS:
+        current_app.cache_delete(key)
+
 @bp.route('/')
 @bp.route('/index')
 def index():
@@ -298,6 +309,7 @@ def checkout():
         
         db.session.add(order)
         db.session.flush()  # Get order ID
+        order.record_created(actor_id=current_user.id)
         
         # Create order items
         for cart_item in cart_items:
@@ -460,16 +472,15 @@ def payment_callback():
             
             if abs(expected_amount - paid_amount) > 0.01:  # Allow for small rounding differences
                 current_app.logger.error(f"Amount mismatch for order {order.id}: expected {expected_amount}, got {paid_amount}")
-                order.payment_status = 'failed'
-                order.status = 'pending'
+                order.transition(payment_status='failed',
+                                 note=f'Amount mismatch: expected {expected_amount}, got {paid_amount}')
                 db.session.commit()
                 flash('Payment amount mismatch. Please contact support.', 'danger')
                 return redirect(url_for('main.payment', order_id=order.id))
             
             # Payment successful
-            order.payment_status = 'paid'
-            order.status = 'confirmed'
-            order.updated_at = datetime.utcnow()
+            order.transition(status='confirmed', payment_status='paid',
+                             note=f'Paystack reference {reference}')
             db.session.commit()
             
             current_app.logger.info(f"Payment successful for order {order.id}")
@@ -491,8 +502,7 @@ def payment_callback():
             
             # Only mark as failed if it's actually failed, not if it's still pending
             if payment_status in ['failed', 'cancelled', 'abandoned']:
-                order.payment_status = 'failed'
-                order.updated_at = datetime.utcnow()
+                order.transition(payment_status='failed', note=error_message[:255])
                 db.session.commit()
                 flash(f'Payment failed: {error_message}', 'danger')
                 return redirect(url_for('main.payment', order_id=order.id))
@@ -502,6 +512,11 @@ def payment_callback():
                 flash('Payment is still being processed. Please wait a moment and check again.', 'info')
                 return redirect(url_for('main.payment', order_id=order.id))
                 
+    except InvalidOrderTransition as e:
+        db.session.rollback()
+        current_app.logger.error(f"Payment callback rejected for order {order.id}: {str(e)}")
+        flash('This order can no longer accept payment. Please contact support.', 'danger')
+        return redirect(url_for('main.order_success', order_id=order.id))
     except Exception as e:
         current_app.logger.error(f"Payment callback error for order {order.id}: {str(e)}")
         flash('An error occurred while processing your payment. Please contact support.', 'danger')
@@ -552,6 +567,8 @@ def add_review(product_id):
             )
             
             db.session.add(review)
+            db.session.flush()
+            Product.refresh_ratings([product_id])
             db.session.commit()
             flash('Thank you for your review!', 'success')
     
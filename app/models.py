@@ -2,19 +2,28 @@ from datetime import datetime, timedelta
 from decimal import Decimal, ROUND_HALF_UP
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import deferred, make_transient_to_detached
+from sqlalchemy.orm.util import identity_key
 from flask_dance.consumer.storage.sqla import OAuthConsumerMixin
-from werkzeug.security import generate_password_hash, check_password_hash
 from app import db
 import secrets
 
+# Columns loaded (and cached) for every authenticated request by the
+# Flask-Login user loader. Everything else is loaded on first access.
+USER_IDENTITY_COLUMNS = ('id', 'username', 'email', 'first_name', 'last_name', 'phone',
+                         'is_admin', 'is_active', 'profile_image', 'phone_verified',
+                         'two_factor_enabled', 'two_factor_method', 'created_at')
+
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
-    password_hash = db.Column(db.String(255))
+    password_hash = deferred(db.Column(db.String(255)), group='secrets')
     first_name = db.Column(db.String(50), nullable=False)
     last_name = db.Column(db.String(50), nullable=False)
-    phone = db.Column(db.String(20))
+    phone = db.Column(db.String(20), index=True)
     address = db.Column(db.Text)
     city = db.Column(db.String(50))
     country = db.Column(db.String(50))
@@ -27,30 +36,79 @@ class User(UserMixin, db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Password reset token
-    reset_token = db.Column(db.String(100), unique=True)
-    reset_token_expiry = db.Column(db.DateTime)
+    reset_token = deferred(db.Column(db.String(100), unique=True), group='secrets')
+    reset_token_expiry = deferred(db.Column(db.DateTime), group='secrets')
     
     # Two-Factor Authentication
     two_factor_enabled = db.Column(db.Boolean, default=False)
-    two_factor_secret = db.Column(db.String(32))
-    backup_codes = db.Column(db.Text)  # JSON string of backup codes
+    two_factor_secret = deferred(db.Column(db.String(32)), group='secrets')
     
-    # Phone verification for 2FA
+    # Phone verification for 2FA (codes live in VerificationCode)
     phone_verified = db.Column(db.Boolean, default=False)
-    phone_verification_code = db.Column(db.String(6))
-    phone_verification_expires = db.Column(db.DateTime)
     two_factor_method = db.Column(db.String(10), default='totp')  # 'totp' or 'sms'
     
     # Relationships
     orders = db.relationship('Order', backref='customer', lazy=True)
     cart_items = db.relationship('CartItem', backref='user', lazy=True, cascade='all, delete-orphan')
     reviews = db.relationship('Review', backref='user', lazy=True)
+    backup_codes = db.relationship('BackupCode', backref='user', lazy='dynamic', cascade='all, delete-orphan')
+    verification_codes = db.relationship('VerificationCode', backref='user', lazy='dynamic',
+                                         cascade='all, delete-orphan')
+    chat_read_cursors = db.relationship('ChatReadCursor', lazy=True, cascade='all, delete-orphan')
+
+    @classmethod
+    def load_identity(cls, user_id):
+        """Load a user for Flask-Login from a short-TTL cached projection.
+
+        Only USER_IDENTITY_COLUMNS are read (and cached in the app cache for
+        USER_CACHE_TTL seconds), so repeated requests and Socket.IO events for
+        the same user skip the database. The returned instance is attached to
+        the current session; any other column or relationship loads lazily on
+        first access. The cache entry is dropped whenever the user row is
+        updated or deleted through the ORM.
+        """
+        from flask import current_app
+
+        existing = db.session.identity_map.get(identity_key(cls, user_id))
+        if existing is not None:
+            return existing
+
+        key = f'user_identity:{user_id}'
+        data = current_app.cache_get(key)
+        if data is None:
+            columns = [getattr(cls, name) for name in USER_IDENTITY_COLUMNS]
+            row = db.session.query(*columns).filter(cls.id == user_id).first()
+            if row is None:
+                return None
+            data = dict(row._mapping)
+            current_app.cache_set(key, data, ttl=current_app.config.get('USER_CACHE_TTL', 30))
+
+        user = cls(**data)
+        # Treat the cached values as loaded state; unset columns become expired
+        # and load on access instead of being flushed as changes.
+        make_transient_to_detached(user)
+        db.session.add(user)
+        return user
+
+    @staticmethod
+    def invalidate_identity(user_id):
+        """Drop a user's cached identity so the next request reloads it"""
+        from flask import current_app, has_app_context
+        if has_app_context() and hasattr(current_app, 'cache_delete'):
+            current_app.cache_delete(f'user_identity:{user_id}')
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        from app.auth.passwords import hash_password
+        self.password_hash = hash_password(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        from app.auth.passwords import verify_password
+        return verify_password(self.password_hash, password)
+
+    def password_needs_rehash(self):
+        """True if the stored hash predates the current PASSWORD_HASH_METHOD"""
+        from app.auth.passwords import needs_rehash
+        return needs_rehash(self.password_hash)
     
     def generate_reset_token(self):
         self.reset_token = secrets.token_urlsafe(32)
@@ -62,87 +120,6 @@ class User(UserMixin, db.Model):
                 self.reset_token_expiry and
                 self.reset_token_expiry > datetime.utcnow())
     
-    def generate_phone_reset_code(self):
-        """Generate a 6-digit phone reset code"""
-        import random
-        from datetime import datetime, timedelta
-        
-        code = ''.join([str(random.randint(0, 9)) for _ in range(6)])
-        self.phone_verification_code = code
-        self.phone_verification_expires = datetime.utcnow() + timedelta(minutes=10)
-        return code
-    
-    def verify_phone_reset_code(self, code):
-        """Verify phone reset code"""
-        from datetime import datetime
-        
-        if not self.phone_verification_code or not self.phone_verification_expires:
-            return False
-        
-        if datetime.utcnow() > self.phone_verification_expires:
-            return False
-        
-        if self.phone_verification_code == code:
-            # Don't clear the code yet - will be cleared after password reset
-            return True
-        
-        return False
-    
-    def send_password_reset_sms(self, code):
-        """Send password reset code via SMS"""
-        from flask import current_app
-        import requests
-        
-        # Method 1: Twilio SMS
-        if current_app.config.get('TWILIO_ACCOUNT_SID') and current_app.config.get('TWILIO_AUTH_TOKEN'):
-            try:
-                from twilio.rest import Client
-                client = Client(
-                    current_app.config['TWILIO_ACCOUNT_SID'],
-                    current_app.config['TWILIO_AUTH_TOKEN']
-                )
-                message = client.messages.create(
-                    body=f"Your H2HERBAL password reset code is: {code}. Valid for 10 minutes.",
-                    from_=current_app.config.get('TWILIO_PHONE_NUMBER'),
-                    to=self.phone
-                )
-                current_app.logger.info(f"Password reset SMS sent via Twilio: {message.sid}")
-                return True, None
-            except Exception as e:
-                current_app.logger.error(f"Twilio SMS failed: {str(e)}")
-        
-        # Method 2: TextBelt SMS (Free alternative)
-        try:
-            response = requests.post('https://textbelt.com/text', {
-                'phone': self.phone,
-                'message': f"Your H2HERBAL password reset code is: {code}. Valid for 10 minutes.",
-                'key': current_app.config.get('TEXTBELT_API_KEY', 'textbelt')
-            }, timeout=10)
-            
-            result = response.json()
-            if result.get('success'):
-                current_app.logger.info(f"Password reset SMS sent via TextBelt to {self.phone}")
-                return True, None
-            else:
-                error_message = f"TextBelt SMS failed: {result.get('error', 'Unknown error')}"
-                current_app.logger.error(error_message)
-                return False, error_message
-        except Exception as e:
-            error_message = f"TextBelt SMS failed: {str(e)}"
-            current_app.logger.error(error_message)
-        
-        # Development mode fallback
-        if current_app.config.get('FLASK_ENV') == 'development':
-            current_app.logger.info(f"Development Mode - Password Reset Code for {self.phone}: {code}")
-            print(f"Password Reset Code for {self.phone}: {code}")
-            
-            from flask import session
-            session['dev_reset_code'] = code
-            session['dev_reset_phone'] = self.phone
-            return True, "Development mode - code displayed in UI"
-        
-        return False, "SMS service unavailable"
-    
     def get_cart_total(self):
         # Cache the computed cart total on the instance to avoid repeated DB access
         if hasattr(self, '_cached_cart_total'):
@@ -207,138 +184,25 @@ class User(UserMixin, db.Model):
         return False
     
     def generate_backup_codes(self):
-        """Generate backup codes for 2FA"""
+        """Replace the user's backup codes with 10 new ones and return them in plaintext"""
         import secrets
-        import json
+        BackupCode.query.filter_by(user_id=self.id).delete()
         codes = [secrets.token_hex(4).upper() for _ in range(10)]
-        self.backup_codes = json.dumps(codes)
+        db.session.add_all(BackupCode(user_id=self.id, code_hash=BackupCode.hash(code)) for code in codes)
         return codes
     
     def verify_backup_code(self, code):
         """Verify and consume a backup code"""
-        import json
-        if self.backup_codes:
-            codes = json.loads(self.backup_codes)
-            if code.upper() in codes:
-                codes.remove(code.upper())
-                self.backup_codes = json.dumps(codes)
-                return True
-        return False
+        if not code:
+            return False
+        # Conditional DELETE: of two concurrent attempts with the same code only one succeeds
+        return BackupCode.query.filter_by(
+            user_id=self.id, code_hash=BackupCode.hash(code)
+        ).delete(synchronize_session=False) == 1
     
     def get_remaining_backup_codes(self):
         """Get count of remaining backup codes"""
-        import json
-        if self.backup_codes:
-            codes = json.loads(self.backup_codes)
-            return len(codes)
-        return 0
-    
-    def generate_phone_verification_code(self):
-        """Generate a 6-digit phone verification code"""
-        import random
-        from datetime import datetime, timedelta
-        
-        code = ''.join([str(random.randint(0, 9)) for _ in range(6)])
-        self.phone_verification_code = code
-        self.phone_verification_expires = datetime.utcnow() + timedelta(minutes=10)
-        return code
-    
-    def verify_phone_code(self, code):
-        """Verify phone verification code"""
-        from datetime import datetime
-        
-        if not self.phone_verification_code or not self.phone_verification_expires:
-            return False
-        
-        if datetime.utcnow() > self.phone_verification_expires:
-            return False
-        
-        if self.phone_verification_code == code:
-            self.phone_verified = True
-            self.phone_verification_code = None
-            self.phone_verification_expires = None
-            return True
-        
-        return False
-    
-    def send_sms_code(self, code):
-        """Send SMS verification code to phone number"""
-        from flask import current_app
-        import requests
-        import json
-        
-        sms_sent = False
-        error_message = None
-        
-        # Method 1: Twilio SMS (Primary)
-        if current_app.config.get('TWILIO_ACCOUNT_SID') and current_app.config.get('TWILIO_AUTH_TOKEN'):
-            try:
-                from twilio.rest import Client
-                client = Client(
-                    current_app.config['TWILIO_ACCOUNT_SID'],
-                    current_app.config['TWILIO_AUTH_TOKEN']
-                )
-                message = client.messages.create(
-                    body=f"Your H2HERBAL verification code is: {code}. Valid for 10 minutes.",
-                    from_=current_app.config.get('TWILIO_PHONE_NUMBER'),
-                    to=self.phone
-                )
-                current_app.logger.info(f"SMS sent via Twilio: {message.sid}")
-                return True, None
-            except Exception as e:
-                error_message = f"Twilio SMS failed: {str(e)}"
-                current_app.logger.error(error_message)
-        
-        # Method 2: TextBelt SMS (Free alternative)
-        try:
-            response = requests.post('https://textbelt.com/text', {
-                'phone': self.phone,
-                'message': f"Your H2HERBAL verification code is: {code}. Valid for 10 minutes.",
-                'key': current_app.config.get('TEXTBELT_API_KEY', 'textbelt')  # 'textbelt' for free quota
-            }, timeout=10)
-            
-            result = response.json()
-            if result.get('success'):
-                current_app.logger.info(f"SMS sent via TextBelt to {self.phone}")
-                return True, None
-            else:
-                error_message = f"TextBelt SMS failed: {result.get('error', 'Unknown error')}"
-                current_app.logger.error(error_message)
-        except Exception as e:
-            error_message = f"TextBelt SMS failed: {str(e)}"
-            current_app.logger.error(error_message)
-        
-        # Method 3: SMS API (Alternative free service)
-        try:
-            # Using SMS API service (you can replace with your preferred SMS service)
-            api_key = current_app.config.get('SMS_API_KEY')
-            if api_key:
-                response = requests.post('https://api.smsapi.com/sms.do', {
-                    'username': current_app.config.get('SMS_API_USERNAME'),
-                    'password': current_app.config.get('SMS_API_PASSWORD'),
-                    'to': self.phone,
-                    'message': f"Your H2HERBAL verification code is: {code}. Valid for 10 minutes.",
-                    'format': 'json'
-                }, timeout=10)
-                
-                if response.status_code == 200:
-                    current_app.logger.info(f"SMS sent via SMS API to {self.phone}")
-                    return True, None
-        except Exception as e:
-            current_app.logger.error(f"SMS API failed: {str(e)}")
-        
-        # Development mode fallback - show code in UI
-        if current_app.config.get('FLASK_ENV') == 'development':
-            current_app.logger.info(f"Development Mode - SMS Code for {self.phone}: {code}")
-            print(f"SMS Code for {self.phone}: {code}")
-            
-            # Store code in session for development mode display
-            from flask import session
-            session['dev_sms_code'] = code
-            session['dev_sms_phone'] = self.phone
-            return True, "Development mode - code displayed in UI"
-        
-        return False, error_message or "All SMS services failed"
+        return BackupCode.query.filter_by(user_id=self.id).count()
     
     def to_dict(self):
         """Convert user to dictionary for JSON responses"""
@@ -357,6 +221,73 @@ class User(UserMixin, db.Model):
     def __repr__(self):
         return f'<User {self.username}>'
 
+
+# session.info key for users whose cached identity goes stale when the current transaction commits
+USER_IDENTITY_CHANGES = 'user_identity_changes'
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _invalidate_user_identity(mapper, connection, target):
+    db.inspect(target).session.info.setdefault(USER_IDENTITY_CHANGES, set()).add(target.id)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _drop_user_identities(session):
+    # After, not before, the commit: a request loading the user in between would re-cache old values
+    for user_id in session.info.pop(USER_IDENTITY_CHANGES, ()):
+        User.invalidate_identity(user_id)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _keep_user_identities(session):
+    session.info.pop(USER_IDENTITY_CHANGES, None)
+
+
+class BackupCode(db.Model):
+    """Single-use 2FA backup code, stored as an HMAC of the normalised code"""
+    __table_args__ = (db.UniqueConstraint('user_id', 'code_hash', name='uq_backup_code_user_hash'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    code_hash = db.Column(db.String(64), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    @staticmethod
+    def hash(code):
+        import hashlib
+        import hmac
+        from flask import current_app
+        normalised = code.strip().replace('-', '').replace(' ', '').upper()
+        key = current_app.config['SECRET_KEY'].encode()
+        return hmac.new(key, normalised.encode(), hashlib.sha256).hexdigest()
+
+    def __repr__(self):
+        return f'<BackupCode user={self.user_id}>'
+
+
+class VerificationCode(db.Model):
+    """Short-lived one-time code sent by SMS (phone verification, password reset).
+
+    Only an HMAC of the code is stored. Lookups go through the
+    (user/phone, purpose, expiry) indexes; see app.auth.verification.
+    """
+    __table_args__ = (
+        db.Index('ix_verification_code_user_purpose', 'user_id', 'purpose', 'expires_at'),
+        db.Index('ix_verification_code_phone_purpose', 'phone', 'purpose', 'expires_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    phone = db.Column(db.String(20), nullable=False)
+    purpose = db.Column(db.String(20), nullable=False)  # 'phone_verify' or 'password_reset'
+    code_hash = db.Column(db.String(64), nullable=False)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<VerificationCode {self.purpose} user={self.user_id}>'
+
 class Category(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), unique=True, nullable=False)
@@ -371,6 +302,9 @@ class Category(db.Model):
     def __repr__(self):
         return f'<Category {self.name}>'
 
+# Placeholder shown for products that have no uploaded images
+DEFAULT_PRODUCT_IMAGE = 'https://images.unsplash.com/photo-1556909114-f6e7ad7d3136?ixlib=rb-4.0.3&w=300&h=250&fit=crop'
+
 class Product(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
@@ -390,6 +324,10 @@ class Product(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # Approved-review aggregates, kept current by refresh_ratings()
+    rating_count = db.Column(db.Integer, nullable=False, default=0)
+    rating_average = db.Column(db.Float, nullable=False, default=0)
+    
     # Foreign Keys
     category_id = db.Column(db.Integer, db.ForeignKey('category.id'), nullable=False)
     
@@ -411,7 +349,7 @@ class Product(db.Model):
             return first_image.image_url
         
         # If no images at all, return a default placeholder URL
-        return 'https://images.unsplash.com/photo-1556909114-f6e7ad7d3136?ixlib=rb-4.0.3&w=300&h=250&fit=crop'
+        return DEFAULT_PRODUCT_IMAGE
     
     def get_discount_percentage(self):
         if self.compare_price and self.compare_price > self.price:
@@ -426,10 +364,23 @@ class Product(db.Model):
         return self.stock_quantity <= self.min_stock_level
     
     def get_average_rating(self):
-        if self.reviews:
-            total_rating = sum(review.rating for review in self.reviews)
-            return round(total_rating / len(self.reviews), 1)
-        return 0
+        return round(self.rating_average or 0, 1)
+
+    @classmethod
+    def refresh_ratings(cls, product_ids):
+        """Recompute rating_count/rating_average from approved reviews in one UPDATE.
+
+        Call after reviews are added, moderated or deleted; the caller commits.
+        """
+        product_ids = list(set(product_ids))
+        if not product_ids:
+            return
+        approved = db.and_(Review.product_id == cls.id, Review.is_approved == True)
+        cls.query.filter(cls.id.in_(product_ids)).update({
+            cls.rating_count: db.select(db.func.count(Review.id)).where(approved).scalar_subquery(),
+            cls.rating_average: db.select(db.func.coalesce(db.func.avg(Review.rating), 0)
+                                          ).where(approved).scalar_subquery(),
+        }, synchronize_session=False)
     
     def get_price_float(self):
         return float(self.price)
@@ -437,6 +388,134 @@ class Product(db.Model):
     def __repr__(self):
         return f'<Product {self.name}>'
 
+# session.info key for low-stock alerts raised in the current transaction
+LOW_STOCK_NOTICES = 'low_stock_notices'
+
+class LowStockAlert(db.Model):
+    """Active products currently at or below their minimum stock level.
+
+    Kept current at write time: every flush that changes a product's stock,
+    minimum level or active flag adds, updates or removes its row (see
+    _track_stock_level), and ``sync()`` covers bulk UPDATEs that skip the
+    ORM. The dashboard reads this small table instead of scanning products.
+    Products that newly run low are pushed to admins once the transaction
+    commits; ``notified_at`` is set once an alert has gone out in a digest.
+    """
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)
+    stock_quantity = db.Column(db.Integer, nullable=False, index=True)
+    min_stock_level = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    notified_at = db.Column(db.DateTime, index=True)
+
+    product = db.relationship('Product')
+
+    @staticmethod
+    def is_low(product):
+        return (bool(product.is_active) and product.stock_quantity is not None
+                and product.min_stock_level is not None
+                and product.stock_quantity <= product.min_stock_level)
+
+    @staticmethod
+    def notice(product):
+        """Socket.IO payload announcing a product that just ran low"""
+        return {
+            'product_id': product.id,
+            'name': product.name,
+            'sku': product.sku,
+            'stock_quantity': product.stock_quantity,
+            'min_stock_level': product.min_stock_level,
+        }
+
+    @classmethod
+    def sync(cls, product_ids):
+        """Reconcile the alerts for ``product_ids`` with the product table.
+
+        For writes that bypass the ORM flush, such as the bulk catalog
+        import. The caller commits.
+        """
+        product_ids = list(set(product_ids))
+        if not product_ids:
+            return
+        low = db.session.query(Product.id, Product.name, Product.sku,
+                               Product.stock_quantity, Product.min_stock_level).filter(
+            Product.id.in_(product_ids), Product.is_active == True,
+            Product.stock_quantity <= Product.min_stock_level).all()
+        existing = {product_id for (product_id,) in db.session.query(cls.product_id).filter(
+            cls.product_id.in_(product_ids))}
+
+        cls.query.filter(cls.product_id.in_(product_ids),
+                         cls.product_id.notin_([row.id for row in low])).delete(synchronize_session=False)
+        changed = [{'product_id': row.id, 'stock_quantity': row.stock_quantity,
+                    'min_stock_level': row.min_stock_level} for row in low if row.id in existing]
+        if changed:
+            db.session.execute(db.update(cls), changed)
+        added = [row for row in low if row.id not in existing]
+        if added:
+            now = datetime.utcnow()
+            db.session.execute(db.insert(cls), [
+                {'product_id': row.id, 'stock_quantity': row.stock_quantity,
+                 'min_stock_level': row.min_stock_level, 'created_at': now} for row in added])
+            notices = db.session.info.setdefault(LOW_STOCK_NOTICES, {})
+            for row in added:
+                notices[row.id] = cls.notice(row)
+
+    def __repr__(self):
+        return f'<LowStockAlert product={self.product_id}: {self.stock_quantity}/{self.min_stock_level}>'
+
+
+@event.listens_for(Product, 'after_insert')
+def _track_stock_level(mapper, connection, target):
+    table = LowStockAlert.__table__
+    notices = db.inspect(target).session.info.setdefault(LOW_STOCK_NOTICES, {})
+    if not LowStockAlert.is_low(target):
+        connection.execute(table.delete().where(table.c.product_id == target.id))
+        notices.pop(target.id, None)
+        return
+    values = {'stock_quantity': target.stock_quantity, 'min_stock_level': target.min_stock_level}
+    if not connection.execute(table.update().where(table.c.product_id == target.id).values(**values)).rowcount:
+        connection.execute(table.insert().values(product_id=target.id, created_at=datetime.utcnow(), **values))
+        notices[target.id] = LowStockAlert.notice(target)
+
+
+@event.listens_for(Product, 'after_update')
+def _track_stock_change(mapper, connection, target):
+    state = db.inspect(target)
+    # Edits to the name, price, ... can't move a product in or out of the set
+    if any(state.attrs[name].history.has_changes() for name in ('stock_quantity', 'min_stock_level', 'is_active')):
+        _track_stock_level(mapper, connection, target)
+
+
+@event.listens_for(Product, 'after_delete')
+def _drop_stock_alert(mapper, connection, target):
+    table = LowStockAlert.__table__
+    connection.execute(table.delete().where(table.c.product_id == target.id))
+
+
+@event.listens_for(db.session, 'after_commit')
+def _announce_low_stock(session):
+    notices = session.info.pop(LOW_STOCK_NOTICES, None)
+    if notices:
+        from app.inventory import notify_admins
+        notify_admins(list(notices.values()))
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_low_stock(session):
+    session.info.pop(LOW_STOCK_NOTICES, None)
+
+class StoredBlob(db.Model):
+    """One stored upload per distinct content, shared by every row that references it"""
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), unique=True, nullable=False)
+    key = db.Column(db.String(255), unique=True, nullable=False)
+    size = db.Column(db.Integer)
+    content_type = db.Column(db.String(100))
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<StoredBlob {self.key} refs={self.ref_count}>'
+
 class ProductImage(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
@@ -449,6 +528,46 @@ class ProductImage(db.Model):
     def __repr__(self):
         return f'<ProductImage {self.image_url}>'
 
+class ProductImportJob(db.Model):
+    """A bulk catalog import (see app/admin/catalog_import.py) and its progress"""
+    id = db.Column(db.Integer, primary_key=True)
+    filename = db.Column(db.String(255), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, done, failed
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+    bytes_total = db.Column(db.Integer, nullable=False, default=0)
+    bytes_read = db.Column(db.Integer, nullable=False, default=0)
+    rows_processed = db.Column(db.Integer, nullable=False, default=0)
+    rows_created = db.Column(db.Integer, nullable=False, default=0)
+    rows_updated = db.Column(db.Integer, nullable=False, default=0)
+    rows_failed = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.String(500))  # Why the whole job failed, if it did
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+    @property
+    def percent(self):
+        if self.status == 'done':
+            return 100
+        return int(self.bytes_read * 100 / self.bytes_total) if self.bytes_total else 0
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'filename': self.filename,
+            'status': self.status,
+            'percent': self.percent,
+            'rows_processed': self.rows_processed,
+            'rows_created': self.rows_created,
+            'rows_updated': self.rows_updated,
+            'rows_failed': self.rows_failed,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+    def __repr__(self):
+        return f'<ProductImportJob {self.id} {self.status}>'
+
 class CartItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -464,7 +583,47 @@ class CartItem(db.Model):
     def __repr__(self):
         return f'<CartItem {self.product.name} x {self.quantity}>'
 
+# Order lifecycle. Each key lists the statuses it may move to; a change to the
+# same value is always a no-op.
+ORDER_STATUSES = ('pending', 'confirmed', 'processing', 'shipped', 'delivered', 'cancelled')
+PAYMENT_STATUSES = ('pending', 'paid', 'failed', 'refunded')
+
+ORDER_STATUS_TRANSITIONS = {
+    'pending': ('confirmed', 'processing', 'cancelled'),
+    'confirmed': ('processing', 'shipped', 'cancelled'),
+    'processing': ('shipped', 'cancelled'),
+    'shipped': ('delivered',),
+    'delivered': (),
+    'cancelled': (),
+}
+
+PAYMENT_STATUS_TRANSITIONS = {
+    'pending': ('paid', 'failed'),
+    'failed': ('pending', 'paid'),
+    'paid': ('refunded',),
+    'refunded': (),
+}
+
+ORDER_STATUS_COLORS = {
+    'pending': 'warning',
+    'confirmed': 'info',
+    'processing': 'primary',
+    'shipped': 'secondary',
+    'delivered': 'success',
+    'cancelled': 'danger'
+}
+
+
+class InvalidOrderTransition(ValueError):
+    """Raised when an order or payment status change is not allowed"""
+
+
 class Order(db.Model):
+    __table_args__ = (
+        # Customer order history is paged newest-first by id within a user
+        db.Index('ix_order_user_id_id', 'user_id', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     order_number = db.Column(db.String(50), unique=True, nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -477,8 +636,8 @@ class Order(db.Model):
     total_amount = db.Column(db.Numeric(10, 2), nullable=False)
     
     # Order status
-    status = db.Column(db.String(50), default='pending')  # pending, confirmed, processing, shipped, delivered, cancelled
-    payment_status = db.Column(db.String(50), default='pending')  # pending, paid, failed, refunded
+    status = db.Column(db.String(50), default='pending', index=True)  # see ORDER_STATUSES
+    payment_status = db.Column(db.String(50), default='pending', index=True)  # see PAYMENT_STATUSES
     payment_method = db.Column(db.String(50))  # card, momo, bank_transfer
     payment_reference = db.Column(db.String(100))
     
@@ -493,13 +652,15 @@ class Order(db.Model):
     shipping_postal_code = db.Column(db.String(20))
     
     # Timestamps
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     shipped_at = db.Column(db.DateTime)
     delivered_at = db.Column(db.DateTime)
     
     # Relationships
     items = db.relationship('OrderItem', backref='order', lazy=True, cascade='all, delete-orphan')
+    events = db.relationship('OrderEvent', backref='order', lazy='dynamic',
+                             cascade='all, delete-orphan', order_by='OrderEvent.id')
     
     def generate_order_number(self):
         import random
@@ -512,22 +673,211 @@ class Order(db.Model):
         return sum(item.quantity for item in self.items)
     
     def get_status_color(self):
-        status_colors = {
-            'pending': 'warning',
-            'confirmed': 'info',
-            'processing': 'primary',
-            'shipped': 'secondary',
-            'delivered': 'success',
-            'cancelled': 'danger'
-        }
-        return status_colors.get(self.status, 'secondary')
+        return ORDER_STATUS_COLORS.get(self.status, 'secondary')
+
+    def can_transition(self, status=None, payment_status=None):
+        """Check whether the given status and/or payment status change is allowed"""
+        if status is not None and status != self.status:
+            if status not in ORDER_STATUS_TRANSITIONS.get(self.status or 'pending', ()):
+                return False
+        if payment_status is not None and payment_status != self.payment_status:
+            if payment_status not in PAYMENT_STATUS_TRANSITIONS.get(self.payment_status or 'pending', ()):
+                return False
+        return True
+
+    def record_created(self, actor_id=None):
+        """Log the initial state of a newly flushed order and count it.
+
+        Call after ``db.session.flush()`` so the order has an id. The caller
+        commits.
+        """
+        for field in ('status', 'payment_status'):
+            value = getattr(self, field)
+            db.session.add(OrderEvent(order_id=self.id, field=field, from_value=None,
+                                      to_value=value, actor_id=actor_id, note='Order created'))
+            OrderStatusCount.bump(field, value, 1)
+        if self.payment_status == 'paid':
+            DailySales.record(self, 1)
+
+    @classmethod
+    def recent_for_users(cls, user_ids, limit=5):
+        """Return {user_id: [up to ``limit`` newest orders]} for ``user_ids`` in one query"""
+        user_ids = list(set(user_ids))
+        if not user_ids:
+            return {}
+        ranked = db.select(cls.id, db.func.row_number().over(
+            partition_by=cls.user_id, order_by=(cls.created_at.desc(), cls.id.desc())
+        ).label('rank')).where(cls.user_id.in_(user_ids)).subquery()
+        orders = cls.query.join(ranked, cls.id == ranked.c.id).filter(
+            ranked.c.rank <= limit).order_by(cls.user_id, ranked.c.rank).all()
+        recent = {}
+        for order in orders:
+            recent.setdefault(order.user_id, []).append(order)
+        return recent
+
+    @classmethod
+    def bulk_transition(cls, order_ids, status, actor_id=None, note=None):
+        """Move many orders to ``status`` with one UPDATE per current status.
+
+        Orders whose current status can't move to ``status`` are left alone.
+        Logs an OrderEvent per changed order, keeps OrderStatusCount in step
+        and stamps shipped_at/delivered_at like transition(). Payment status
+        is not handled here, as it also moves the DailySales rollups. The
+        caller commits. Returns the ids of the orders that changed.
+        """
+        if status not in ORDER_STATUSES:
+            raise InvalidOrderTransition(f'Unknown order status: {status}')
+        sources = [source for source, targets in ORDER_STATUS_TRANSITIONS.items() if status in targets]
+        rows = db.session.query(cls.id, cls.status).filter(
+            cls.id.in_(order_ids), cls.status.in_(sources)
+        ).with_for_update().all()
+        if not rows:
+            return []
+
+        now = datetime.utcnow()
+        values = {cls.status: status, cls.updated_at: now}
+        if status == 'shipped':
+            values[cls.shipped_at] = db.func.coalesce(cls.shipped_at, now)
+        elif status == 'delivered':
+            values[cls.delivered_at] = db.func.coalesce(cls.delivered_at, now)
+
+        by_source = {}
+        for order_id, source in rows:
+            by_source.setdefault(source, []).append(order_id)
+        for source, ids in by_source.items():
+            cls.query.filter(cls.id.in_(ids)).update(values, synchronize_session=False)
+            OrderStatusCount.bump('status', source, -len(ids))
+        OrderStatusCount.bump('status', status, len(rows))
+
+        db.session.execute(db.insert(OrderEvent), [
+            {'order_id': order_id, 'field': 'status', 'from_value': source, 'to_value': status,
+             'actor_id': actor_id, 'note': note, 'created_at': now}
+            for order_id, source in rows
+        ])
+        return [order_id for order_id, _ in rows]
+
+    def transition(self, status=None, payment_status=None, actor_id=None, note=None):
+        """Apply a validated status and/or payment status change.
+
+        Appends an OrderEvent per changed field, keeps OrderStatusCount and the
+        DailySales rollups in step and stamps shipped_at/delivered_at. Raises InvalidOrderTransition if
+        either change is not allowed; nothing is modified in that case. The
+        caller commits. Returns True if anything changed.
+        """
+        if status is not None and status not in ORDER_STATUSES:
+            raise InvalidOrderTransition(f'Unknown order status: {status}')
+        if payment_status is not None and payment_status not in PAYMENT_STATUSES:
+            raise InvalidOrderTransition(f'Unknown payment status: {payment_status}')
+        if not self.can_transition(status=status):
+            raise InvalidOrderTransition(f'Cannot change order status from {self.status} to {status}')
+        if not self.can_transition(payment_status=payment_status):
+            raise InvalidOrderTransition(
+                f'Cannot change payment status from {self.payment_status} to {payment_status}')
+
+        now = datetime.utcnow()
+        changed = False
+        for field, value in (('status', status), ('payment_status', payment_status)):
+            old_value = getattr(self, field)
+            if value is None or value == old_value:
+                continue
+            setattr(self, field, value)
+            db.session.add(OrderEvent(order_id=self.id, field=field, from_value=old_value,
+                                      to_value=value, actor_id=actor_id, note=note))
+            OrderStatusCount.bump(field, old_value, -1)
+            OrderStatusCount.bump(field, value, 1)
+            if field == 'payment_status' and 'paid' in (old_value, value):
+                DailySales.record(self, 1 if value == 'paid' else -1)
+            changed = True
+
+        if changed:
+            if status == 'shipped' and not self.shipped_at:
+                self.shipped_at = now
+            elif status == 'delivered' and not self.delivered_at:
+                self.delivered_at = now
+            self.updated_at = now
+        return changed
 
     def __repr__(self):
         return f'<Order {self.order_number}>'
 
+
+class OrderEvent(db.Model):
+    """Append-only log of order and payment status transitions"""
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False, index=True)
+    field = db.Column(db.String(20), nullable=False)  # 'status' or 'payment_status'
+    from_value = db.Column(db.String(50))  # None for the creation event
+    to_value = db.Column(db.String(50), nullable=False)
+    actor_id = db.Column(db.Integer, db.ForeignKey('user.id'))  # None for system/payment callbacks
+    note = db.Column(db.String(255))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    actor = db.relationship('User')
+
+    def __repr__(self):
+        return f'<OrderEvent {self.order_id} {self.field}: {self.from_value} -> {self.to_value}>'
+
+
+class OrderStatusCount(db.Model):
+    """Incrementally maintained number of orders per status and payment status.
+
+    Rows are bumped by Order.record_created/Order.transition so the admin
+    dashboard can read counts without COUNT(*) scans over the order table.
+    """
+    __table_args__ = (db.UniqueConstraint('field', 'value', name='uq_order_status_count'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    field = db.Column(db.String(20), nullable=False)  # 'status' or 'payment_status'
+    value = db.Column(db.String(50), nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    @classmethod
+    def bump(cls, field, value, delta):
+        """Atomically add ``delta`` to the counter for ``field``/``value``.
+
+        Does nothing until the counters have been built once; ``counts()``
+        rebuilds them from the order table on first use.
+        """
+        if value is None:
+            return
+        updated = cls.query.filter_by(field=field, value=value).update(
+            {'count': cls.count + delta}, synchronize_session=False)
+        if not updated and cls.query.filter_by(field=field).first() is not None:
+            db.session.add(cls(field=field, value=value, count=max(delta, 0)))
+
+    @classmethod
+    def rebuild(cls):
+        """Recompute every counter from the order table and commit"""
+        cls.query.delete(synchronize_session=False)
+        for field in ('status', 'payment_status'):
+            column = getattr(Order, field)
+            rows = db.session.query(column, db.func.count(Order.id)).group_by(column).all()
+            present = {value for value, _ in rows}
+            for value, count in rows:
+                if value is not None:
+                    db.session.add(cls(field=field, value=value, count=count))
+            # Seed the known values so bump() has a row to update
+            known = ORDER_STATUSES if field == 'status' else PAYMENT_STATUSES
+            for value in known:
+                if value not in present:
+                    db.session.add(cls(field=field, value=value, count=0))
+        db.session.commit()
+
+    @classmethod
+    def counts(cls, field='status'):
+        """Return a {value: count} dict for ``field``, building counters if needed"""
+        rows = cls.query.filter_by(field=field).all()
+        if not rows:
+            cls.rebuild()
+            rows = cls.query.filter_by(field=field).all()
+        return {row.value: row.count for row in rows}
+
+    def __repr__(self):
+        return f'<OrderStatusCount {self.field}={self.value}: {self.count}>'
+
 class OrderItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False)
+    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False, index=True)
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
     quantity = db.Column(db.Integer, nullable=False)
     unit_price = db.Column(db.Numeric(10, 2), nullable=False)
@@ -540,6 +890,120 @@ class OrderItem(db.Model):
     def __repr__(self):
         return f'<OrderItem {self.product_name} x {self.quantity}>'
 
+
+def _add_to_rollup(model, key, amounts):
+    """Add ``amounts`` to the rollup row identified by ``key``, creating it if needed"""
+    values = {name: getattr(model, name) + amount for name, amount in amounts.items()}
+    if model.query.filter_by(**key).update(values, synchronize_session=False):
+        return
+    try:
+        # Savepoint: a concurrent first sale of the day may insert the same row
+        with db.session.begin_nested():
+            db.session.add(model(**key, **amounts))
+    except IntegrityError:
+        model.query.filter_by(**key).update(values, synchronize_session=False)
+
+
+class RollupState(db.Model):
+    """When a derived table was last rebuilt, so an empty rollup is not mistaken for an unbuilt one"""
+    name = db.Column(db.String(50), primary_key=True)
+    built_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    @classmethod
+    def mark_built(cls, name):
+        state = db.session.get(cls, name)
+        if state is None:
+            db.session.add(cls(name=name, built_at=datetime.utcnow()))
+        else:
+            state.built_at = datetime.utcnow()
+
+    @classmethod
+    def is_built(cls, name):
+        return db.session.query(cls.name).filter_by(name=name).first() is not None
+
+    def __repr__(self):
+        return f'<RollupState {self.name} built {self.built_at}>'
+
+
+class DailySales(db.Model):
+    """Paid order totals per day of order creation, for the admin analytics page.
+
+    Kept in step by Order.record_created/Order.transition when an order
+    becomes (or stops being) paid, together with DailyProductSales. Like
+    OrderStatusCount, nothing is bumped until the rollup has been built once;
+    ``rebuild()`` (or the ``rollup_sales`` command) recomputes it from orders
+    and records that in RollupState, since a built rollup may have no rows.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, unique=True, nullable=False)
+    order_count = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+
+    @classmethod
+    def is_built(cls):
+        return RollupState.is_built('daily_sales')
+
+    @classmethod
+    def record(cls, order, sign):
+        """Add (sign=1) or remove (sign=-1) a paid order from the rollups"""
+        if order.created_at is None or not cls.is_built():
+            return
+        day = order.created_at.date()
+        _add_to_rollup(cls, {'day': day},
+                       {'order_count': sign, 'revenue': sign * Decimal(order.total_amount or 0)})
+        per_product = {}
+        for item in order.items:
+            quantity, revenue = per_product.get(item.product_id, (0, Decimal('0')))
+            per_product[item.product_id] = (quantity + item.quantity,
+                                            revenue + Decimal(item.total_price or 0))
+        for product_id, (quantity, revenue) in per_product.items():
+            _add_to_rollup(DailyProductSales, {'day': day, 'product_id': product_id},
+                           {'quantity': sign * quantity, 'revenue': sign * revenue})
+
+    @classmethod
+    def rebuild(cls, since=None):
+        """Recompute the rollups from paid orders, for every day or from ``since`` on, and commit"""
+        day = db.func.date(Order.created_at, type_=db.Date)
+        paid = [Order.payment_status == 'paid']
+        if since is not None:
+            paid.append(Order.created_at >= datetime.combine(since, datetime.min.time()))
+            cls.query.filter(cls.day >= since).delete(synchronize_session=False)
+            DailyProductSales.query.filter(DailyProductSales.day >= since).delete(synchronize_session=False)
+        else:
+            cls.query.delete(synchronize_session=False)
+            DailyProductSales.query.delete(synchronize_session=False)
+
+        rows = db.session.query(day, db.func.count(Order.id), db.func.sum(Order.total_amount)
+                                ).filter(*paid).group_by(day).all()
+        db.session.add_all(cls(day=d, order_count=count, revenue=revenue) for d, count, revenue in rows)
+        rows = db.session.query(day, OrderItem.product_id, db.func.sum(OrderItem.quantity),
+                                db.func.sum(OrderItem.total_price)
+                                ).join(Order, OrderItem.order_id == Order.id
+                                ).filter(*paid).group_by(day, OrderItem.product_id).all()
+        db.session.add_all(DailyProductSales(day=d, product_id=product_id, quantity=quantity, revenue=revenue)
+                           for d, product_id, quantity, revenue in rows)
+        RollupState.mark_built('daily_sales')
+        db.session.commit()
+
+    def __repr__(self):
+        return f'<DailySales {self.day}: {self.order_count} orders>'
+
+
+class DailyProductSales(db.Model):
+    """Units sold and revenue per product per day of paid orders (see DailySales)"""
+    __table_args__ = (
+        db.UniqueConstraint('day', 'product_id', name='uq_daily_product_sales'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False, index=True)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<DailyProductSales {self.day} product={self.product_id}: {self.quantity}>'
+
 class Review(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -604,23 +1068,62 @@ class ChatSession(db.Model):
     customer = db.relationship('User', foreign_keys=[customer_id], backref='customer_chat_sessions')
     agent = db.relationship('User', foreign_keys=[agent_id], backref='agent_chat_sessions')
     messages = db.relationship('ChatMessage', backref='session', lazy=True, cascade='all, delete-orphan')
+    read_cursors = db.relationship('ChatReadCursor', lazy=True, cascade='all, delete-orphan')
     
     def get_last_message(self):
         """Get the last message in this session"""
         return ChatMessage.query.filter_by(session_id=self.id).order_by(ChatMessage.created_at.desc()).first()
+
+    @classmethod
+    def last_messages(cls, session_ids):
+        """Return {session_id: latest ChatMessage} for ``session_ids`` in one query"""
+        session_ids = list(set(session_ids))
+        if not session_ids:
+            return {}
+        # Message ids grow with time, so the highest id per session is its latest message
+        ranked = db.select(ChatMessage.id, db.func.row_number().over(
+            partition_by=ChatMessage.session_id, order_by=ChatMessage.id.desc()
+        ).label('rank')).where(ChatMessage.session_id.in_(session_ids)).subquery()
+        messages = ChatMessage.query.join(ranked, ChatMessage.id == ranked.c.id).filter(ranked.c.rank == 1)
+        return {message.session_id: message for message in messages}
     
     def get_unread_count_for_user(self, user_id):
         """Get count of unread messages for a specific user"""
-        return ChatMessage.query.filter_by(
-            session_id=self.id,
-            is_read=False
-        ).filter(ChatMessage.sender_id != user_id).count()
-    
-    def mark_messages_as_read(self, user_id):
-        """Mark all messages as read for a specific user (except their own messages)"""
-        ChatMessage.query.filter_by(session_id=self.id).filter(
+        return ChatSession.unread_counts([self.id], user_id).get(self.id, 0)
+
+    @classmethod
+    def unread_counts(cls, session_ids, user_id):
+        """Return {session_id: unread message count} for ``user_id`` in one query.
+
+        Unread means newer than the user's read cursor and sent by someone
+        else; sessions with nothing unread are left out. Without a cursor
+        (a session the user never opened), messages sent before the user's
+        account was created count as read, so admins added later don't
+        inherit the whole chat history as unread.
+        """
+        session_ids = list(set(session_ids))
+        if not session_ids:
+            return {}
+        cursor = ChatReadCursor
+        joined = db.select(User.created_at).where(User.id == user_id).scalar_subquery()
+        # A range scan of ix_chat_message_session_id_id past each session's cursor
+        rows = db.session.query(ChatMessage.session_id, db.func.count(ChatMessage.id)).outerjoin(
+            cursor, db.and_(cursor.session_id == ChatMessage.session_id, cursor.user_id == user_id)
+        ).filter(
+            ChatMessage.session_id.in_(session_ids),
+            db.or_(ChatMessage.id > cursor.last_read_message_id,
+                   db.and_(cursor.last_read_message_id.is_(None), ChatMessage.created_at >= joined)),
             ChatMessage.sender_id != user_id
-        ).update({'is_read': True})
+        ).group_by(ChatMessage.session_id)
+        return dict(rows.all())
+    
+    def mark_messages_as_read(self, user_id, up_to_message_id=None):
+        """Mark the session read for a specific user, up to its latest message by default"""
+        if up_to_message_id is None:
+            up_to_message_id = db.session.query(db.func.max(ChatMessage.id)).filter(
+                ChatMessage.session_id == self.id).scalar()
+        if up_to_message_id is not None:
+            ChatReadCursor.advance(self.id, user_id, up_to_message_id)
         db.session.commit()
     
     def get_status_color(self):
@@ -651,8 +1154,39 @@ class ChatSession(db.Model):
     def __repr__(self):
         return f'<ChatSession {self.id} - {self.customer.username}>'
 
+# session.info key for chat session routing changes made in the current transaction
+CHAT_SESSION_CHANGES = 'chat_session_changes'
+
+@event.listens_for(ChatSession, 'after_insert')
+@event.listens_for(ChatSession, 'after_update')
+def _record_chat_session_state(mapper, connection, target):
+    changes = db.inspect(target).session.info.setdefault(CHAT_SESSION_CHANGES, {})
+    changes[target.id] = (target.status, target.agent_id, target.customer_id)
+
+
+@event.listens_for(ChatSession, 'after_delete')
+def _record_chat_session_delete(mapper, connection, target):
+    db.inspect(target).session.info.setdefault(CHAT_SESSION_CHANGES, {})[target.id] = None
+
+
+@event.listens_for(db.session, 'after_commit')
+def _publish_chat_session_states(session):
+    # Write-through to the socket handlers' cache (app/chat/state.py), here and in other workers
+    changes = session.info.pop(CHAT_SESSION_CHANGES, None)
+    if changes:
+        from app.chat.state import apply_changes
+        apply_changes(changes)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_chat_session_states(session):
+    session.info.pop(CHAT_SESSION_CHANGES, None)
+
 class ChatMessage(db.Model):
     """Individual chat message within a session"""
+    # History is paged by (session_id, id) cursors, see chat.api_get_session_messages
+    __table_args__ = (db.Index('ix_chat_message_session_id_id', 'session_id', 'id'),)
+
     id = db.Column(db.Integer, primary_key=True)
     session_id = db.Column(db.Integer, db.ForeignKey('chat_session.id'), nullable=False)
     sender_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -700,6 +1234,55 @@ class ChatMessage(db.Model):
     def __repr__(self):
         return f'<ChatMessage {self.id} from {self.sender.username}>'
 
+class ChatReadCursor(db.Model):
+    """The last message a participant has read in a chat session.
+
+    Replaces flagging every message row as read: marking a session read is
+    one upsert here, and unread counts are the messages after the cursor
+    (see ChatSession.unread_counts).
+    """
+    session_id = db.Column(db.Integer, db.ForeignKey('chat_session.id'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    last_read_message_id = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    @classmethod
+    def advance(cls, session_id, user_id, message_id):
+        """Move the cursor forward to ``message_id`` (never back). The caller commits."""
+        values = {'session_id': session_id, 'user_id': user_id,
+                  'last_read_message_id': message_id, 'updated_at': datetime.utcnow()}
+        dialect = db.session.get_bind().dialect.name
+        if dialect in ('postgresql', 'sqlite'):
+            if dialect == 'postgresql':
+                from sqlalchemy.dialects.postgresql import insert
+            else:
+                from sqlalchemy.dialects.sqlite import insert
+            statement = insert(cls).values(**values)
+            statement = statement.on_conflict_do_update(
+                index_elements=['session_id', 'user_id'],
+                set_={'last_read_message_id': statement.excluded.last_read_message_id,
+                      'updated_at': statement.excluded.updated_at},
+                where=cls.last_read_message_id < statement.excluded.last_read_message_id)
+        elif dialect == 'mysql':
+            from sqlalchemy.dialects.mysql import insert
+            statement = insert(cls).values(**values)
+            statement = statement.on_duplicate_key_update(
+                last_read_message_id=db.func.greatest(cls.last_read_message_id,
+                                                      statement.inserted.last_read_message_id),
+                updated_at=statement.inserted.updated_at)
+        else:
+            updated = cls.query.filter_by(session_id=session_id, user_id=user_id).filter(
+                cls.last_read_message_id < message_id
+            ).update({'last_read_message_id': message_id, 'updated_at': values['updated_at']},
+                     synchronize_session=False)
+            if not updated and not db.session.get(cls, (session_id, user_id)):
+                db.session.add(cls(**values))
+            return
+        db.session.execute(statement)
+
+    def __repr__(self):
+        return f'<ChatReadCursor session={self.session_id} user={self.user_id}: {self.last_read_message_id}>'
+
 class ChatNotification(db.Model):
     """Notifications for chat events"""
     id = db.Column(db.Integer, primary_key=True)
@@ -12,6 +12,8 @@ class AdminDashboard {
   this.customerTypingTimeout = null;
     
 this.displayedMessages = new Map(); // Track displayed messages per session to prevent duplicates
+  this.newestMessageIds = {}; // Highest message id shown per session, for catching up after a reconnect
+  this.subscribedSessions = new Set(); // Sessions this socket gets full traffic for (see subscribeSessions)
   this.skipClearOnClose = null; // session id that should not clear saved selection when we closed it locally
 this.initializeDashboard();
 this.setupEventListeners();
@@ -176,28 +178,30 @@ children.forEach(child => {
     // Listen for events
     this.socket.on('connect', () => {
       this.socket.emit('join_room', 'admins');
+
+      // Fetch anything the open conversation missed while disconnected
+      if (this.currentSessionId && this.newestMessageIds[this.currentSessionId]) {
+        this.catchUpMessages(this.currentSessionId);
+      }
       
-      // After a short delay, join all existing session rooms
-      // This ensures we receive real-time messages for all sessions
-      setTimeout(() => {
-        Object.keys(this.sessions).forEach(sessionId => {
-          const session = this.sessions[sessionId];
-          if (session) {
-            // Join session rooms silently to avoid emitting "Admin Joined" notifications
-            this.socket.emit('join_session', {
-              session_id: sessionId,
-              customer_name: session.customer_name || 'Customer',
-              silent: true
-            });
-          }
-        });
-      }, 1000);
+      // Rooms are per connection: subscribe again to our sessions
+      this.subscribeSessions();
     });
     
     this.socket.on('new_chat_session', (data) => {
       this.addNewChatSession(data);
     });
+
+    // Coalesced activity for the sessions we aren't subscribed to
+    this.socket.on('chat_summary', (data) => {
+      this.applyChatSummary(data);
+    });
     
+    // The server turned a message away (e.g. while it is overloaded)
+    this.socket.on('message_error', (data) => {
+      this.showNotification({ title: 'Message not sent', message: data.message });
+    });
+
     this.socket.on('message_sent', (data) => {
       try {
         const sessionId = data && data.session_id ? String(data.session_id) : null;
@@ -223,15 +227,6 @@ children.forEach(child => {
             unread_count: 1
           };
 
-          // Join the session room to receive further session-scoped events
-          if (this.socket) {
-            this.socket.emit('join_session', {
-              session_id: sessionId,
-              customer_name: this.sessions[sessionId].customer_name || 'Customer',
-              silent: true
-            });
-          }
-
           // Re-render so the new session appears in the list immediately (new sessions show at top thanks to sorting)
           this.renderChatSessions();
           this.updateSessionCounts();
@@ -249,6 +244,11 @@ children.forEach(child => {
 
         // Finally display the message (this will update previews and badges)
         this.displayMessage(messageObj);
+
+        // A message shown in the open session has been read; keep the cursor up with it
+        if (sessionId && String(this.currentSessionId) === sessionId && messageObj && messageObj.id) {
+          this.markSessionRead(sessionId, messageObj.id).catch(() => {});
+        }
       } catch (e) {
         // Fall back to original behavior on error
         try { this.displayMessage(data); } catch (e2) {}
@@ -405,31 +405,6 @@ children.forEach(child => {
       this.renderChatSessions();
       this.updateSessionCounts();
     });
-
-    // When server notifies that unread for a session was cleared (someone read it)
-    this.socket.on('session_unread_cleared', (data) => {
-      try {
-        const sessId = data.session_id;
-        // Update local model
-        if (this.sessions && this.sessions[sessId]) {
-          this.sessions[sessId].unread_count = 0;
-        }
-
-        // Remove badge from UI if present
-        const sessionElement = document.querySelector(`[data-session-id="${sessId}"]`);
-        if (sessionElement) {
-          const badge = sessionElement.querySelector('.session-unread-badge');
-          if (badge && badge.parentNode) {
-            badge.parentNode.removeChild(badge);
-          }
-        }
-
-        // Refresh counts
-        this.updateSessionCounts();
-      } catch (e) {
-        // ignore
-      }
-    });
   }
   
   loadDashboardData() {
@@ -470,22 +445,32 @@ children.forEach(child => {
   }
   
   loadChatSessions() {
-    return fetch('/messenger/api/sessions')
-      .then(response => response.json())
+    // Every open session (following has_next through the pages), plus the most recent closed ones
+    const fetchSessions = (query) => fetch(`/messenger/api/sessions?${query}`).then(response => response.json());
+    const fetchAllSessions = (query, page = 1) => fetchSessions(`${query}&page=${page}`).then(data => {
+      if (!data.success || !data.has_next) {
+        return data;
+      }
+      return fetchAllSessions(query, page + 1).then(rest => ({
+        success: rest.success,
+        sessions: data.sessions.concat(rest.sessions || [])
+      }));
+    });
+    return Promise.all([
+      fetchAllSessions('status=waiting,active&per_page=200'),
+      fetchSessions('status=closed&per_page=50')
+    ])
+      .then(([open, closed]) => ({
+        success: open.success && closed.success,
+        sessions: (open.sessions || []).concat(closed.sessions || [])
+      }))
       .then(data => {
         if (data.success) {
           this.sessions = {};
           data.sessions.forEach(session => {
             this.sessions[session.id] = session;
-            
-            // Join the session room to receive real-time messages
-            if (this.socket) {
-              this.socket.emit('join_session', {
-                session_id: session.id,
-                customer_name: session.customer_name || 'Customer'
-              });
-            }
           });
+          this.subscribeSessions();
           this.renderChatSessions();
           this.updateSessionCounts();
         }
@@ -673,6 +658,18 @@ children.forEach(child => {
     return sessionElement;
   }
   
+  markSessionRead(sessionId, upToMessageId) {
+    // Advance this admin's read cursor, to the session's latest message unless an id is given
+    return fetch(`/messenger/api/sessions/${sessionId}/mark_read`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+        'X-CSRFToken': document.querySelector('meta[name="csrf-token"]')?.getAttribute('content') || ''
+      },
+      body: JSON.stringify(upToMessageId ? { up_to_message_id: upToMessageId } : {})
+    });
+  }
+
   selectChatSession(sessionId) {
     // Update current session
     this.currentSessionId = sessionId;
@@ -708,13 +705,7 @@ children.forEach(child => {
 
     // Mark messages as read on the server for this session so unread counts clear
     try {
-      fetch(`/messenger/api/sessions/${sessionId}/mark_read`, {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-          'X-CSRFToken': document.querySelector('meta[name="csrf-token"]')?.getAttribute('content') || ''
-        }
-      }).then(() => {
+      this.markSessionRead(sessionId).then(() => {
         // Clear unread badge locally as well
         const sessionElement = document.querySelector(`[data-session-id="${sessionId}"]`);
         if (sessionElement) {
@@ -747,6 +738,8 @@ children.forEach(child => {
     
     // Also join the admins room to receive notifications
     this.socket.emit('join_room', 'admins');
+    // Leave the previously viewed session unless it's assigned to us
+    this.subscribeSessions();
 
     // Check session status and agent assignment to enable/disable buttons and input accordingly
     const session = this.sessions[sessionId];
@@ -999,19 +992,41 @@ children.forEach(child => {
     }
   }
   
-  loadSessionMessages(sessionId) {
-    fetch(`/messenger/api/sessions/${sessionId}/messages`)
+  loadSessionMessages(sessionId, beforeId = null) {
+    // The API returns the latest page; older pages are loaded on demand
+    const params = new URLSearchParams({ limit: 100 });
+    if (beforeId) params.set('before', beforeId);
+    fetch(`/messenger/api/sessions/${sessionId}/messages?${params}`)
       .then(response => response.json())
       .then(data => {
         if (data.success) {
           const messagesContainer = document.getElementById('chat-messages-container');
           if (messagesContainer) {
-            messagesContainer.innerHTML = '';
-            // Clear displayed messages for this session
-            if (this.displayedMessages.has(sessionId)) {
-              this.displayedMessages.delete(sessionId);
+            // Older pages go above what is shown: set the current messages aside while rendering
+            const newerMessages = document.createDocumentFragment();
+            if (beforeId) {
+              while (messagesContainer.firstChild) {
+                newerMessages.appendChild(messagesContainer.firstChild);
+              }
+              const oldButton = newerMessages.querySelector('.load-earlier-btn');
+              if (oldButton) oldButton.remove();
+            } else {
+              messagesContainer.innerHTML = '';
+              // Clear displayed messages for this session
+              if (this.displayedMessages.has(sessionId)) {
+                this.displayedMessages.delete(sessionId);
+              }
+              this.displayedMessages.set(sessionId, new Set());
+              delete this.newestMessageIds[sessionId];
+            }
+
+            if (data.has_more) {
+              const loadEarlier = document.createElement('button');
+              loadEarlier.className = 'btn btn-sm btn-link w-100 load-earlier-btn';
+              loadEarlier.textContent = 'Load earlier messages';
+              loadEarlier.addEventListener('click', () => this.loadSessionMessages(sessionId, data.oldest_id));
+              messagesContainer.appendChild(loadEarlier);
             }
-            this.displayedMessages.set(sessionId, new Set());
             
             data.messages.forEach(message => {
               // Use displayMessage function to ensure proper duplicate prevention
@@ -1022,13 +1037,33 @@ children.forEach(child => {
               };
               this.displayMessage(messageWithSessionId);
             });
-            this.scrollToBottom(messagesContainer);
+            messagesContainer.appendChild(newerMessages);
+            if (beforeId) {
+              messagesContainer.scrollTop = 0;
+            } else {
+              this.scrollToBottom(messagesContainer);
+            }
           }
         }
       })
       .catch(error => {
       });
   }
+
+  catchUpMessages(sessionId) {
+    const sinceId = this.newestMessageIds[sessionId];
+    fetch(`/messenger/api/sessions/${sessionId}/messages?since_id=${sinceId}&limit=200`)
+      .then(response => response.json())
+      .then(data => {
+        if (!data.success || sessionId !== this.currentSessionId) return;
+        data.messages.forEach(message => this.displayMessage({ ...message, session_id: sessionId }));
+        if (data.has_more) {
+          this.catchUpMessages(sessionId);
+        }
+      })
+      .catch(error => {
+      });
+  }
   
   loadCustomerContext(sessionId) {
     // Use the session data we already have. If customer context is missing, fetch full detail
@@ -1191,6 +1226,9 @@ children.forEach(child => {
     
     // Add message to displayed messages set for this session
     this.displayedMessages.get(messageData.session_id).add(messageIdentifier);
+    if (messageData.id && messageData.id > (this.newestMessageIds[messageData.session_id] || 0)) {
+      this.newestMessageIds[messageData.session_id] = messageData.id;
+    }
     
     // Update session data with the latest message only if this is a full message object
     // with session_id, otherwise it's just a notification
@@ -1453,19 +1491,8 @@ children.forEach(child => {
       }
     }
 
-    // Ensure we join the session room when it becomes active or waiting so we receive
-    // session-scoped events (typing, messages) even if the admin previously closed it.
-    if (this.socket && (data.status === 'active' || data.status === 'waiting')) {
-      try {
-        this.socket.emit('join_session', {
-          session_id: data.session_id,
-          customer_name: this.sessions[data.session_id] ? this.sessions[data.session_id].customer_name : 'Customer',
-          silent: true
-        });
-      } catch (e) {
-        // ignore join errors
-      }
-    }
+    // Assignment may have changed which sessions we should get full traffic for
+    this.subscribeSessions();
 
     // Update UI if this is the current session (coerce types)
     if (String(data.session_id) === String(this.currentSessionId)) {
@@ -1559,16 +1586,6 @@ children.forEach(child => {
       unread_count: 1
     };
     
-    // Join the session room to receive real-time messages
-    if (this.socket) {
-      // Join silently to avoid notifying other participants that the admin auto-joined
-      this.socket.emit('join_session', {
-        session_id: data.session_id,
-        customer_name: data.customer_name || 'Customer',
-        silent: true
-      });
-    }
-    
     // Always enable btn-group when customer joins new session for assignment
     // This ensures admins can immediately assign the new session
     if (this.currentSessionId === data.session_id) {
@@ -1632,6 +1649,53 @@ children.forEach(child => {
     }
   }
   
+  subscribeSessions() {
+    // Full session traffic (messages, typing) only for sessions assigned to us and the one
+    // on screen; the rest arrives as chat_summary previews on the admins room
+    if (!this.socket) return;
+    const sessionIds = Object.values(this.sessions)
+      .filter(session => session.status === 'active' && session.agent_id &&
+        String(session.agent_id) === String(this.currentAdminId))
+      .map(session => String(session.id));
+    if (this.currentSessionId && !sessionIds.includes(String(this.currentSessionId))) {
+      sessionIds.push(String(this.currentSessionId));
+    }
+    this.subscribedSessions = new Set(sessionIds);
+    this.socket.emit('subscribe_sessions', { session_ids: sessionIds });
+  }
+
+  applyChatSummary(data) {
+    (data.sessions || []).forEach(entry => {
+      const sessionId = String(entry.session_id);
+      // Subscribed sessions already received each message_sent
+      if (this.subscribedSessions.has(sessionId)) return;
+
+      let session = this.sessions[sessionId];
+      if (!session) {
+        session = this.sessions[sessionId] = {
+          id: sessionId,
+          customer_name: entry.customer_name || 'Customer',
+          status: 'waiting',
+          unread_count: 0
+        };
+      }
+      session.last_message = entry.last_message;
+      session.last_message_time = entry.last_message_time;
+      session.unread_count = (session.unread_count || 0) + (entry.unread || 0);
+    });
+
+    this.renderChatSessions();
+    this.updateSessionCounts();
+
+    // Server totals also cover sessions beyond the loaded list
+    if (data.counts) {
+      const activeCount = document.getElementById('active-chats-count');
+      const waitingCount = document.getElementById('waiting-chats-count');
+      if (activeCount) activeCount.textContent = data.counts.active || 0;
+      if (waitingCount) waitingCount.textContent = data.counts.waiting || 0;
+    }
+  }
+
   updateSessionCounts() {
     // Update active and waiting chat counts
     const activeCount = document.getElementById('active-chats-count');
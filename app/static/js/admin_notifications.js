@@ -51,19 +51,46 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     });
 
-    // Also listen for message_sent so admin dashboards can react to actual messages
-    socket.on('message_sent', function(data) {
-        console.log('message_sent received for admin:', data);
+    // Products that just dropped to (or below) their minimum stock level
+    socket.on('low_stock', function(data) {
+        const products = data.products || [];
+        if (!products.length) {
+            return;
+        }
 
-        // Update notification badge as a lightweight notification
         const notificationBadge = document.getElementById('navNotificationBadge');
         if (notificationBadge) {
             const currentCount = parseInt(notificationBadge.textContent) || 0;
-            notificationBadge.textContent = currentCount + 1;
+            notificationBadge.textContent = currentCount + products.length;
             notificationBadge.style.display = 'inline-block';
         }
 
-        // You may add UI logic here to insert the message into the admin messages list
+        if ('Notification' in window && Notification.permission === 'granted') {
+            const names = products.slice(0, 3).map(function(p) { return `${p.name} (${p.stock_quantity} left)`; });
+            if (products.length > 3) {
+                names.push(`and ${products.length - 3} more`);
+            }
+            new Notification('Low stock', {
+                body: names.join(', '),
+                icon: '/static/images/notification-icon.png'
+            });
+        }
+    });
+
+    // Coalesced chat activity: new customer messages per session since the last summary
+    socket.on('chat_summary', function(data) {
+        const unread = (data.sessions || []).reduce(function(total, entry) { return total + (entry.unread || 0); }, 0);
+        if (!unread) {
+            return;
+        }
+
+        // Update notification badge as a lightweight notification
+        const notificationBadge = document.getElementById('navNotificationBadge');
+        if (notificationBadge) {
+            const currentCount = parseInt(notificationBadge.textContent) || 0;
+            notificationBadge.textContent = currentCount + unread;
+            notificationBadge.style.display = 'inline-block';
+        }
     });
 
     // Listen for chat session assigned notifications
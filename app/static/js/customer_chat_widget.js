@@ -191,6 +191,16 @@ class CustomerChatWidget {
       this.socket.emit('get_agent_status');
     });
     
+    // The server turned a message away (e.g. while it is overloaded)
+    this.socket.on('message_error', (data) => {
+      this.displayMessageInWidget({
+        session_id: data.session_id,
+        message: data.message,
+        sender_type: 'system',
+        created_at: new Date().toISOString()
+      });
+    });
+
     this.socket.on('message_sent', (data) => {
       // Always display the message in the widget regardless of session ID
       // This ensures messages are displayed even before a session is established
@@ -0,0 +1,334 @@
+"""Content-addressed upload storage.
+
+Uploaded files are stored once per distinct content under
+``blobs/<sha[:2]>/<sha256><ext>``, so the same image uploaded for two
+products is kept once. ``StoredBlob`` rows count references:
+``save_upload`` adds one, ``release_upload`` removes one, and the file (with
+its image variants) is deleted after the commit that drops the count to zero.
+
+Backends:
+- ``LocalStorage`` writes under UPLOAD_FOLDER and is served as /static/uploads.
+- ``S3Storage`` talks to any S3-compatible API (AWS, MinIO, R2...). Tests run
+  it against ``FilesystemS3Client``, a directory-backed stand-in.
+
+Pick one with STORAGE_BACKEND ('local' or 's3'). Uploads are spooled to a
+temporary file in fixed-size chunks while hashing, then handed to the
+backend; S3 uploads are multipart for large files.
+"""
+import hashlib
+import mimetypes
+import os
+import shutil
+import tempfile
+from datetime import datetime, timezone
+
+from flask import current_app, url_for
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+
+CHUNK_SIZE = 64 * 1024
+BLOB_PREFIX = 'blobs'
+# save_upload() rounds of "reference the existing blob, else insert one" before giving up
+UPLOAD_ATTEMPTS = 3
+
+
+class LocalStorage:
+    """Files under ``root`` (UPLOAD_FOLDER), served by Flask's static route."""
+
+    def __init__(self, root, static_prefix='uploads'):
+        self.root = root
+        self.static_prefix = static_prefix
+
+    def _path(self, key):
+        path = os.path.normpath(os.path.join(self.root, key))
+        if not path.startswith(os.path.normpath(self.root) + os.sep):
+            raise ValueError(f'Storage key escapes the upload folder: {key!r}')
+        return path
+
+    def put_file(self, key, local_path, content_type=None):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Copy to a sibling temp name first so readers never see a partial file
+        tmp_path = path + '.part'
+        shutil.copyfile(local_path, tmp_path)
+        os.replace(tmp_path, path)
+
+    def open(self, key):
+        return open(self._path(key), 'rb')
+
+    def read_bytes(self, key):
+        with self.open(key) as f:
+            return f.read()
+
+    def exists(self, key):
+        return os.path.exists(self._path(key))
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def url(self, key):
+        return url_for('static', filename=f'{self.static_prefix}/{key}')
+
+    def list_keys(self, start_after=''):
+        """Yield ``(key, mtime)`` for every stored file in key order, lazily"""
+        yield from self._walk(self.root, '', start_after)
+
+    def _walk(self, path, prefix, start_after):
+        try:
+            entries = list(os.scandir(path))
+        except FileNotFoundError:
+            return
+        # Sorting directories as 'name/' makes the walk come out in plain string order
+        entries.sort(key=lambda e: e.name + '/' if e.is_dir() else e.name)
+        for entry in entries:
+            key = prefix + entry.name
+            if entry.is_dir():
+                subtree = key + '/'
+                if subtree < start_after and not start_after.startswith(subtree):
+                    continue
+                yield from self._walk(entry.path, subtree, start_after)
+            elif key > start_after:
+                yield key, entry.stat().st_mtime
+
+
+class S3Storage:
+    """Objects in an S3-compatible bucket, served from ``public_url``."""
+
+    def __init__(self, bucket, client, prefix='', public_url=None):
+        self.bucket = bucket
+        self.client = client
+        self.prefix = prefix.strip('/') + '/' if prefix else ''
+        self.public_url = (public_url or '').rstrip('/')
+
+    def _key(self, key):
+        return self.prefix + key
+
+    def put_file(self, key, local_path, content_type=None):
+        extra = {'ContentType': content_type} if content_type else {}
+        if key.startswith(BLOB_PREFIX + '/') or '/variants/' in f'/{key}':
+            # Content-addressed: the object at this key never changes
+            extra['CacheControl'] = 'public, max-age=31536000, immutable'
+        # upload_file streams from disk and switches to multipart for large files
+        self.client.upload_file(local_path, self.bucket, self._key(key), ExtraArgs=extra)
+
+    def open(self, key):
+        body = self.client.get_object(Bucket=self.bucket, Key=self._key(key))['Body']
+        spool = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+        for chunk in iter(lambda: body.read(CHUNK_SIZE), b''):
+            spool.write(chunk)
+        spool.seek(0)
+        return spool
+
+    def read_bytes(self, key):
+        return self.client.get_object(Bucket=self.bucket, Key=self._key(key))['Body'].read()
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+            return True
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            code = getattr(e, 'response', {}).get('Error', {}).get('Code')
+            if code in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+
+    def url(self, key):
+        return f'{self.public_url}/{self._key(key)}'
+
+    def list_keys(self, start_after=''):
+        """Yield ``(key, mtime)`` for every stored object in key order, a page at a time"""
+        params = {'Bucket': self.bucket, 'Prefix': self.prefix}
+        if start_after:
+            params['StartAfter'] = self._key(start_after)
+        while True:
+            page = self.client.list_objects_v2(**params)
+            for obj in page.get('Contents', []):
+                yield obj['Key'][len(self.prefix):], obj['LastModified'].timestamp()
+            if not page.get('IsTruncated'):
+                return
+            params['ContinuationToken'] = page['NextContinuationToken']
+
+
+class FilesystemS3Client:
+    """Directory-backed stand-in for the handful of boto3 S3 calls S3Storage uses"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, bucket, key):
+        return os.path.join(self.root, bucket, key)
+
+    def upload_file(self, Filename, Bucket, Key, ExtraArgs=None):
+        path = self._path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.copyfile(Filename, path)
+
+    def get_object(self, Bucket, Key):
+        return {'Body': open(self._path(Bucket, Key), 'rb')}
+
+    def head_object(self, Bucket, Key):
+        path = self._path(Bucket, Key)
+        if not os.path.exists(path):
+            raise FileNotFoundError(Key)
+        return {'ContentLength': os.path.getsize(path)}
+
+    def delete_object(self, Bucket, Key):
+        try:
+            os.remove(self._path(Bucket, Key))
+        except FileNotFoundError:
+            pass
+
+    def list_objects_v2(self, Bucket, Prefix='', StartAfter='', ContinuationToken=None, MaxKeys=1000):
+        base = os.path.join(self.root, Bucket)
+        keys = sorted(
+            os.path.relpath(os.path.join(dirpath, name), base).replace(os.sep, '/')
+            for dirpath, _, names in os.walk(base) for name in names
+        )
+        after = ContinuationToken or StartAfter
+        keys = [k for k in keys if k.startswith(Prefix) and k > after]
+        page = keys[:MaxKeys]
+        contents = [{'Key': k, 'LastModified': datetime.fromtimestamp(
+            os.path.getmtime(self._path(Bucket, k)), timezone.utc)} for k in page]
+        result = {'Contents': contents, 'IsTruncated': len(keys) > MaxKeys}
+        if result['IsTruncated']:
+            result['NextContinuationToken'] = page[-1]
+        return result
+
+
+def upload_root(app=None):
+    """Absolute UPLOAD_FOLDER; relative values are taken from the project root"""
+    app = app or current_app
+    return os.path.join(os.path.dirname(app.root_path), app.config['UPLOAD_FOLDER'])
+
+
+def get_storage(app=None):
+    app = app or current_app._get_current_object()
+    storage = app.extensions.get('storage')
+    if storage is None:
+        if app.config.get('STORAGE_BACKEND') == 's3':
+            import boto3  # type: ignore
+            client = boto3.client('s3', endpoint_url=app.config.get('S3_ENDPOINT_URL'))
+            storage = S3Storage(app.config['S3_BUCKET'], client,
+                                prefix=app.config.get('S3_PREFIX', ''),
+                                public_url=app.config.get('S3_PUBLIC_URL'))
+        else:
+            storage = LocalStorage(upload_root(app))
+        app.extensions['storage'] = storage
+    return storage
+
+
+def blob_key(sha, ext):
+    return f'{BLOB_PREFIX}/{sha[:2]}/{sha}{ext}'
+
+
+def save_upload(file_storage):
+    """Store an uploaded file by content and take a reference to it.
+
+    Returns the storage key to save on the model. The reference is part of
+    the current DB transaction; the caller commits.
+    """
+    from app.models import StoredBlob
+
+    storage = get_storage()
+    ext = os.path.splitext(file_storage.filename or '')[1].lower() or '.bin'
+    digest = hashlib.sha256()
+    size = 0
+    with tempfile.NamedTemporaryFile(suffix=ext) as tmp:
+        for chunk in iter(lambda: file_storage.stream.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+            size += len(chunk)
+            tmp.write(chunk)
+        tmp.flush()
+        sha = digest.hexdigest()
+
+        for _ in range(UPLOAD_ATTEMPTS):
+            # Reference an existing blob in one UPDATE, so a concurrent release that
+            # deletes the row can't slip in between finding it and counting the reference
+            if StoredBlob.query.filter_by(sha256=sha).update(
+                    {StoredBlob.ref_count: StoredBlob.ref_count + 1}, synchronize_session=False):
+                key = db.session.query(StoredBlob.key).filter_by(sha256=sha).scalar()
+                if storage.exists(key):
+                    return key
+                break
+            key = blob_key(sha, ext)
+            try:
+                with db.session.begin_nested():
+                    db.session.add(StoredBlob(sha256=sha, key=key, size=size, ref_count=1,
+                                              content_type=mimetypes.guess_type(key)[0]))
+                break
+            except IntegrityError:
+                # A concurrent first upload of the same content inserted the row meanwhile
+                continue
+        else:
+            raise RuntimeError(f'Could not reference stored blob {sha}')
+        storage.put_file(key, tmp.name, mimetypes.guess_type(key)[0])
+    return key
+
+
+def release_upload(key):
+    """Drop one reference to ``key``; the file goes once nothing points at it.
+
+    Keys from before content addressing have no StoredBlob row and are
+    deleted outright, as they were only ever referenced once.
+    """
+    from app.models import StoredBlob
+
+    if not key or key.startswith('http') or '/' not in key:
+        return  # External URL or a bundled placeholder such as default.jpg
+    blob = StoredBlob.query.filter_by(key=key).first()
+    if blob is not None:
+        StoredBlob.query.filter_by(id=blob.id).update(
+            {StoredBlob.ref_count: StoredBlob.ref_count - 1}, synchronize_session=False)
+        # Only remove the row if no concurrent upload re-referenced it in the meantime
+        removed = StoredBlob.query.filter(
+            StoredBlob.id == blob.id, StoredBlob.ref_count <= 0
+        ).delete(synchronize_session=False)
+        db.session.expunge(blob)
+        if not removed:
+            return
+    db.session.info.setdefault('storage_deletes', []).append(key)
+
+
+def _delete_blob_files(storage, key):
+    from app.images import variant_keys, content_hash
+    for variant_key in variant_keys(storage, key):
+        storage.delete(variant_key)
+    storage.delete(key)
+    sha = content_hash(key)
+    if sha:
+        current_app.cache_delete(f'img_variants:{sha}')
+
+
+@event.listens_for(db.session, 'after_commit')
+def _delete_released_files(session):
+    keys = session.info.pop('storage_deletes', None)
+    if not keys:
+        return
+    from app.models import StoredBlob
+
+    storage = get_storage()
+    for key in keys:
+        try:
+            # SQL can't go through the just-committed session; a concurrent upload may
+            # have re-created the blob since, in which case the file must stay
+            with db.engine.connect() as conn:
+                if conn.execute(db.select(StoredBlob.id).where(StoredBlob.key == key)).first():
+                    continue
+            _delete_blob_files(storage, key)
+        except Exception:
+            current_app.logger.exception(f'Failed to delete released upload {key}')
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _forget_released_files(session):
+    session.info.pop('storage_deletes', None)
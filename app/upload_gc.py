@@ -0,0 +1,195 @@
+"""Orphaned upload collection and image consistency checks.
+
+Compares what is in storage with what the database points at, without
+holding either side in memory: storage keys are listed in key order, each
+image column is streamed in the same order, and the two are walked together
+as a sorted merge. That finds
+
+- orphans: stored files nothing references (left behind by crashes, failed
+  requests or the old one-off scripts), optionally deleted in batches, and
+- missing files: ``ProductImage``/``Category``/``User`` rows and
+  ``StoredBlob`` entries whose file is gone.
+
+Image variants (``variants/<sha[:2]>/<sha>/...``) belong to their blob and
+live as long as its ``StoredBlob`` row does. Runs can be capped with
+``limit`` and resumed from the returned checkpoint, so large catalogs can be
+swept a slice at a time.
+"""
+import heapq
+import time
+
+from flask import current_app
+
+from app import db
+from app.images import VARIANT_DIR, variant_prefix
+from app.models import Category, ProductImage, StoredBlob, User
+from app.storage import get_storage
+
+STREAM_BATCH = 1000
+
+# (model, column, label) for every column that may hold an upload key
+IMAGE_COLUMNS = (
+    (ProductImage, ProductImage.image_url, 'product_image'),
+    (Category, Category.image, 'category'),
+    (User, User.profile_image, 'user'),
+    (StoredBlob, StoredBlob.key, 'stored_blob'),
+)
+
+
+class OutOfOrderError(RuntimeError):
+    """A stream did not come back in key order, so the merge can't be trusted"""
+
+
+def is_upload_key(value):
+    # External URLs (OAuth avatars) and bare bundled names like default.jpg aren't uploads
+    return bool(value) and not value.startswith('http') and '/' in value
+
+
+def owner_key(key):
+    """The key a stored file lives or dies with: variants map to their blob's prefix"""
+    parts = key.split('/')
+    if parts[0] == VARIANT_DIR and len(parts) > 3:
+        return '/'.join(parts[:3])
+    return key
+
+
+def _binary_order(column):
+    # Storage lists keys in byte order; make the database sort the same way
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        return column.collate('C')
+    if dialect == 'mysql':
+        return column.collate('utf8mb4_bin')
+    return column
+
+
+def _stream_column(column, label, start_after):
+    query = (db.select(column)
+             .where(column.isnot(None), column > start_after)
+             .order_by(_binary_order(column))
+             .execution_options(yield_per=STREAM_BATCH))
+    for value in db.session.execute(query).scalars():
+        if is_upload_key(value):
+            yield value, label
+
+
+def _stream_variant_owners(start_after):
+    query = (db.select(StoredBlob.sha256)
+             .order_by(StoredBlob.sha256)
+             .execution_options(yield_per=STREAM_BATCH))
+    for sha in db.session.execute(query).scalars():
+        prefix = variant_prefix(sha)
+        if prefix > start_after:
+            yield prefix, ''
+
+
+def iter_references(start_after=''):
+    """Yield ``(key, labels)`` for every referenced upload key, in key order.
+
+    ``labels`` names the tables pointing at the key; it is empty for a
+    variant prefix, which is only implied by its blob.
+    """
+    streams = [_stream_column(column, label, start_after) for _, column, label in IMAGE_COLUMNS]
+    streams.append(_stream_variant_owners(start_after))
+    current, labels = None, set()
+    for key, label in heapq.merge(*streams):
+        if current is not None and key < current:
+            raise OutOfOrderError(f'Reference {key!r} sorted after {current!r}')
+        if key != current:
+            if current is not None:
+                yield current, labels
+            current, labels = key, set()
+        if label:
+            labels.add(label)
+    if current is not None:
+        yield current, labels
+
+
+def _still_unreferenced(owners):
+    """Re-check a batch just before deleting, in case an upload landed mid-scan"""
+    owners = set(owners)
+    taken = set()
+    for _, column, _ in IMAGE_COLUMNS:
+        taken.update(db.session.execute(db.select(column).where(column.in_(owners))).scalars())
+    shas = {owner.rsplit('/', 1)[-1] for owner in owners if owner.startswith(VARIANT_DIR + '/')}
+    if shas:
+        taken.update(variant_prefix(sha) for sha in db.session.execute(
+            db.select(StoredBlob.sha256).where(StoredBlob.sha256.in_(shas))).scalars())
+    return owners - taken
+
+
+def collect_garbage(storage=None, delete=False, batch_size=500, limit=None, start_after='',
+                    min_age=3600, on_orphan=None, on_missing=None):
+    """Diff storage against the image tables and optionally delete orphans.
+
+    Files younger than ``min_age`` seconds are never treated as orphans:
+    an upload is written to storage before its row is committed. With
+    ``limit`` the scan stops after about that many files; pass the returned
+    ``checkpoint`` back as ``start_after`` to continue. A finished pass
+    returns ``checkpoint=None``.
+
+    ``on_orphan(key)`` and ``on_missing(key, labels)`` are called as
+    problems are found, so callers can report without collecting them all.
+    """
+    storage = storage or get_storage()
+    cutoff = time.time() - min_age
+    refs = iter_references(start_after)
+    ref = next(refs, None)
+    summary = {'scanned': 0, 'orphans': 0, 'deleted': 0, 'missing': 0,
+               'skipped_recent': 0, 'checkpoint': None}
+    pending = []
+
+    def report_missing(key, labels):
+        # A blob without variants is just not rendered yet; only real rows count
+        if labels:
+            summary['missing'] += 1
+            if on_missing:
+                on_missing(key, labels)
+
+    def flush():
+        orphaned = _still_unreferenced(owner for owner, _ in pending)
+        for owner, key in pending:
+            if owner in orphaned:
+                storage.delete(key)
+                summary['deleted'] += 1
+        pending.clear()
+
+    last_owner = None
+    for key, mtime in storage.list_keys(start_after):
+        owner = owner_key(key)
+        if start_after and owner <= start_after:
+            continue  # Rest of a variant set finished by the previous run
+        if last_owner is not None and owner < last_owner:
+            raise OutOfOrderError(f'Storage key {key!r} listed after {last_owner!r}')
+        if limit and summary['scanned'] >= limit and owner != last_owner:
+            summary['checkpoint'] = last_owner
+            break
+        summary['scanned'] += 1
+
+        while ref is not None and ref[0] < owner:
+            if ref[0] != last_owner:
+                report_missing(*ref)
+            ref = next(refs, None)
+        if ref is None or ref[0] != owner:
+            if mtime > cutoff:
+                summary['skipped_recent'] += 1
+            else:
+                summary['orphans'] += 1
+                if on_orphan:
+                    on_orphan(key)
+                if delete:
+                    pending.append((owner, key))
+                    if len(pending) >= batch_size:
+                        flush()
+        last_owner = owner
+
+    if summary['checkpoint'] is None:
+        # Storage is exhausted, so every reference left over has no file
+        while ref is not None:
+            if ref[0] != last_owner:
+                report_missing(*ref)
+            ref = next(refs, None)
+    if pending:
+        flush()
+    current_app.logger.info(f'Upload GC: {summary}')
+    return summary
@@ -112,6 +112,102 @@ with app.app_context():
         else:
             print(f"Error updating attachment_url column: {e}")
     
+    # Approved-review aggregates on product (see Product.refresh_ratings)
+    for column, definition in (("rating_count", "INTEGER NOT NULL DEFAULT 0"),
+                               ("rating_average", "FLOAT NOT NULL DEFAULT 0")):
+        try:
+            cursor.execute(f"ALTER TABLE product ADD COLUMN {column} {definition}")
+            print(f"Added {column} column to product")
+        except sqlite3.OperationalError as e:
+            if "duplicate column name" in str(e):
+                print(f"{column} column already exists in product")
+            else:
+                print(f"Error adding {column} column: {e}")
+    cursor.execute("""
+        UPDATE product SET
+            rating_count = (SELECT COUNT(*) FROM review
+                            WHERE review.product_id = product.id AND review.is_approved = 1),
+            rating_average = COALESCE((SELECT AVG(rating) FROM review
+                                       WHERE review.product_id = product.id AND review.is_approved = 1), 0)
+    """)
+    print("Refreshed product rating aggregates")
+    
+    # Move 2FA backup codes from the legacy user.backup_codes JSON blob into the
+    # backup_code table (created by init_database.py), hashing them on the way.
+    try:
+        import json
+        from datetime import datetime
+        from app.models import BackupCode
+        rows = cursor.execute(
+            "SELECT id, backup_codes FROM user WHERE backup_codes IS NOT NULL AND backup_codes != ''"
+        ).fetchall()
+        for user_id, blob in rows:
+            for code in json.loads(blob) or []:
+                cursor.execute(
+                    "INSERT OR IGNORE INTO backup_code (user_id, code_hash, created_at) VALUES (?, ?, ?)",
+                    (user_id, BackupCode.hash(code), datetime.utcnow())
+                )
+            cursor.execute("UPDATE user SET backup_codes = NULL WHERE id = ?", (user_id,))
+        print(f"Moved backup codes for {len(rows)} users into backup_code")
+    except sqlite3.OperationalError as e:
+        print(f"Skipped backup code migration: {e}")
+    
+    # Seed the low-stock set (see LowStockAlert) from current stock levels
+    try:
+        cursor.execute("""
+            INSERT OR IGNORE INTO low_stock_alert (product_id, stock_quantity, min_stock_level, created_at)
+            SELECT id, stock_quantity, min_stock_level, CURRENT_TIMESTAMP FROM product
+            WHERE is_active = 1 AND stock_quantity <= min_stock_level
+        """)
+        print(f"Seeded {cursor.rowcount} low stock alerts")
+    except sqlite3.OperationalError as e:
+        print(f"Skipped low stock alert seeding: {e}")
+    
+    # Seed chat read cursors (see ChatReadCursor) from the legacy per-message is_read
+    # flags: each customer and admin has read a session up to just before its first
+    # message still flagged unread, or else up to its latest message
+    try:
+        cursor.execute("""
+            INSERT OR IGNORE INTO chat_read_cursor (session_id, user_id, last_read_message_id, updated_at)
+            SELECT s.id, u.id,
+                   COALESCE((SELECT MIN(m.id) - 1 FROM chat_message m
+                             WHERE m.session_id = s.id AND m.is_read = 0 AND m.sender_id != u.id),
+                            (SELECT MAX(m.id) FROM chat_message m WHERE m.session_id = s.id), 0),
+                   CURRENT_TIMESTAMP
+            FROM chat_session s JOIN user u ON u.id = s.customer_id OR u.is_admin = 1
+        """)
+        print(f"Seeded {cursor.rowcount} chat read cursors")
+    except sqlite3.OperationalError as e:
+        print(f"Skipped chat read cursor seeding: {e}")
+    
+    # Sales rollups built before RollupState existed were recognised by having rows
+    try:
+        cursor.execute("""
+            INSERT OR IGNORE INTO rollup_state (name, built_at)
+            SELECT 'daily_sales', CURRENT_TIMESTAMP WHERE EXISTS (SELECT 1 FROM daily_sales)
+        """)
+        print(f"Marked {cursor.rowcount} existing sales rollups as built")
+    except sqlite3.OperationalError as e:
+        print(f"Skipped rollup state seeding: {e}")
+    
+    # Add indexes declared on the models to databases created before they existed.
+    # New tables themselves are created by init_database.py (db.create_all()).
+    indexes = [
+        ("ix_order_status", '"order"', "status"),
+        ("ix_order_payment_status", '"order"', "payment_status"),
+        ("ix_order_user_id_id", '"order"', "user_id, id"),
+        ("ix_order_item_order_id", "order_item", "order_id"),
+        ("ix_user_phone", '"user"', "phone"),
+        ("ix_order_created_at", '"order"', "created_at"),
+        ("ix_chat_message_session_id_id", "chat_message", "session_id, id"),
+    ]
+    for name, table, columns in indexes:
+        try:
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})")
+            print(f"Ensured index {name}")
+        except sqlite3.OperationalError as e:
+            print(f"Error creating index {name}: {e}")
+    
     # Commit changes and close connection
     conn.commit()
     conn.close()
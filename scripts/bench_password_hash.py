@@ -0,0 +1,51 @@
+"""Measure password verification throughput for candidate hash settings.
+
+Usage:
+    python scripts/bench_password_hash.py [method ...] [--seconds N]
+
+Example:
+    python scripts/bench_password_hash.py scrypt:32768:8:1 scrypt:16384:8:1 pbkdf2:sha256:600000
+
+Prints the time per verification and verifications/second for a single core,
+which is what one login costs a worker. Pick the strongest setting that still
+leaves headroom for peak login traffic, then set PASSWORD_HASH_METHOD.
+"""
+import sys
+import time
+from werkzeug.security import generate_password_hash, check_password_hash
+
+DEFAULT_METHODS = ['scrypt:32768:8:1', 'scrypt:16384:8:1', 'pbkdf2:sha256:1000000', 'pbkdf2:sha256:600000']
+
+
+def bench(method, seconds):
+    pwhash = generate_password_hash('correct horse battery staple', method=method)
+    runs = 0
+    start = time.perf_counter()
+    while True:
+        check_password_hash(pwhash, 'correct horse battery staple')
+        runs += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= seconds:
+            return elapsed / runs, runs / elapsed
+
+
+def main(argv):
+    seconds = 2.0
+    if '--seconds' in argv:
+        i = argv.index('--seconds')
+        seconds = float(argv[i + 1])
+        argv = argv[:i] + argv[i + 2:]
+    methods = argv or DEFAULT_METHODS
+
+    print(f'{"method":<28} {"ms/verify":>10} {"verify/s/core":>14}')
+    for method in methods:
+        try:
+            per_call, rate = bench(method, seconds)
+        except ValueError as e:
+            print(f'{method:<28} error: {e}')
+            continue
+        print(f'{method:<28} {per_call * 1000:>10.1f} {rate:>14.1f}')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,6 @@
+import os
+
+# create_app() reads DATABASE_URL when it is called, so point it at an
+# in-memory database before any test builds an app. Without this the tests
+# run against (and drop) the development database in instance/.
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
@@ -0,0 +1,39 @@
+import gzip
+
+import pytest
+
+from app import create_app
+from app.assets import build_assets, asset_url
+
+
+@pytest.fixture
+def app_instance(tmp_path):
+    (tmp_path / 'css').mkdir()
+    (tmp_path / 'css' / 'site.css').write_text('body { color: green; }\n' * 50)
+    app = create_app()
+    app.config['TESTING'] = True
+    app.static_folder = str(tmp_path)
+    return app
+
+
+def test_build_and_serve_precompressed(app_instance, tmp_path):
+    with app_instance.test_request_context():
+        assert asset_url('css/site.css') == '/static/css/site.css'
+
+    manifest = build_assets(str(tmp_path))
+    built = manifest['css/site.css']
+    assert built.startswith('dist/css/site.') and built.endswith('.css')
+
+    with app_instance.test_request_context():
+        assert asset_url('css/site.css') == f'/static/{built}'
+
+    client = app_instance.test_client()
+    response = client.get(f'/static/{built}', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Content-Type'].startswith('text/css')
+    assert 'immutable' in response.headers['Cache-Control']
+    assert gzip.decompress(response.data) == (tmp_path / 'css' / 'site.css').read_bytes()
+
+    plain = client.get(f'/static/{built}')
+    assert 'Content-Encoding' not in plain.headers
+    assert plain.data == (tmp_path / 'css' / 'site.css').read_bytes()
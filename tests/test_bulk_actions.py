@@ -0,0 +1,143 @@
+import pytest
+
+from app import create_app, db, mail
+from app.admin import bulk
+from app.models import Category, Order, OrderEvent, OrderStatusCount, Product, Review, User
+
+
+@pytest.fixture
+def app_instance():
+    app = create_app()
+    app.config['TESTING'] = True
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['BULK_EMAIL_SYNC'] = True
+    app.config['MAIL_DEFAULT_SENDER'] = 'shop@example.com'
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def admin(app_instance):
+    user = User(username='admin', email='admin@example.com', first_name='Ada', last_name='Admin', is_admin=True)
+    user.set_password('x')
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def _make_customer(name):
+    user = User(username=name, email=f'{name}@example.com', first_name=name.title(), last_name='Customer')
+    user.set_password('x')
+    db.session.add(user)
+    db.session.flush()
+    return user
+
+
+def _make_order(user_id, number):
+    order = Order(
+        order_number=number,
+        user_id=user_id,
+        subtotal=10,
+        total_amount=12,
+        shipping_first_name='Test',
+        shipping_last_name='Customer',
+        shipping_email='cust@example.com',
+        shipping_address='1 Road',
+        shipping_city='Accra',
+        shipping_country='Ghana',
+    )
+    db.session.add(order)
+    db.session.flush()
+    order.record_created()
+    return order
+
+
+def test_bulk_transition_skips_disallowed_orders(app_instance, admin):
+    customer = _make_customer('cust')
+    assert OrderStatusCount.counts('status')['pending'] == 0
+    pending = [_make_order(customer.id, f'ORD-{n}') for n in range(3)]
+    cancelled = _make_order(customer.id, 'ORD-X')
+    cancelled.transition(status='cancelled')
+    db.session.commit()
+
+    ids = [order.id for order in pending + [cancelled]]
+    changed = bulk.update_order_status(ids, 'confirmed', actor_id=admin.id, note='bulk')
+    db.session.commit()
+
+    assert sorted(changed) == sorted(order.id for order in pending)
+    db.session.expire_all()
+    assert [order.status for order in pending] == ['confirmed'] * 3
+    assert cancelled.status == 'cancelled'
+
+    counts = OrderStatusCount.counts('status')
+    assert (counts['pending'], counts['confirmed'], counts['cancelled']) == (0, 3, 1)
+    events = OrderEvent.query.filter_by(to_value='confirmed').all()
+    assert len(events) == 3
+    assert {(e.from_value, e.actor_id, e.note) for e in events} == {('pending', admin.id, 'bulk')}
+
+
+def test_bulk_status_route_emails_all_matching_orders(app_instance, admin, monkeypatch):
+    # Flask-Mail reads TESTING at init time, before the fixture sets it
+    monkeypatch.setattr(app_instance.extensions['mail'], 'suppress', True)
+    customer = _make_customer('cust')
+    for n in range(3):
+        _make_order(customer.id, f'ORD-{n}').transition(status='processing')
+    db.session.commit()
+
+    client = app_instance.test_client()
+    with client.session_transaction() as sess:
+        sess['_user_id'] = str(admin.id)
+        sess['_fresh'] = True
+
+    with mail.record_messages() as outbox:
+        response = client.post('/admin/orders/bulk_status', data={
+            'status': 'shipped', 'all_matching': '1', 'filter_search': 'ORD-',
+        })
+    assert response.status_code == 302
+
+    db.session.expire_all()
+    orders = Order.query.all()
+    assert {order.status for order in orders} == {'shipped'}
+    assert all(order.shipped_at is not None for order in orders)
+    assert len(outbox) == 3
+
+
+def test_moderate_reviews_refreshes_ratings(app_instance):
+    customer = _make_customer('cust')
+    category = Category(name='Teas')
+    db.session.add(category)
+    db.session.flush()
+    product = Product(name='Green Tea', price=3, sku='TEA-1', category_id=category.id)
+    db.session.add(product)
+    db.session.flush()
+    reviews = [Review(user_id=customer.id, product_id=product.id, rating=rating, is_approved=False)
+               for rating in (5, 4, 1)]
+    db.session.add_all(reviews)
+    db.session.commit()
+
+    assert bulk.moderate_reviews([r.id for r in reviews[:2]], 'approve') == 2
+    db.session.commit()
+    db.session.refresh(product)
+    assert (product.rating_count, product.get_average_rating()) == (2, 4.5)
+
+    assert bulk.moderate_reviews([reviews[0].id], 'delete') == 1
+    db.session.commit()
+    db.session.refresh(product)
+    assert (product.rating_count, product.get_average_rating()) == (1, 4.0)
+
+
+def test_set_users_active_keeps_current_admin(app_instance, admin):
+    customers = [_make_customer(name) for name in ('ann', 'bob')]
+    db.session.commit()
+
+    ids = [admin.id] + [customer.id for customer in customers]
+    assert bulk.set_users_active(ids, False, keep_id=admin.id) == 2
+    db.session.commit()
+    db.session.expire_all()
+
+    assert admin.is_active is True
+    assert [customer.is_active for customer in customers] == [False, False]
@@ -0,0 +1,83 @@
+import io
+import json
+import os
+
+import pytest
+from werkzeug.datastructures import FileStorage
+
+from app import create_app, db
+from app.admin.catalog_import import error_report_path, start_import
+from app.models import Category, Product
+
+
+@pytest.fixture
+def app_instance(tmp_path):
+    app = create_app()
+    app.config['TESTING'] = True
+    app.config['PRODUCT_IMPORT_SYNC'] = True
+    app.config['PRODUCT_IMPORT_BATCH'] = 2
+    app.instance_path = str(tmp_path)
+
+    with app.app_context():
+        db.create_all()
+        category = Category(name='Teas')
+        db.session.add(category)
+        db.session.flush()
+        db.session.add(Product(name='Green Tea', price=3, sku='TEA-1', stock_quantity=4, category_id=category.id))
+        db.session.commit()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+def _upload(name, text):
+    return FileStorage(stream=io.BytesIO(text.encode('utf-8')), filename=name)
+
+
+def test_csv_import_upserts_and_reports_errors(app_instance):
+    app_instance.cache_set('featured_products', ['stale'])
+    csv_text = (
+        'sku,name,price,stock_quantity,category\n'
+        'TEA-1,,3.50,10,\n'               # price/stock update, name left alone
+        'TEA-2,Black Tea,4,7,teas\n'      # new product, category by name
+        'TEA-3,Mint Tea,-1,2,Teas\n'      # invalid price
+        'TEA-4,Chai,5,1,Coffee\n'         # unknown category
+        'TEA-5,Rooibos,,3,Teas\n'         # new product without a price
+        'TEA-2,,,9,\n'                    # later row for a SKU created earlier in the file
+    )
+    job = start_import(app_instance, _upload('catalog.csv', csv_text))
+
+    assert job.status == 'done'
+    assert (job.rows_processed, job.rows_created, job.rows_failed) == (6, 1, 3)
+    assert job.percent == 100
+
+    existing = Product.query.filter_by(sku='TEA-1').one()
+    assert (existing.name, float(existing.price), existing.stock_quantity) == ('Green Tea', 3.5, 10)
+    created = Product.query.filter_by(sku='TEA-2').one()
+    assert (created.name, created.stock_quantity, created.is_active) == ('Black Tea', 9, True)
+    assert Product.query.count() == 2
+
+    with open(error_report_path(app_instance, job.id)) as f:
+        report = f.read().splitlines()
+    assert report[0] == 'line,sku,error'
+    assert report[1:] == [
+        '4,TEA-3,price: must be zero or more',
+        "5,TEA-4,category: no category named 'Coffee'",
+        '6,TEA-5,new product needs price',
+    ]
+    assert app_instance.cache_get('featured_products') is None
+    assert os.listdir(os.path.join(app_instance.instance_path, 'imports')) == [f'{job.id}-errors.csv']
+
+
+def test_jsonl_import(app_instance):
+    lines = [json.dumps({'sku': 'TEA-1', 'is_featured': True}), 'not json',
+             json.dumps({'sku': 'OIL-1', 'name': 'Oil', 'price': 9, 'category_id': 1})]
+    job = start_import(app_instance, _upload('catalog.jsonl', '\n'.join(lines)))
+
+    assert (job.status, job.rows_created, job.rows_updated, job.rows_failed) == ('done', 1, 1, 1)
+    assert Product.query.filter_by(sku='TEA-1').one().is_featured is True
+
+
+def test_rejects_unknown_file_type(app_instance):
+    with pytest.raises(ValueError):
+        start_import(app_instance, _upload('catalog.xlsx', 'x'))
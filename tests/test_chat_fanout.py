@@ -0,0 +1,91 @@
+import pytest
+
+from app import create_app, db, socketio
+from app.chat import fanout
+from app.chat.fanout import ChatSummary
+from app.models import ChatSession, User
+
+
+@pytest.fixture
+def app_instance():
+    app = create_app()
+    app.config['TESTING'] = True
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def emitted(monkeypatch):
+    events = []
+    monkeypatch.setattr(fanout.socketio, 'emit', lambda name, data, room=None: events.append((name, room, data)))
+    # The summary is flushed by hand below
+    monkeypatch.setattr(fanout.socketio, 'start_background_task', lambda target: None)
+    return events
+
+
+def _payload(session_id, text, sender_type='customer'):
+    return {'session_id': session_id, 'message': text, 'sender_type': sender_type,
+            'sender_name': 'Test Customer', 'created_at': '2026-01-01T10:00:00'}
+
+
+def test_summary_coalesces_messages_per_session(app_instance, emitted):
+    customer = User(username='cust', email='cust@example.com', first_name='Test', last_name='Customer')
+    customer.set_password('x')
+    db.session.add(customer)
+    db.session.flush()
+    for status in ('waiting', 'waiting', 'active'):
+        db.session.add(ChatSession(customer_id=customer.id, status=status))
+    db.session.commit()
+
+    summary = ChatSummary(app_instance)
+    summary.note_message(_payload(1, 'first'))
+    summary.note_message(_payload(1, 'second  ' + 'x' * 100))
+    summary.note_message(_payload(2, 'reply', sender_type='agent'))
+    assert emitted == []
+
+    assert summary.flush() == 2
+    assert len(emitted) == 1
+    name, room, data = emitted[0]
+    assert (name, room) == ('chat_summary', 'admins')
+    first, second = data['sessions']
+    assert first['unread'] == 2 and first['customer_name'] == 'Test Customer'
+    assert first['last_message'].startswith('second x') and len(first['last_message']) == fanout.PREVIEW_LENGTH
+    assert (second['unread'], second['last_message']) == (0, 'reply')
+    assert data['counts'] == {'waiting': 2, 'active': 1}
+
+    # Nothing new: no event, and the flusher stops
+    assert summary.flush() == 0
+    assert len(emitted) == 1
+
+
+def test_subscribe_sessions_replaces_admin_rooms(app_instance):
+    socketio.init_app(app_instance, async_mode='threading')
+    admin = User(username='agent', email='agent@example.com', first_name='Test', last_name='Agent', is_admin=True)
+    admin.set_password('x')
+    db.session.add(admin)
+    db.session.commit()
+
+    flask_client = app_instance.test_client()
+    with flask_client.session_transaction() as sess:
+        sess['_user_id'] = str(admin.id)
+        sess['_fresh'] = True
+    client = socketio.test_client(app_instance, flask_test_client=flask_client)
+    try:
+        sid = client.eio_sid
+        server = socketio.server
+
+        def session_rooms():
+            return sorted(room for room in server.rooms(server.manager.sid_from_eio_sid(sid, '/'))
+                          if room.startswith('session_'))
+
+        assert client.emit('subscribe_sessions', {'session_ids': [3, '5', 'x']}, callback=True) == {'subscribed': 2}
+        assert session_rooms() == ['session_3', 'session_5']
+
+        client.emit('subscribe_sessions', {'session_ids': [5, 7]}, callback=True)
+        assert session_rooms() == ['session_5', 'session_7']
+    finally:
+        client.disconnect()
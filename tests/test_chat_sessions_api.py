@@ -0,0 +1,130 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from app import create_app, db
+from app.models import ChatMessage, ChatSession, Order, User
+
+
+@pytest.fixture
+def app_instance():
+    app = create_app()
+    app.config['TESTING'] = True
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+def _make_user(name, is_admin=False):
+    user = User(username=name, email=f'{name}@example.com', first_name=name.title(), last_name='User',
+                is_admin=is_admin)
+    user.set_password('x')
+    db.session.add(user)
+    db.session.flush()
+    return user
+
+
+def _make_order(user_id, number, created_at):
+    db.session.add(Order(order_number=number, user_id=user_id, subtotal=10, total_amount=12,
+                         shipping_first_name='Test', shipping_last_name='Customer',
+                         shipping_email='cust@example.com', shipping_address='1 Road',
+                         shipping_city='Accra', shipping_country='Ghana', created_at=created_at))
+
+
+@pytest.fixture
+def client(app_instance):
+    base = datetime(2024, 1, 1)
+    admin = _make_user('admin', is_admin=True)
+    admin.created_at = base  # Older messages would count as read without a read cursor
+    for n in range(6):
+        customer = _make_user(f'cust{n}')
+        session = ChatSession(customer_id=customer.id, agent_id=admin.id if n % 2 else None,
+                              status='closed' if n < 2 else 'waiting', subject=f'S{n}',
+                              created_at=base + timedelta(hours=n), updated_at=base + timedelta(hours=n))
+        db.session.add(session)
+        db.session.flush()
+        for m in range(3):
+            db.session.add(ChatMessage(session_id=session.id, sender_id=customer.id, message=f'm{n}-{m}',
+                                       created_at=base + timedelta(hours=n, minutes=m)))
+        for o in range(7):
+            _make_order(customer.id, f'ORD-{n}-{o}', base + timedelta(days=o))
+    db.session.commit()
+
+    client = app_instance.test_client()
+    with client.session_transaction() as sess:
+        sess['_user_id'] = str(admin.id)
+        sess['_fresh'] = True
+    return client
+
+
+def test_sessions_page_uses_a_fixed_number_of_queries(app_instance, client):
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        data = client.get('/messenger/api/sessions?status=waiting&per_page=3').get_json()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+
+    assert data['success']
+    assert (data['total'], data['has_next'], len(data['sessions'])) == (4, True, 3)
+    assert data['counts'] == {'waiting': 4, 'active': 0, 'closed': 2}
+
+    newest = data['sessions'][0]
+    assert newest['subject'] == 'S5'
+    assert newest['last_message'] == 'm5-2'
+    assert newest['agent_name'] == 'Admin User'
+    assert newest['unread_count'] == 3
+    assert [o['order_number'] for o in newest['recent_orders']] == [f'ORD-5-{o}' for o in (6, 5, 4, 3, 2)]
+
+    # Independent of the number of sessions on the page: user, count, page,
+    # last messages, unread counts, recent orders and status counts
+    assert len(statements) <= 7
+
+
+def test_since_returns_only_changed_sessions(app_instance, client):
+    since = datetime(2024, 1, 1, 4, 30)
+    quiet = ChatSession.query.filter_by(subject='S1').one()
+    db.session.add(ChatMessage(session_id=quiet.id, sender_id=quiet.customer_id, message='late',
+                               created_at=since + timedelta(minutes=1)))
+    db.session.commit()
+
+    data = client.get(f'/messenger/api/sessions?since={since.isoformat()}').get_json()
+    assert [s['subject'] for s in data['sessions']] == ['S5', 'S1']
+    assert data['sessions'][1]['last_message'] == 'late'
+    assert client.get('/messenger/api/sessions?since=yesterday').status_code == 400
+    assert client.get('/messenger/api/sessions?status=bogus').status_code == 400
+
+
+def test_message_history_cursor_pagination(app_instance, client):
+    session = ChatSession.query.filter_by(subject='S5').one()
+    agent = User.query.filter_by(username='admin').one()
+    for m in range(3, 8):
+        db.session.add(ChatMessage(session_id=session.id, sender_id=agent.id, message=f'm5-{m}'))
+    db.session.commit()
+    url = f'/messenger/api/sessions/{session.id}/messages'
+
+    latest = client.get(f'{url}?limit=3').get_json()
+    assert [m['message'] for m in latest['messages']] == ['m5-5', 'm5-6', 'm5-7']
+    assert latest['has_more'] is True
+    assert {m['sender_type'] for m in latest['messages']} == {'agent'}
+
+    older = client.get(f"{url}?limit=3&before={latest['oldest_id']}").get_json()
+    assert [m['message'] for m in older['messages']] == ['m5-2', 'm5-3', 'm5-4']
+    oldest = client.get(f"{url}?limit=3&before={older['oldest_id']}").get_json()
+    assert [m['message'] for m in oldest['messages']] == ['m5-0', 'm5-1']
+    assert oldest['has_more'] is False
+    assert oldest['messages'][0]['sender_name'] == 'Cust5 User'
+
+    caught_up = client.get(f"{url}?since_id={older['newest_id']}").get_json()
+    assert [m['message'] for m in caught_up['messages']] == ['m5-5', 'm5-6', 'm5-7']
+    assert caught_up['has_more'] is False
+
+    # after=0 is a cursor (from the start), not a missing one that falls back to the latest page
+    from_start = client.get(f'{url}?limit=3&after=0').get_json()
+    assert [m['message'] for m in from_start['messages']] == ['m5-0', 'm5-1', 'm5-2']
+    assert from_start['has_more'] is True
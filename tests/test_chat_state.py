@@ -0,0 +1,122 @@
+import pytest
+from sqlalchemy import event
+
+from app import create_app, db
+from app.chat import state as chat_state
+from app.chat.state import SessionState, SessionStateCache, session_state
+from app.models import ChatSession, User
+
+
+@pytest.fixture
+def app_instance():
+    app = create_app()
+    app.config['TESTING'] = True
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def users(app_instance):
+    customer = User(username='cust', email='cust@example.com', first_name='Test', last_name='Customer')
+    agent = User(username='agent', email='agent@example.com', first_name='Test', last_name='Agent', is_admin=True)
+    for user in (customer, agent):
+        user.set_password('x')
+        db.session.add(user)
+    db.session.commit()
+    return customer.id, agent.id
+
+
+def _count_state_loads():
+    # Only the narrow status/agent/customer lookup, not ORM refreshes of the test's own objects
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().startswith('SELECT chat_session.status AS'):
+            statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    return statements, lambda: event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def test_commits_write_through_without_queries(app_instance, users):
+    customer_id, agent_id = users
+    session = ChatSession(customer_id=customer_id, status='waiting')
+    db.session.add(session)
+    db.session.commit()
+    session_id = session.id
+
+    statements, stop = _count_state_loads()
+    try:
+        assert session_state(session_id) == SessionState('waiting', None, customer_id)
+
+        session.agent_id = agent_id
+        session.status = 'active'
+        db.session.commit()
+        assert session_state(session_id) == SessionState('active', agent_id, customer_id)
+
+        session.status = 'closed'
+        db.session.commit()
+        assert session_state(session_id).status == 'closed'
+        assert statements == []
+    finally:
+        stop()
+
+    db.session.delete(session)
+    db.session.commit()
+    assert session_state(session_id) is None
+
+
+def test_rolled_back_changes_are_not_cached(app_instance, users):
+    session = ChatSession(customer_id=users[0], status='waiting')
+    db.session.add(session)
+    db.session.commit()
+
+    session.status = 'closed'
+    db.session.flush()
+    db.session.rollback()
+
+    assert session_state(session.id).status == 'waiting'
+
+
+def test_miss_loads_once_and_ignores_unknown_ids(app_instance, users):
+    session = ChatSession(customer_id=users[0], status='waiting')
+    db.session.add(session)
+    db.session.commit()
+    cache, _ = chat_state._get_state()
+    cache.clear()
+
+    statements, stop = _count_state_loads()
+    try:
+        assert session_state(str(session.id)).status == 'waiting'
+        assert session_state(session.id).status == 'waiting'
+        assert len(statements) == 1
+        assert session_state(9999) is None
+        assert session_state('abc') is None
+    finally:
+        stop()
+
+
+def test_load_racing_a_commit_is_not_cached():
+    cache = SessionStateCache()
+    version = cache.version
+    # A commit lands between the load and the put: the loaded row may predate it
+    cache.apply({1: ('closed', None, 5)})
+    cache.put(1, SessionState('waiting', None, 5), version=version)
+    assert cache.get(1).status == 'closed'
+
+
+def test_entries_expire_and_are_bounded(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(chat_state.time, 'monotonic', lambda: now[0])
+    cache = SessionStateCache(ttl=10, max_size=2)
+    for session_id in (1, 2, 3):
+        cache.put(session_id, SessionState('waiting', None, None))
+
+    assert cache.get(1) is None
+    assert cache.get(3) is not None
+    now[0] += 11
+    assert cache.get(3) is None
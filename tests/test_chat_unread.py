@@ -0,0 +1,152 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from app import create_app, db
+from app.models import ChatMessage, ChatReadCursor, ChatSession, User
+
+
+@pytest.fixture
+def app_instance():
+    app = create_app()
+    app.config['TESTING'] = True
+    app.config['WTF_CSRF_ENABLED'] = False
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def chat(app_instance):
+    users = {}
+    for name, is_admin in (('cust', False), ('agent', True), ('other', True)):
+        user = users[name] = User(username=name, email=f'{name}@example.com', first_name=name.title(),
+                                  last_name='User', is_admin=is_admin)
+        user.set_password('x')
+        db.session.add(user)
+    db.session.flush()
+    sessions = []
+    for n in range(2):
+        session = ChatSession(customer_id=users['cust'].id, agent_id=users['agent'].id, status='active')
+        db.session.add(session)
+        db.session.flush()
+        sessions.append(session)
+    db.session.commit()
+    return users, sessions
+
+
+def _say(session, user, text):
+    message = ChatMessage(session_id=session.id, sender_id=user.id, message=text)
+    db.session.add(message)
+    db.session.commit()
+    return message
+
+
+def test_unread_counts_follow_read_cursors(app_instance, chat):
+    users, (first, second) = chat
+    cust, agent = users['cust'], users['agent']
+    for n in range(3):
+        _say(first, cust, f'question {n}')
+    _say(second, cust, 'hello')
+    _say(first, agent, 'answer')
+
+    assert ChatSession.unread_counts([first.id, second.id], agent.id) == {first.id: 3, second.id: 1}
+    assert ChatSession.unread_counts([first.id, second.id], cust.id) == {first.id: 1}
+
+    first.mark_messages_as_read(agent.id)
+    assert first.get_unread_count_for_user(agent.id) == 0
+    # Read state is per participant
+    assert first.get_unread_count_for_user(cust.id) == 1
+    assert first.get_unread_count_for_user(users['other'].id) == 4
+
+    _say(first, cust, 'one more')
+    assert ChatSession.unread_counts([first.id, second.id], agent.id) == {first.id: 1, second.id: 1}
+
+
+def test_mark_read_is_one_upsert_that_never_moves_back(app_instance, chat):
+    users, (session, _) = chat
+    cust, agent = users['cust'], users['agent']
+    early_id = _say(session, cust, 'early').id
+    late_id = _say(session, cust, 'late').id
+    session_id, agent_id = session.id, agent.id
+
+    # Ignore ORM refreshes of the test's own expired objects
+    statements = []
+    listener = lambda conn, cursor, statement, *args: (
+        statements.append(statement) if 'chat_message' in statement or 'chat_read_cursor' in statement else None)
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        session.mark_messages_as_read(agent_id, up_to_message_id=late_id)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+    assert len(statements) == 1 and statements[0].startswith('INSERT INTO chat_read_cursor')
+
+    session.mark_messages_as_read(agent_id, up_to_message_id=early_id)
+    assert db.session.get(ChatReadCursor, (session_id, agent_id)).last_read_message_id == late_id
+
+
+def test_deleting_a_session_drops_its_cursors(app_instance, chat):
+    users, (session, _) = chat
+    _say(session, users['cust'], 'hi')
+    session.mark_messages_as_read(users['agent'].id)
+
+    db.session.delete(session)
+    db.session.commit()
+    assert ChatReadCursor.query.count() == 0
+
+
+def test_without_a_cursor_only_messages_since_the_user_joined_are_unread(app_instance, chat):
+    users, (session, _) = chat
+    cust = users['cust']
+    _say(session, cust, 'before the new admin')
+    newcomer = User(username='newcomer', email='newcomer@example.com', first_name='New', last_name='User',
+                    is_admin=True, created_at=datetime.utcnow() + timedelta(seconds=1))
+    newcomer.set_password('x')
+    db.session.add(newcomer)
+    db.session.commit()
+    assert session.get_unread_count_for_user(newcomer.id) == 0
+
+    db.session.add(ChatMessage(session_id=session.id, sender_id=cust.id, message='after',
+                               created_at=newcomer.created_at + timedelta(seconds=1)))
+    db.session.commit()
+    assert session.get_unread_count_for_user(newcomer.id) == 1
+    # Participants who joined before the history still see all of it
+    assert session.get_unread_count_for_user(users['other'].id) == 2
+
+
+def test_mark_read_route_accepts_up_to_message_id(app_instance, chat):
+    users, (session, other_session) = chat
+    cust, agent = users['cust'], users['agent']
+    first_id = _say(session, cust, 'first').id
+    _say(session, cust, 'second')
+    foreign_id = _say(other_session, cust, 'elsewhere').id
+    session_id, agent_id = session.id, agent.id
+    client = app_instance.test_client()
+    with client.session_transaction() as sess:
+        sess['_user_id'] = str(agent_id)
+    url = f'/messenger/api/sessions/{session_id}/mark_read'
+
+    assert client.post(url, json={'up_to_message_id': first_id}).get_json()['success']
+    assert ChatSession.unread_counts([session_id], agent_id) == {session_id: 1}
+    assert client.post(url, json={'up_to_message_id': 'x'}).status_code == 400
+
+    # An id from another session only covers this session's messages before it
+    client.post(url, json={'up_to_message_id': foreign_id})
+    assert db.session.get(ChatReadCursor, (session_id, agent_id)).last_read_message_id == foreign_id - 1
+    assert ChatSession.unread_counts([session_id], agent_id) == {}
+
+
+def test_deleting_a_user_drops_their_cursors(app_instance, chat):
+    db.session.execute(db.text('PRAGMA foreign_keys=ON'))
+    users, (session, _) = chat
+    _say(session, users['cust'], 'hi')
+    session.mark_messages_as_read(users['other'].id)
+    session.mark_messages_as_read(users['agent'].id)
+
+    db.session.delete(users['other'])
+    db.session.commit()
+    assert [cursor.user_id for cursor in ChatReadCursor.query] == [users['agent'].id]
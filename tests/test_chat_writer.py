@@ -0,0 +1,102 @@
+import pytest
+from sqlalchemy import event
+
+from app import create_app, db, socketio
+from app.chat import writer as chat_writer
+from app.chat.writer import ChatWriter
+from app.models import ChatMessage, ChatSession, User
+
+
+@pytest.fixture
+def app_instance():
+    app = create_app()
+    app.config['TESTING'] = True
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def session_id(app_instance):
+    user = User(username='cust', email='cust@example.com', first_name='Test', last_name='Customer')
+    user.set_password('x')
+    db.session.add(user)
+    db.session.flush()
+    session = ChatSession(customer_id=user.id, status='active')
+    db.session.add(session)
+    db.session.commit()
+    return session.id
+
+
+@pytest.fixture
+def emitted(monkeypatch):
+    events = []
+    monkeypatch.setattr(chat_writer.socketio, 'emit',
+                        lambda name, data, room=None: events.append((name, room, data['message'], data['id'])))
+    return events
+
+
+def _fields(session_id, text, sender_id=1):
+    return {'session_id': session_id, 'sender_id': sender_id, 'message': text, 'message_type': 'text'}
+
+
+def _item(session_id, text, sender_id=1):
+    return chat_writer.PendingMessage(_fields(session_id, text, sender_id), [f'session_{session_id}'],
+                                      'Test Customer', 'customer')
+
+
+def test_batch_is_committed_once_and_emitted_in_order(app_instance, session_id, emitted):
+    writer = ChatWriter(app_instance)
+    commits = []
+    on_commit = lambda conn: commits.append(conn)
+    event.listen(db.engine, 'commit', on_commit)
+    try:
+        writer.write([_item(session_id, f'msg {n}') for n in range(5)])
+    finally:
+        event.remove(db.engine, 'commit', on_commit)
+
+    assert len(commits) == 1
+    rows = ChatMessage.query.order_by(ChatMessage.id).all()
+    assert [m.message for m in rows] == [f'msg {n}' for n in range(5)]
+    assert [(room, text, message_id) for _, room, text, message_id in emitted] == [
+        (f'session_{session_id}', m.message, m.id) for m in rows]
+    stats = writer.stats()
+    assert (stats['batches'], stats['written'], stats['failed']) == (1, 5, 0)
+    assert stats['avg_commit_ms'] is not None
+
+
+def test_bad_message_does_not_lose_the_batch(app_instance, session_id, emitted):
+    writer = ChatWriter(app_instance)
+    # sender_id is NOT NULL, so the middle message can't be stored
+    writer.write([_item(session_id, 'first'), _item(session_id, 'broken', sender_id=None),
+                  _item(session_id, 'last')])
+
+    assert [m.message for m in ChatMessage.query.order_by(ChatMessage.id)] == ['first', 'last']
+    assert [text for _, _, text, _ in emitted] == ['first', 'last']
+    assert (writer.written, writer.failed) == (2, 1)
+
+
+def test_full_queue_turns_senders_away(app_instance, session_id):
+    writer = ChatWriter(app_instance, queue_size=1, put_timeout=0.01)
+    writer._started = True  # no writer task draining the queue
+
+    assert writer.submit(_fields(session_id, 'a'), [], 'Test Customer', 'customer') == (True, None)
+    accepted, error = writer.submit(_fields(session_id, 'b'), [], 'Test Customer', 'customer')
+
+    assert not accepted and error
+    assert writer.stats()['queued'] == 1
+    assert (writer.stats()['rejected'], writer.stats()['max_queued']) == (1, 1)
+
+
+def test_background_writer_groups_messages(app_instance, session_id, emitted):
+    socketio.init_app(app_instance, async_mode='threading')
+    writer = ChatWriter(app_instance, batch_size=10, flush_interval=0.05)
+    for n in range(6):
+        writer.submit(_fields(session_id, f'msg {n}'), [f'session_{session_id}'], 'Test Customer', 'customer')
+    writer._queue.join()
+
+    assert [text for _, _, text, _ in emitted] == [f'msg {n}' for n in range(6)]
+    assert writer.batches < 6
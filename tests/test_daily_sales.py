@@ -0,0 +1,120 @@
+from datetime import date, datetime
+
+import pytest
+
+from app import create_app, db
+from app.models import Category, DailyProductSales, DailySales, Order, OrderItem, Product, User
+
+
+@pytest.fixture
+def app_instance():
+    app = create_app()
+    app.config['TESTING'] = True
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def shop(app_instance):
+    user = User(username='cust', email='cust@example.com', first_name='Test', last_name='Customer')
+    user.set_password('x')
+    category = Category(name='Teas')
+    db.session.add_all([user, category])
+    db.session.flush()
+    tea = Product(name='Tea', price=5, category_id=category.id)
+    oil = Product(name='Oil', price=8, category_id=category.id)
+    db.session.add_all([tea, oil])
+    db.session.commit()
+    return user, tea, oil
+
+
+def _order(shop, number, created_at, lines):
+    user = shop[0]
+    order = Order(order_number=number, user_id=user.id, subtotal=0, total_amount=0, created_at=created_at,
+                  shipping_first_name='Test', shipping_last_name='Customer',
+                  shipping_email='cust@example.com', shipping_address='1 Road',
+                  shipping_city='Accra', shipping_country='Ghana')
+    for product, quantity in lines:
+        order.items.append(OrderItem(product_id=product.id, quantity=quantity, unit_price=product.price,
+                                     total_price=product.price * quantity, product_name=product.name))
+    order.total_amount = sum(item.total_price for item in order.items)
+    db.session.add(order)
+    db.session.flush()
+    order.record_created()
+    return order
+
+
+def _totals():
+    days = {row.day: (row.order_count, float(row.revenue)) for row in DailySales.query}
+    products = {(row.day, row.product_id): (row.quantity, float(row.revenue)) for row in DailyProductSales.query}
+    return days, products
+
+
+def test_rebuild_groups_paid_orders_by_day(shop):
+    user, tea, oil = shop
+    first = _order(shop, 'ORD-1', datetime(2026, 3, 1, 9), [(tea, 2), (oil, 1)])
+    second = _order(shop, 'ORD-2', datetime(2026, 3, 1, 23), [(tea, 1)])
+    _order(shop, 'ORD-3', datetime(2026, 3, 2, 9), [(oil, 1)])  # never paid
+    for order in (first, second):
+        order.transition(status='confirmed', payment_status='paid')
+    db.session.commit()
+
+    DailySales.rebuild()
+    days, products = _totals()
+    assert days == {date(2026, 3, 1): (2, 23.0)}
+    assert products == {(date(2026, 3, 1), tea.id): (3, 15.0), (date(2026, 3, 1), oil.id): (1, 8.0)}
+
+
+def test_payment_transitions_keep_rollup_in_step(shop):
+    user, tea, oil = shop
+    assert not DailySales.is_built()  # Nothing is bumped before the first rebuild
+    _order(shop, 'ORD-0', datetime(2026, 3, 1, 8), [(oil, 1)]).transition(payment_status='paid')
+    db.session.commit()
+    assert _totals() == ({}, {})
+    DailySales.rebuild()
+
+    order = _order(shop, 'ORD-1', datetime(2026, 3, 2, 9), [(tea, 2)])
+    order.transition(status='confirmed', payment_status='paid')
+    db.session.commit()
+    days, products = _totals()
+    assert days[date(2026, 3, 2)] == (1, 10.0)
+    assert products[(date(2026, 3, 2), tea.id)] == (2, 10.0)
+
+    order.transition(payment_status='refunded')
+    db.session.commit()
+    days, products = _totals()
+    assert days[date(2026, 3, 2)] == (0, 0.0)
+    assert products[(date(2026, 3, 2), tea.id)] == (0, 0.0)
+
+    incremental = _totals()
+    DailySales.rebuild(since=date(2026, 3, 2))
+    rebuilt = _totals()
+    assert rebuilt[0][date(2026, 3, 1)] == incremental[0][date(2026, 3, 1)]
+    assert date(2026, 3, 2) not in rebuilt[0]
+
+
+def test_empty_rollup_counts_as_built(shop, app_instance, monkeypatch):
+    admin = User(username='admin', email='admin@example.com', first_name='A', last_name='Admin', is_admin=True)
+    admin.set_password('x')
+    db.session.add(admin)
+    db.session.commit()
+    client = app_instance.test_client()
+    with client.session_transaction() as sess:
+        sess['_user_id'] = str(admin.id)
+
+    rebuilds = []
+    rebuild = DailySales.rebuild
+    monkeypatch.setattr(DailySales, 'rebuild', lambda since=None: (rebuilds.append(since), rebuild(since))[1])
+    assert client.get('/admin/analytics').status_code == 200
+    assert client.get('/admin/analytics/export').status_code == 200
+    assert client.get('/admin/analytics').status_code == 200
+    assert rebuilds == [None]  # No paid orders, yet only the first request rebuilt
+    assert DailySales.is_built() and DailySales.query.count() == 0
+
+    _order(shop, 'ORD-1', datetime(2026, 3, 1, 9), [(shop[1], 1)]).transition(payment_status='paid')
+    db.session.commit()
+    assert _totals()[0] == {date(2026, 3, 1): (1, 5.0)}
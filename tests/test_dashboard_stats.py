@@ -0,0 +1,84 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from app import create_app, db
+from app.admin.stats import compute_stats, dashboard_stats
+from app.models import Category, Order, Product, User
+
+
+@pytest.fixture
+def app_instance():
+    app = create_app()
+    app.config['TESTING'] = True
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+def _order(user_id, number, amount, created_at, payment_status='paid'):
+    return Order(order_number=number, user_id=user_id, subtotal=amount, total_amount=amount,
+                 payment_status=payment_status, created_at=created_at,
+                 shipping_first_name='Test', shipping_last_name='Customer',
+                 shipping_email='cust@example.com', shipping_address='1 Road',
+                 shipping_city='Accra', shipping_country='Ghana')
+
+
+@pytest.fixture
+def now(app_instance):
+    now = datetime(2026, 3, 10, 12, 0)
+    user = User(username='cust', email='cust@example.com', first_name='Test', last_name='Customer',
+                created_at=now - timedelta(days=40))
+    user.set_password('x')
+    db.session.add(user)
+    db.session.add(User(username='new', email='new@example.com', first_name='New', last_name='User',
+                        password_hash='x', created_at=now.replace(hour=1)))
+    category = Category(name='Teas')
+    db.session.add(category)
+    db.session.flush()
+    db.session.add_all([
+        Product(name='A', price=1, category_id=category.id, stock_quantity=0),
+        Product(name='B', price=1, category_id=category.id, stock_quantity=3),
+        Product(name='C', price=1, category_id=category.id, stock_quantity=50),
+        Product(name='D', price=1, category_id=category.id, stock_quantity=0, is_active=False),
+    ])
+    db.session.add_all([
+        _order(user.id, 'ORD-1', 10, now.replace(hour=0, minute=5)),
+        _order(user.id, 'ORD-2', 20, now - timedelta(days=3)),
+        _order(user.id, 'ORD-3', 40, now - timedelta(days=20)),
+        _order(user.id, 'ORD-4', 80, now - timedelta(days=90)),
+        _order(user.id, 'ORD-5', 160, now, payment_status='pending'),
+    ])
+    db.session.commit()
+    return now
+
+
+def test_compute_stats(now):
+    stats = compute_stats(now)
+
+    assert stats['total_sales'] == 150
+    assert stats['today_sales'] == 10
+    assert stats['week_sales'] == 30
+    assert stats['month_sales'] == 70
+    assert stats['today_orders'] == 2
+    assert stats['total_orders'] == 5
+    assert stats['pending_orders'] == 5
+    assert (stats['total_products'], stats['low_stock_products'], stats['out_of_stock_products']) == (3, 2, 1)
+    assert (stats['total_users'], stats['new_users_today']) == (2, 1)
+
+
+def test_cached_stats_skip_database(app_instance, now):
+    first = dashboard_stats()
+
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        assert dashboard_stats() == first
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+    assert statements == []
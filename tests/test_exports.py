@@ -0,0 +1,74 @@
+import csv
+import gzip
+import io
+import json
+
+import pytest
+
+from app import create_app, db
+from app.models import Newsletter, Order, User
+
+
+@pytest.fixture
+def app_instance():
+    app = create_app()
+    app.config['TESTING'] = True
+    app.config['WTF_CSRF_ENABLED'] = False
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app_instance):
+    admin = User(username='admin', email='admin@example.com', first_name='Ad', last_name='Min', is_admin=True)
+    admin.set_password('x')
+    db.session.add(admin)
+    db.session.flush()
+    db.session.add_all(
+        Order(order_number=f'ORD-{n:05d}', user_id=admin.id, subtotal=n, total_amount=n,
+              payment_status='paid' if n % 2 else 'pending',
+              shipping_first_name='=cmd()' if n == 1 else 'Test', shipping_last_name='Customer',
+              shipping_email='cust@example.com', shipping_address='1 Road',
+              shipping_city='Accra', shipping_country='Ghana')
+        for n in range(1, 3001))
+    db.session.add(Newsletter(email='reader@example.com'))
+    db.session.commit()
+
+    client = app_instance.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(admin.id)
+        session['_fresh'] = True
+    return client
+
+
+def test_order_export_streams_filtered_rows(client):
+    response = client.get('/admin/orders/export?payment_status=paid')
+    assert response.is_streamed
+    assert 'attachment; filename="orders-' in response.headers['Content-Disposition']
+
+    rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+    assert len(rows) == 1500
+    assert {row['payment_status'] for row in rows} == {'paid'}
+    assert rows[0]['order_number'] == 'ORD-02999'  # Newest first
+    assert rows[-1]['shipping_first_name'] == "'=cmd()"  # Neutralised for spreadsheets
+
+
+def test_gzipped_json_export(client):
+    response = client.get('/admin/orders/export?format=json&gzip=1&search=ORD-0001')
+    assert response.mimetype == 'application/gzip'
+    assert response.headers['Content-Disposition'].endswith('.json.gz"')
+
+    data = json.loads(gzip.decompress(response.get_data()))
+    assert [row['order_number'] for row in data][:2] == ['ORD-00019', 'ORD-00018']
+    assert data[0]['total_amount'] == '19.00'
+
+
+def test_newsletter_export(client):
+    response = client.get('/admin/newsletter/export')
+    rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+    assert rows[0] == ['email', 'subscribed_at']
+    assert rows[1][0] == 'reader@example.com'
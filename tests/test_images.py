@@ -0,0 +1,52 @@
+import io
+import os
+
+import pytest
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+
+from app import create_app, db
+from app.images import save_image_upload, image_srcset, thumbnail_url, content_hash, variant_prefix
+
+
+@pytest.fixture
+def app_instance(tmp_path):
+    app = create_app()
+    app.config['TESTING'] = True
+    app.config['UPLOAD_FOLDER'] = str(tmp_path)
+    app.config['IMAGE_VARIANTS_SYNC'] = True
+    app.config['SERVER_NAME'] = 'localhost'
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+def _upload(color='red', size=(1600, 900)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, format='PNG')
+    buffer.seek(0)
+    return FileStorage(stream=buffer, filename='photo.PNG')
+
+
+def test_variants_and_srcset(app_instance, tmp_path):
+    path = save_image_upload(_upload())
+    db.session.commit()
+    out_dir = tmp_path / variant_prefix(content_hash(path))
+
+    assert sorted(os.listdir(out_dir)) == sorted(
+        ['manifest.json'] + [f'{name}.{ext}' for name in ('thumb', '320', '640', '1280') for ext in ('webp', 'jpg')]
+    )
+    with Image.open(out_dir / 'thumb.jpg') as thumb:
+        assert thumb.size == (200, 200)
+
+    srcset = image_srcset(path, 'webp')
+    assert '640.webp 640w' in srcset and '1280.webp 1280w' in srcset
+    assert thumbnail_url(path).endswith('/thumb.jpg')
+
+    # Legacy names have no variants and fall back to the original
+    assert image_srcset('products/20240101_photo.jpg') == ''
+    assert thumbnail_url('products/20240101_photo.jpg').endswith('/uploads/products/20240101_photo.jpg')
+    assert thumbnail_url('default.jpg').endswith('/static/uploads/default.jpg')
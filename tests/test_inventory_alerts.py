@@ -0,0 +1,110 @@
+import pytest
+
+from app import create_app, db, mail
+from app import inventory
+from app.admin.stats import compute_stats
+from app.models import Category, LowStockAlert, Product, User
+
+
+@pytest.fixture
+def app_instance():
+    app = create_app()
+    app.config['TESTING'] = True
+    app.config['MAIL_DEFAULT_SENDER'] = 'shop@example.com'
+
+    with app.app_context():
+        db.create_all()
+        db.session.add(Category(name='Teas'))
+        db.session.commit()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def notices(monkeypatch):
+    sent = []
+    monkeypatch.setattr(inventory, 'notify_admins', sent.extend)
+    return sent
+
+
+def _make_product(sku, stock, min_level=5):
+    product = Product(name=sku.title(), price=3, sku=sku, stock_quantity=stock, min_stock_level=min_level,
+                      category_id=Category.query.first().id)
+    db.session.add(product)
+    db.session.commit()
+    return product
+
+
+def _alerts():
+    return {alert.product_id: alert.stock_quantity for alert in LowStockAlert.query}
+
+
+def test_stock_changes_maintain_alerts(app_instance, notices):
+    product = _make_product('tea', 10)
+    assert _alerts() == {} and notices == []
+
+    product.stock_quantity = 3
+    db.session.commit()
+    assert _alerts() == {product.id: 3}
+    assert [n['product_id'] for n in notices] == [product.id]
+
+    # Still low: the row follows the stock level without a second notice
+    product.stock_quantity = 1
+    db.session.commit()
+    assert _alerts() == {product.id: 1}
+    assert len(notices) == 1
+
+    product.is_active = False
+    db.session.commit()
+    assert _alerts() == {}
+
+    product.is_active = True
+    product.stock_quantity = 20
+    db.session.commit()
+    assert _alerts() == {}
+
+
+def test_rolled_back_changes_are_not_announced(app_instance, notices):
+    product = _make_product('tea', 10)
+    product.stock_quantity = 0
+    db.session.flush()
+    db.session.rollback()
+
+    assert _alerts() == {}
+    assert notices == []
+
+
+def test_sync_after_bulk_update(app_instance, notices):
+    low = _make_product('low', 1)
+    ok = _make_product('ok', 10)
+    notices.clear()
+
+    db.session.execute(db.update(Product), [{'id': low.id, 'stock_quantity': 50},
+                                            {'id': ok.id, 'stock_quantity': 0}])
+    LowStockAlert.sync([low.id, ok.id])
+    db.session.commit()
+
+    assert _alerts() == {ok.id: 0}
+    assert [n['product_id'] for n in notices] == [ok.id]
+    stats = compute_stats()
+    assert (stats['low_stock_products'], stats['out_of_stock_products']) == (1, 1)
+
+
+def test_digest_mails_each_alert_once(app_instance, notices, monkeypatch):
+    # Flask-Mail reads TESTING at init time, before the fixture sets it
+    monkeypatch.setattr(app_instance.extensions['mail'], 'suppress', True)
+    admin = User(username='admin', email='admin@example.com', first_name='Ada', last_name='Admin', is_admin=True)
+    admin.set_password('x')
+    db.session.add(admin)
+    _make_product('empty', 0)
+    _make_product('low', 2)
+
+    with mail.record_messages() as outbox:
+        assert inventory.send_digest() == 2
+        assert inventory.send_digest() == 0
+
+    assert len(outbox) == 1
+    assert outbox[0].recipients == ['admin@example.com']
+    assert 'Empty' in outbox[0].body and 'status=low_stock' in outbox[0].body
+    assert LowStockAlert.query.filter(LowStockAlert.notified_at.is_(None)).count() == 0
@@ -0,0 +1,100 @@
+import pytest
+
+from app import create_app, db
+from app.models import Category, Order, OrderItem, Product, User
+
+
+@pytest.fixture
+def app_instance():
+    app = create_app()
+    app.config['TESTING'] = True
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+def _make_user(name):
+    user = User(username=name, email=f'{name}@example.com', first_name=name.title(), last_name='User')
+    user.set_password('x')
+    db.session.add(user)
+    db.session.flush()
+    return user
+
+
+def _make_order(user_id, number, product_id):
+    order = Order(order_number=number, user_id=user_id, subtotal=10, total_amount=12,
+                  shipping_first_name='Test', shipping_last_name='Customer',
+                  shipping_email='cust@example.com', shipping_address='1 Road',
+                  shipping_city='Accra', shipping_country='Ghana')
+    db.session.add(order)
+    db.session.flush()
+    db.session.add(OrderItem(order_id=order.id, product_id=product_id, product_name='Tea', quantity=2, unit_price=5, total_price=10))
+    return order
+
+
+@pytest.fixture
+def client(app_instance):
+    customer = _make_user('cust')
+    other = _make_user('other')
+    category = Category(name='Teas')
+    db.session.add(category)
+    db.session.flush()
+    tea = Product(name='Tea', price=5, category_id=category.id)
+    db.session.add(tea)
+    db.session.flush()
+    for n in range(5):
+        _make_order(customer.id, f'ORD-{n}', tea.id)
+        _make_order(other.id, f'OTHER-{n}', tea.id)
+    db.session.commit()
+
+    client = app_instance.test_client()
+    with client.session_transaction() as sess:
+        sess['_user_id'] = str(customer.id)
+        sess['_fresh'] = True
+    return client
+
+
+def _numbers(data):
+    return [order['order_number'] for order in data['orders']]
+
+
+def test_pages_follow_the_before_cursor(app_instance, client):
+    first = client.get('/auth/api/orders?per_page=2').get_json()
+    assert first['success']
+    assert _numbers(first) == ['ORD-4', 'ORD-3']
+    assert first['orders'][0]['total_items'] == 2
+    assert first['next_before'] == first['orders'][-1]['id']
+
+    second = client.get(f"/auth/api/orders?per_page=2&before={first['next_before']}").get_json()
+    assert _numbers(second) == ['ORD-2', 'ORD-1']
+
+    last = client.get(f"/auth/api/orders?per_page=2&before={second['next_before']}").get_json()
+    assert _numbers(last) == ['ORD-0']
+    assert last['next_before'] is None
+
+
+def test_other_users_orders_do_not_leak(app_instance, client):
+    data = client.get('/auth/api/orders?per_page=50').get_json()
+    assert _numbers(data) == [f'ORD-{n}' for n in range(4, -1, -1)]
+
+    # A cursor taken from someone else's order still only returns our own
+    other_id = Order.query.filter_by(order_number='OTHER-4').one().id
+    data = client.get(f'/auth/api/orders?per_page=50&before={other_id}').get_json()
+    assert all(number.startswith('ORD-') for number in _numbers(data))
+
+
+def test_invalid_before(app_instance, client):
+    # Not a number: ignored, so the first page
+    assert _numbers(client.get('/auth/api/orders?per_page=2&before=abc').get_json()) == ['ORD-4', 'ORD-3']
+    # Nothing is older than id 0
+    data = client.get('/auth/api/orders?before=0').get_json()
+    assert data['orders'] == [] and data['next_before'] is None
+
+
+def test_orders_page_renders(app_instance, client):
+    response = client.get('/auth/orders')
+    assert response.status_code == 200
+    assert b'ORD-4' in response.data
@@ -0,0 +1,91 @@
+import pytest
+
+from app import create_app, db
+from app.models import User, Order, OrderEvent, OrderStatusCount, InvalidOrderTransition
+
+
+@pytest.fixture
+def app_instance():
+    app = create_app()
+    app.config['TESTING'] = True
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+def _make_order(user_id, number):
+    order = Order(
+        order_number=number,
+        user_id=user_id,
+        subtotal=10,
+        total_amount=12,
+        shipping_first_name='Test',
+        shipping_last_name='Customer',
+        shipping_email='cust@example.com',
+        shipping_address='1 Road',
+        shipping_city='Accra',
+        shipping_country='Ghana',
+    )
+    db.session.add(order)
+    db.session.flush()
+    order.record_created()
+    return order
+
+
+@pytest.fixture
+def customer(app_instance):
+    user = User(username='cust', email='cust@example.com', first_name='Test', last_name='Customer')
+    user.set_password('x')
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def test_transition_logs_events_and_updates_counts(app_instance, customer):
+    # Build the counters before any orders exist so bumps are applied incrementally
+    assert OrderStatusCount.counts('status')['pending'] == 0
+
+    first = _make_order(customer.id, 'ORD-1')
+    _make_order(customer.id, 'ORD-2')
+    db.session.commit()
+
+    first.transition(status='confirmed', payment_status='paid', note='test')
+    db.session.commit()
+
+    counts = OrderStatusCount.counts('status')
+    assert counts['pending'] == 1
+    assert counts['confirmed'] == 1
+    assert OrderStatusCount.counts('payment_status')['paid'] == 1
+
+    events = first.events.all()
+    assert [(e.field, e.from_value, e.to_value) for e in events] == [
+        ('status', None, 'pending'),
+        ('payment_status', None, 'pending'),
+        ('status', 'pending', 'confirmed'),
+        ('payment_status', 'pending', 'paid'),
+    ]
+
+
+def test_invalid_transition_leaves_order_untouched(app_instance, customer):
+    order = _make_order(customer.id, 'ORD-1')
+    order.transition(status='cancelled')
+    db.session.commit()
+
+    with pytest.raises(InvalidOrderTransition):
+        order.transition(status='shipped', payment_status='paid')
+
+    assert order.status == 'cancelled'
+    assert order.payment_status == 'pending'
+    assert OrderEvent.query.filter_by(order_id=order.id).count() == 3
+
+
+def test_counts_rebuild_from_existing_orders(app_instance, customer):
+    # Orders created before the counters existed are picked up on first read
+    _make_order(customer.id, 'ORD-1')
+    _make_order(customer.id, 'ORD-2')
+    db.session.commit()
+
+    assert OrderStatusCount.counts('status')['pending'] == 2
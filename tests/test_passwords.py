@@ -0,0 +1,50 @@
+import pytest
+
+from app import create_app, db
+from app.models import User
+
+
+@pytest.fixture
+def app_instance():
+    app = create_app()
+    app.config['TESTING'] = True
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+def test_hash_uses_configured_method(app_instance):
+    user = User(username='cust', email='cust@example.com')
+    user.set_password('secret')
+
+    assert user.password_hash.startswith('pbkdf2:sha256:1000$')
+    assert user.check_password('secret')
+    assert not user.password_needs_rehash()
+
+    app_instance.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:2000'
+    assert user.password_needs_rehash()
+
+
+def test_login_upgrades_outdated_hash(app_instance):
+    user = User(username='cust', email='cust@example.com', first_name='Test', last_name='Customer')
+    user.set_password('secret')
+    db.session.add(user)
+    db.session.commit()
+    user_id = user.id
+    db.session.remove()
+
+    app_instance.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:2000'
+    response = app_instance.test_client().post('/auth/login', data={
+        'email': 'cust@example.com',
+        'password': 'secret',
+    })
+    assert response.status_code == 302
+
+    user = db.session.get(User, user_id)
+    assert user.password_hash.startswith('pbkdf2:sha256:2000$')
+    assert user.check_password('secret')
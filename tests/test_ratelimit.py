@@ -0,0 +1,69 @@
+import pytest
+from sqlalchemy import event
+
+from app import create_app, db
+from app.auth.ratelimit import MemoryBucketStore
+
+
+@pytest.fixture
+def app_instance():
+    app = create_app()
+    app.config['TESTING'] = True
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['RATELIMIT_LOGIN'] = '3/60'
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+def test_bucket_refills_over_time():
+    now = [0.0]
+    store = MemoryBucketStore(clock=lambda: now[0])
+
+    assert store.hit('k', 2, 10) == (True, 0)
+    assert store.hit('k', 2, 10) == (True, 0)
+    assert store.hit('k', 2, 10) == (False, 5)
+
+    now[0] = 5.0
+    assert store.hit('k', 2, 10) == (True, 0)
+    assert store.hit('other', 2, 10) == (True, 0)
+
+
+def test_throttled_login_skips_database(app_instance):
+    client = app_instance.test_client()
+    for _ in range(3):
+        client.post('/auth/login', data={'email': 'who@example.com', 'password': 'nope'})
+
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        response = client.post('/auth/login', data={'email': 'who@example.com', 'password': 'nope'})
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+    assert response.status_code == 302
+    assert int(response.headers['Retry-After']) > 0
+    assert statements == []
+
+
+def test_forwarded_clients_get_separate_ip_buckets(app_instance):
+    client = app_instance.test_client()
+
+    def login(ip, n):
+        # A different email each time, so only the per-IP bucket fills up
+        return client.post('/auth/login', data={'email': f'who{n}@example.com', 'password': 'nope'},
+                           headers={'X-Forwarded-For': ip})
+
+    for n in range(3):
+        assert 'Retry-After' not in login('203.0.113.1', n).headers
+    assert 'Retry-After' in login('203.0.113.1', 3).headers
+
+    # Another client behind the same router is unaffected
+    assert 'Retry-After' not in login('198.51.100.7', 4).headers
@@ -0,0 +1,55 @@
+import logging
+
+from app import create_app
+from app.auth.sms import SmsDispatcher, FakeSmsProvider, get_dispatcher
+
+
+def _dispatcher(*providers, **kwargs):
+    return SmsDispatcher(providers, logging.getLogger('test'), synchronous=True, **kwargs)
+
+
+def test_fails_over_to_next_provider():
+    broken = FakeSmsProvider(fail=True)
+    broken.name = 'broken'
+    backup = FakeSmsProvider()
+    dispatcher = _dispatcher(broken, backup)
+
+    assert dispatcher.enqueue('+233200000000', 'code 123456') == (True, None)
+    assert backup.outbox == [('+233200000000', 'code 123456')]
+
+    stats = dispatcher.stats()['providers']
+    assert stats['broken']['failed'] == 1
+    assert stats['fake']['sent'] == 1
+
+
+def test_circuit_opens_after_repeated_failures():
+    broken = FakeSmsProvider(fail=True)
+    dispatcher = _dispatcher(broken, threshold=2, cooldown=60)
+
+    assert dispatcher.enqueue('+233200000000', 'a')[0] is False
+    assert dispatcher.enqueue('+233200000000', 'b')[0] is False
+    assert dispatcher.stats()['providers']['fake']['circuit_open']
+
+    # With every provider tripped, callers are told immediately instead of queueing
+    assert dispatcher.enqueue('+233200000000', 'c') == (False, 'SMS service temporarily unavailable')
+    assert dispatcher.stats()['providers']['fake']['failed'] == 2
+
+
+def test_background_queue_delivers():
+    app = create_app()
+    app.config['SMS_PROVIDERS'] = 'fake'
+    dispatcher = get_dispatcher(app)
+
+    assert dispatcher.enqueue('+233200000000', 'hello') == (True, None)
+    dispatcher._queue.join()
+    assert dispatcher.providers[0].outbox == [('+233200000000', 'hello')]
+
+
+def test_textbelt_only_when_configured(monkeypatch):
+    for name in ('SMS_PROVIDERS', 'TWILIO_ACCOUNT_SID', 'TWILIO_AUTH_TOKEN', 'TEXTBELT_API_KEY', 'SMS_API_KEY'):
+        monkeypatch.delenv(name, raising=False)
+    # Nothing configured: no providers, so development mode can show the code instead
+    assert not get_dispatcher(create_app()).has_providers()
+
+    monkeypatch.setenv('TEXTBELT_API_KEY', 'textbelt')
+    assert [p.name for p in get_dispatcher(create_app()).providers] == ['textbelt']
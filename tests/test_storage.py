@@ -0,0 +1,125 @@
+import io
+
+import pytest
+from werkzeug.datastructures import FileStorage
+
+from app import create_app, db
+from app.models import StoredBlob, User
+from app.storage import S3Storage, FilesystemS3Client, save_upload, release_upload, get_storage
+
+
+@pytest.fixture(params=['local', 's3'])
+def app_instance(request, tmp_path):
+    app = create_app()
+    app.config['TESTING'] = True
+    app.config['UPLOAD_FOLDER'] = str(tmp_path / 'uploads')
+    if request.param == 's3':
+        app.extensions['storage'] = S3Storage('media', FilesystemS3Client(str(tmp_path / 's3')),
+                                              prefix='uploads', public_url='https://cdn.example.com')
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+def _file(data=b'same bytes', name='a.txt'):
+    return FileStorage(stream=io.BytesIO(data), filename=name)
+
+
+def test_identical_uploads_share_one_blob(app_instance):
+    storage = get_storage()
+    first = save_upload(_file())
+    second = save_upload(_file(name='b.txt'))
+    db.session.commit()
+
+    assert first == second
+    assert StoredBlob.query.one().ref_count == 2
+    assert storage.read_bytes(first) == b'same bytes'
+
+    release_upload(first)
+    db.session.commit()
+    assert storage.exists(first)
+
+    release_upload(second)
+    db.session.commit()
+    assert StoredBlob.query.count() == 0
+    assert not storage.exists(first)
+
+
+def test_rolled_back_release_keeps_file(app_instance):
+    key = save_upload(_file())
+    db.session.commit()
+
+    release_upload(key)
+    db.session.rollback()
+
+    assert get_storage().exists(key)
+    assert StoredBlob.query.one().ref_count == 1
+
+
+def _update_hook(monkeypatch, before_first_update):
+    from sqlalchemy.orm import Query
+
+    original_update = Query.update
+    calls = []
+
+    def update(self, *args, **kwargs):
+        calls.append(True)
+        if len(calls) == 1:
+            return before_first_update(lambda: original_update(self, *args, **kwargs))
+        return original_update(self, *args, **kwargs)
+
+    monkeypatch.setattr(Query, 'update', update)
+
+
+def test_concurrent_first_upload_references_existing_blob(app_instance, monkeypatch):
+    key = save_upload(_file())
+    db.session.commit()
+
+    # The second upload's UPDATE runs before the first one committed, so it matches nothing
+    _update_hook(monkeypatch, lambda update: 0)
+    assert save_upload(_file(name='b.txt')) == key
+    db.session.commit()
+
+    assert StoredBlob.query.one().ref_count == 2
+
+
+def test_upload_racing_a_release_recreates_the_blob_row(app_instance, monkeypatch):
+    key = save_upload(_file())
+    db.session.commit()
+
+    # A concurrent release deletes the row (its file not yet removed) just before our UPDATE
+    def release_then_update(update):
+        StoredBlob.query.delete(synchronize_session=False)
+        return update()
+
+    _update_hook(monkeypatch, release_then_update)
+    assert save_upload(_file(name='b.txt')) == key
+    db.session.commit()
+
+    blob = StoredBlob.query.one()
+    assert (blob.key, blob.ref_count) == (key, 1)
+
+
+def test_deleting_a_user_releases_their_profile_image(app_instance):
+    app_instance.config['WTF_CSRF_ENABLED'] = False
+    admin = User(username='admin', email='admin@example.com', first_name='Ad', last_name='Min', is_admin=True)
+    customer = User(username='cust', email='cust@example.com', first_name='Test', last_name='Customer')
+    for user in (admin, customer):
+        user.set_password('x')
+        db.session.add(user)
+    customer.profile_image = save_upload(_file(b'avatar', 'me.png'))
+    db.session.commit()
+    key, customer_id = customer.profile_image, customer.id
+
+    client = app_instance.test_client()
+    with client.session_transaction() as sess:
+        sess['_user_id'] = str(admin.id)
+        sess['_fresh'] = True
+    client.post(f'/admin/user/{customer_id}/delete')
+
+    assert db.session.get(User, customer_id) is None
+    assert StoredBlob.query.count() == 0
+    assert not get_storage().exists(key)
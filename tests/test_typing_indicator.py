@@ -0,0 +1,135 @@
+import pytest
+
+from app.chat import typing_indicator
+from app.chat.typing_indicator import TypingCoalescer
+
+
+@pytest.fixture
+def emitted(monkeypatch):
+    events = []
+    monkeypatch.setattr(typing_indicator.socketio, 'emit',
+                        lambda name, data, room=None: events.append((name, room, data['is_typing'])))
+    # The sweeper is driven by hand below
+    monkeypatch.setattr(typing_indicator.socketio, 'start_background_task', lambda target: None)
+    return events
+
+
+@pytest.fixture
+def clock():
+    return [100.0]
+
+
+@pytest.fixture
+def typing(clock):
+    return TypingCoalescer(window=1.0, expiry=5.0, clock=lambda: clock[0])
+
+
+def _update(typing, is_typing, typist=7, sid='sid-1'):
+    typing.update('3', typist, is_typing, 'user_typing', {'session_id': '3', 'user_id': typist}, sid=sid)
+
+
+def test_leading_and_trailing_edges(typing, clock, emitted):
+    _update(typing, True)
+    assert emitted == [('user_typing', 'session_3', True)]
+
+    # Stop and start again inside the window: nothing to relay
+    clock[0] += 0.2
+    _update(typing, False)
+    clock[0] += 0.2
+    _update(typing, True)
+    clock[0] += 1
+    typing.sweep()
+    assert len(emitted) == 1
+
+    # A restart inside the window is relayed when the window closes
+    _update(typing, False)
+    assert emitted[-1] == ('user_typing', 'session_3', False)
+    clock[0] += 0.3
+    _update(typing, True)
+    typing.sweep()
+    assert len(emitted) == 2
+    clock[0] += 0.7
+    typing.sweep()
+    assert emitted[-1] == ('user_typing', 'session_3', True)
+    assert typing.stats() == {'typists': 1, 'received': 5, 'emitted': 3}
+
+
+def test_update_after_the_window_replaces_pending_state(typing, clock, emitted):
+    clock[0] = 0.0
+    _update(typing, True)
+    clock[0] = 0.5
+    _update(typing, False)  # Pending until the window closes at t=1
+    clock[0] = 1.05
+    _update(typing, True)  # Past the window, before the sweep: still typing, nothing to relay
+    clock[0] = 1.1
+    typing.sweep()
+    assert emitted == [('user_typing', 'session_3', True)]
+
+
+def test_typing_expires_without_refresh(typing, clock, emitted):
+    _update(typing, True)
+    clock[0] += 4
+    _update(typing, True)
+    clock[0] += 4
+    typing.sweep()
+    assert emitted == [('user_typing', 'session_3', True)]
+
+    clock[0] += 1.5
+    typing.sweep()
+    assert emitted[-1] == ('user_typing', 'session_3', False)
+    clock[0] += 1
+    assert typing.sweep() == 0
+
+
+def test_disconnect_withdraws_typing(typing, clock, emitted):
+    _update(typing, True, typist=7, sid='sid-1')
+    _update(typing, True, typist=8, sid='sid-2')
+    typing.disconnect('sid-1')
+
+    assert emitted == [('user_typing', 'session_3', True), ('user_typing', 'session_3', True),
+                       ('user_typing', 'session_3', False)]
+    assert typing.stats()['typists'] == 1
+
+
+def test_stop_without_start_is_dropped(typing, emitted):
+    _update(typing, False)
+    assert emitted == []
+    assert typing.stats()['typists'] == 0
+
+
+
+def test_failed_emit_does_not_stop_the_sweeper(typing, clock, emitted, monkeypatch):
+    started = []
+    monkeypatch.setattr(typing_indicator.socketio, 'start_background_task', started.append)
+    monkeypatch.setattr(typing_indicator.socketio, 'sleep', lambda seconds: clock.__setitem__(0, clock[0] + 0.5))
+    _update(typing, True)
+    clock[0] += 0.2
+    _update(typing, False)
+
+    def emit(name, data, room=None):
+        raise ConnectionError('message queue unavailable')
+
+    with monkeypatch.context() as patched:
+        patched.setattr(typing_indicator.socketio, 'emit', emit)
+        started[0]()  # The trailing "stopped" fails to send; the sweeper still runs until idle
+    assert typing.stats()['typists'] == 0
+
+    _update(typing, True)
+    assert len(started) == 2
+    assert emitted[-1] == ('user_typing', 'session_3', True)
+
+
+def test_sweeper_that_dies_is_restarted(typing, emitted, monkeypatch):
+    started = []
+    monkeypatch.setattr(typing_indicator.socketio, 'start_background_task', started.append)
+
+    def sleep(seconds):
+        raise RuntimeError('sweeper killed')
+
+    monkeypatch.setattr(typing_indicator.socketio, 'sleep', sleep)
+    _update(typing, True)
+    with pytest.raises(RuntimeError):
+        started[0]()
+
+    _update(typing, True, typist=8)
+    assert len(started) == 2
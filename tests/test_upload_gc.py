@@ -0,0 +1,113 @@
+import io
+import os
+import tempfile
+
+import pytest
+from werkzeug.datastructures import FileStorage
+
+from app import create_app, db
+from app.models import Category, Product, ProductImage
+from app.storage import S3Storage, FilesystemS3Client, save_upload, get_storage
+from app.upload_gc import collect_garbage
+
+
+@pytest.fixture(params=['local', 's3'])
+def app_instance(request, tmp_path):
+    app = create_app()
+    app.config['TESTING'] = True
+    app.config['UPLOAD_FOLDER'] = str(tmp_path / 'uploads')
+    if request.param == 's3':
+        app.extensions['storage'] = S3Storage('media', FilesystemS3Client(str(tmp_path / 's3')),
+                                              prefix='uploads', public_url='https://cdn.example.com')
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+def _put(storage, key, data=b'x'):
+    with tempfile.NamedTemporaryFile() as f:
+        f.write(data)
+        f.flush()
+        storage.put_file(key, f.name)
+
+
+@pytest.fixture
+def catalog(app_instance):
+    storage = get_storage()
+    blob = save_upload(FileStorage(stream=io.BytesIO(b'img'), filename='a.jpg'))
+    sha = os.path.splitext(os.path.basename(blob))[0]
+    _put(storage, f'variants/{sha[:2]}/{sha}/w320.webp')
+    _put(storage, f'variants/{sha[:2]}/{sha}/manifest.json', b'{"files": ["w320.webp"]}')
+    _put(storage, 'products/legacy.jpg')
+    _put(storage, 'products/stray.jpg')
+    _put(storage, 'variants/00/' + '0' * 64 + '/w320.webp')
+
+    category = Category(name='Teas', image='categories/gone.jpg')
+    db.session.add(category)
+    db.session.flush()
+    product = Product(name='Tea', price=1, category_id=category.id)
+    db.session.add(product)
+    db.session.flush()
+    db.session.add_all([
+        ProductImage(product_id=product.id, image_url=blob),
+        ProductImage(product_id=product.id, image_url='products/legacy.jpg'),
+        ProductImage(product_id=product.id, image_url='products/missing.jpg'),
+    ])
+    db.session.commit()
+    return storage
+
+
+def _keys(storage):
+    return [key for key, _ in storage.list_keys()]
+
+
+def test_report_finds_orphans_and_missing_files(catalog):
+    orphans, missing = [], []
+    summary = collect_garbage(min_age=0, on_orphan=orphans.append,
+                              on_missing=lambda key, labels: missing.append((key, labels)))
+
+    assert orphans == ['products/stray.jpg', 'variants/00/' + '0' * 64 + '/w320.webp']
+    assert missing == [('categories/gone.jpg', {'category'}),
+                       ('products/missing.jpg', {'product_image'})]
+    assert summary['deleted'] == 0 and summary['checkpoint'] is None
+    assert 'products/stray.jpg' in _keys(catalog)
+
+
+def test_delete_removes_only_orphans(catalog):
+    before = _keys(catalog)
+    summary = collect_garbage(delete=True, batch_size=1, min_age=0)
+
+    assert summary['deleted'] == 2
+    assert _keys(catalog) == [k for k in before
+                              if k != 'products/stray.jpg' and not k.startswith('variants/00/')]
+
+
+def test_recent_files_are_left_alone(catalog):
+    summary = collect_garbage(delete=True, min_age=3600)
+    assert summary['orphans'] == 0 and summary['skipped_recent'] == 2
+    assert 'products/stray.jpg' in _keys(catalog)
+
+
+def test_incremental_runs_cover_everything_once(catalog):
+    orphans = []
+    checkpoint, runs = '', 0
+    while True:
+        summary = collect_garbage(limit=1, start_after=checkpoint, min_age=0, on_orphan=orphans.append)
+        runs += 1
+        if summary['checkpoint'] is None:
+            break
+        checkpoint = summary['checkpoint']
+
+    assert runs > 3
+    assert orphans == ['products/stray.jpg', 'variants/00/' + '0' * 64 + '/w320.webp']
+
+
+def test_listing_is_in_string_order(app_instance):
+    storage = get_storage()
+    for key in ('a/x', 'a-b/x', 'a.jpg', 'ab'):
+        _put(storage, key)
+    assert _keys(storage) == sorted(['a/x', 'a-b/x', 'a.jpg', 'ab'])
+    assert [k for k, _ in storage.list_keys('a.jpg')] == ['a/x', 'ab']
@@ -0,0 +1,91 @@
+import pytest
+from sqlalchemy import event
+
+from app import create_app, db, load_user
+from app.admin.bulk import set_users_active
+from app.models import User
+
+
+@pytest.fixture
+def app_instance():
+    app = create_app()
+    app.config['TESTING'] = True
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def user_id(app_instance):
+    user = User(username='cust', email='cust@example.com', first_name='Test', last_name='Customer')
+    user.set_password('secret')
+    db.session.add(user)
+    db.session.commit()
+    user_id = user.id
+    db.session.remove()
+    return user_id
+
+
+def _count_user_selects(app):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT') and 'FROM user' in statement:
+            statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    return statements, lambda: event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def test_cached_identity_skips_database(app_instance, user_id):
+    assert load_user(str(user_id)).first_name == 'Test'
+    db.session.remove()
+
+    statements, stop = _count_user_selects(app_instance)
+    try:
+        user = load_user(str(user_id))
+        assert user.username == 'cust'
+        assert user.is_admin is False
+        assert statements == []
+
+        # Deferred columns still load on demand from the attached instance
+        assert user.check_password('secret')
+        assert len(statements) == 1
+    finally:
+        stop()
+
+
+def test_update_invalidates_cached_identity(app_instance, user_id):
+    user = load_user(str(user_id))
+    user.first_name = 'Renamed'
+    db.session.commit()
+    db.session.remove()
+
+    assert load_user(str(user_id)).first_name == 'Renamed'
+
+
+@pytest.mark.parametrize('change', ['orm', 'bulk'])
+def test_identity_is_dropped_when_the_change_commits(app_instance, user_id, change):
+    load_user(str(user_id))
+    db.session.remove()
+    key = f'user_identity:{user_id}'
+
+    if change == 'orm':
+        db.session.get(User, user_id).is_active = False
+    else:
+        set_users_active([user_id], False)
+    db.session.flush()
+    # Dropping it now would let a request re-cache the old row before the commit
+    assert app_instance.cache_get(key)['is_active'] is True
+
+    db.session.commit()
+    assert app_instance.cache_get(key) is None
+    db.session.remove()
+    assert load_user(str(user_id)).is_active is False
+
+
+def test_missing_user_returns_none(app_instance, user_id):
+    assert load_user('9999') is None
@@ -0,0 +1,103 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import create_app, db
+from app.auth import verification
+from app.models import BackupCode, User, VerificationCode
+
+
+@pytest.fixture
+def app_instance():
+    app = create_app()
+    app.config['TESTING'] = True
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def user(app_instance):
+    user = User(username='cust', email='cust@example.com', first_name='Test', last_name='Customer',
+                phone='+233200000000')
+    user.set_password('x')
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def test_code_is_hashed_and_single_use(app_instance, user):
+    code = verification.issue_code(user, verification.PURPOSE_PASSWORD_RESET)
+    db.session.commit()
+
+    row = VerificationCode.query.one()
+    assert code not in row.code_hash
+
+    assert verification.consume_code(verification.PURPOSE_PASSWORD_RESET, code, phone=user.phone) == user.id
+    assert verification.consume_code(verification.PURPOSE_PASSWORD_RESET, code, phone=user.phone) is None
+    # Codes are scoped to their purpose
+    code = verification.issue_code(user, verification.PURPOSE_PASSWORD_RESET)
+    assert verification.consume_code(verification.PURPOSE_PHONE_VERIFY, code, user_id=user.id) is None
+
+
+def test_code_locks_after_too_many_attempts(app_instance, user):
+    code = verification.issue_code(user, verification.PURPOSE_PHONE_VERIFY)
+    db.session.commit()
+
+    for _ in range(verification.MAX_ATTEMPTS):
+        wrong = '000000' if code != '000000' else '111111'
+        assert verification.consume_code(verification.PURPOSE_PHONE_VERIFY, wrong, user_id=user.id) is None
+
+    assert not verification.has_pending_code(verification.PURPOSE_PHONE_VERIFY, user_id=user.id)
+    assert verification.consume_code(verification.PURPOSE_PHONE_VERIFY, code, user_id=user.id) is None
+
+
+def test_purge_expired(app_instance, user):
+    verification.issue_code(user, verification.PURPOSE_PHONE_VERIFY)
+    verification.issue_code(user, verification.PURPOSE_PASSWORD_RESET)
+    VerificationCode.query.filter_by(purpose=verification.PURPOSE_PHONE_VERIFY).update(
+        {VerificationCode.expires_at: datetime.utcnow() - timedelta(minutes=1)})
+    db.session.commit()
+
+    assert verification.purge_expired() == 1
+    assert VerificationCode.query.count() == 1
+
+
+def test_backup_codes_are_single_use(app_instance, user):
+    codes = user.generate_backup_codes()
+    db.session.commit()
+
+    assert user.get_remaining_backup_codes() == 10
+    assert user.verify_backup_code(codes[0].lower())
+    assert not user.verify_backup_code(codes[0])
+    assert user.get_remaining_backup_codes() == 9
+
+    # Regenerating invalidates the old set
+    user.generate_backup_codes()
+    db.session.commit()
+    assert not user.verify_backup_code(codes[1])
+    assert user.get_remaining_backup_codes() == 10
+
+
+def test_deleting_a_user_removes_their_backup_codes(app_instance, user):
+    db.session.execute(db.text('PRAGMA foreign_keys=ON'))
+    user.generate_backup_codes()
+    db.session.commit()
+
+    db.session.delete(user)
+    db.session.commit()
+    assert BackupCode.query.count() == 0
+
+
+def test_deleting_a_user_removes_their_verification_codes(app_instance, user):
+    db.session.execute(db.text('PRAGMA foreign_keys=ON'))
+    verification.issue_code(user, verification.PURPOSE_PHONE_VERIFY)
+    verification.issue_code(user, verification.PURPOSE_PASSWORD_RESET)
+    db.session.commit()
+
+    db.session.delete(user)
+    db.session.commit()
+    assert VerificationCode.query.count() == 0